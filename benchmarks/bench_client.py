@@ -0,0 +1,309 @@
+#
+# mdx REST Client のクライアント側のオーバーヘッドの計測
+#
+# MdxSimulator (プロセス内、または --transport http の場合はHTTPサーバ) に対して操作を実行し、
+# 論理操作あたりのAPI呼び出し数と所要時間、ページ取得のスループット、一覧のJSONのデコード時間、
+# スナップショット(全仮想マシンの詳細情報)の取得、mdx.mdx_ext の import 時間を計測して JSON で出力する。
+#
+#   python benchmarks/bench_client.py --sizes 10,100,1000 --output bench.json
+#   python benchmarks/bench_client.py --baseline bench.json   # API呼び出し数の増加を検出する
+#   python benchmarks/bench_client.py --import-only            # import 時間のみ計測する
+#
+import argparse
+import datetime
+import json
+import platform
+import re
+import subprocess
+import sys
+import time
+
+from mdx.mdx_ext import MdxResourceExt
+from mdx.mdx_simulator import MdxSimulator, SimulatorServer
+from mdx.mdx_wait import PollingPolicy
+
+DEFAULT_SIZES = (10, 100, 1000)
+# 時間の計測を繰り返す回数 (最小値を採用する)
+DEFAULT_REPEAT = 3
+# import 時間の計測を繰り返す回数
+IMPORT_REPEAT = 5
+# --baseline と比較して、所要時間の増加を回帰とみなす倍率
+WALL_TIME_TOLERANCE = 1.5
+# 一覧の取得などでは読み込まれないはずのモジュール
+DEFERRED_MODULES = ("jsonschema", "pexpect", "sqlite3", "http.server")
+
+VM_SPEC = {
+    "catalog": "catalog",
+    "template_name": "template",
+    "pack_type": "cpu",
+    "pack_num": 1,
+    "gpu": "0",
+    "disk_size": 40,
+    "network_adapters": [{"adapter_number": 1, "segment": None}],
+    "storage_network": "portgroup",
+    "shared_key": "ssh-ed25519 AAAA bench",
+}
+
+
+class Bench(object):
+    """
+    計測対象のシミュレータとクライアントの組
+    """
+
+    def __init__(self, vm_count, transport):
+        # 状態遷移を即時とし、待ち合わせの確認間隔を短くしてクライアント側の処理時間を計測する
+        self.simulator = MdxSimulator(vm_count=vm_count, deploy_delay_sec=0, clone_delay_sec=0,
+                                      power_delay_sec=0, destroy_delay_sec=0,
+                                      ip_assign_delay_sec=0)
+        self._server = None
+        endpoint_options = {}
+        if transport == "http":
+            self._server = SimulatorServer(self.simulator)
+            self._server.start()
+            endpoint_options["endpoint"] = self._server.endpoint
+        policy = PollingPolicy(initial_interval_sec=0.01, max_interval_sec=0.05, jitter=0,
+                               learn=False)
+        self.mdx = MdxResourceExt(self.simulator.issue_token(), polling_policy=policy,
+                                  **endpoint_options)
+        if transport != "http":
+            self.simulator.attach(self.mdx)
+        self.mdx.set_current_project_by_name(self.simulator.project_name)
+        self.segment_id = self.mdx.get_segments()[0]["uuid"]
+
+    def close(self):
+        self.mdx.close()
+        if self._server is not None:
+            self._server.stop()
+
+    def measure(self, func):
+        """
+        func() を実行し、(API呼び出し数, 呼び出し毎の内訳, 所要時間(秒), func の返り値) を返す
+        """
+        self.simulator.reset_request_counts()
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        counts = self.simulator.get_request_counts()
+        return sum(counts.values()), counts, elapsed, result
+
+
+def _result(name, vm_count, transport, requests=None, breakdown=None, wall_sec=None, **extra):
+    result = {"name": name, "vm_count": vm_count, "transport": transport}
+    if requests is not None:
+        result["requests"] = requests
+        result["requests_breakdown"] = breakdown
+    if wall_sec is not None:
+        result["wall_sec"] = wall_sec
+    result.update(extra)
+    return result
+
+
+def bench_name_lookup(vm_count, transport, repeat):
+    bench = Bench(vm_count, transport)
+    try:
+        vm_name = "vm-{:04d}".format(vm_count)
+        results = []
+        # 索引なし: 一覧を走査して仮想マシン名を解決する
+        best = None
+        for _ in range(repeat):
+            bench.mdx.invalidate_vm_index()
+            measured = bench.measure(lambda: bench.mdx.get_vm_info(vm_name))
+            if best is None or measured[2] < best[2]:
+                best = measured
+        results.append(_result("name_lookup_cold", vm_count, transport, *best[:3]))
+        # 索引あり
+        best = None
+        for _ in range(repeat):
+            measured = bench.measure(lambda: bench.mdx.get_vm_info(vm_name))
+            if best is None or measured[2] < best[2]:
+                best = measured
+        results.append(_result("name_lookup_warm", vm_count, transport, *best[:3]))
+        return results
+    finally:
+        bench.close()
+
+
+def bench_power_cycle(vm_count, transport, repeat):
+    bench = Bench(vm_count, transport)
+    try:
+        vm_name = "vm-0001"
+        bench.mdx.get_vm_info(vm_name)
+        single = bench.measure(lambda: (bench.mdx.power_off_vm(vm_name),
+                                        bench.mdx.power_on_vm(vm_name)))
+        vm_names = ["vm-{:04d}".format(i + 1) for i in range(vm_count)]
+        fleet = bench.measure(lambda: (bench.mdx.power_off_vms(vm_names),
+                                       bench.mdx.power_on_vms(vm_names)))
+        return [
+            _result("power_cycle", vm_count, transport, *single[:3]),
+            _result("power_cycle_fleet", vm_count, transport, *fleet[:3]),
+        ]
+    finally:
+        bench.close()
+
+
+def bench_ranged_deploy(vm_count, transport, repeat):
+    bench = Bench(0, transport)
+    try:
+        spec = json.loads(json.dumps(VM_SPEC))
+        spec["network_adapters"][0]["segment"] = bench.segment_id
+        vm_name = "bench-[1-{}]".format(vm_count)
+        requests, breakdown, elapsed, vms = bench.measure(lambda: bench.mdx.deploy_vm(vm_name, spec))
+        return [_result("ranged_deploy", vm_count, transport, requests, breakdown, elapsed,
+                        deployed=len(vms))]
+    finally:
+        bench.close()
+
+
+def bench_page_iteration(vm_count, transport, repeat):
+    bench = Bench(vm_count, transport)
+    try:
+        best = None
+        for _ in range(repeat):
+            measured = bench.measure(lambda: sum(1 for _ in bench.mdx.vm_info_iter()))
+            if best is None or measured[2] < best[2]:
+                best = measured
+        requests, breakdown, elapsed, items = best
+        return [_result("page_iteration", vm_count, transport, requests, breakdown, elapsed,
+                        items=items, items_per_sec=items / elapsed if elapsed > 0 else None)]
+    finally:
+        bench.close()
+
+
+def bench_snapshot(vm_count, transport, repeat):
+    bench = Bench(vm_count, transport)
+    try:
+        requests, breakdown, elapsed, inventory = bench.measure(lambda: bench.mdx.snapshot())
+        results = [_result("snapshot", vm_count, transport, requests, breakdown, elapsed,
+                           fetched=inventory.fetched)]
+        # 状態が変わらなければ一覧の取得のみとなる
+        requests, breakdown, elapsed, inventory = bench.measure(
+            lambda: bench.mdx.snapshot(previous=inventory))
+        results.append(_result("snapshot_incremental", vm_count, transport, requests, breakdown,
+                               elapsed, fetched=inventory.fetched))
+        return results
+    finally:
+        bench.close()
+
+
+def bench_json_decode(vm_count, repeat):
+    simulator = MdxSimulator(vm_count=vm_count)
+    response = simulator.handle("GET", "/api/vm/project/{}/".format(simulator.project_id),
+                                {"page": 1, "page_size": vm_count},
+                                headers={"Authorization": "JWT " + simulator.issue_token()})
+    content = response.content()
+    best = None
+    for _ in range(max(repeat, 5)):
+        started = time.perf_counter()
+        json.loads(content)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return [_result("json_decode_vm_list", vm_count, "none", wall_sec=best, bytes=len(content),
+                    mb_per_sec=len(content) / best / 1e6 if best > 0 else None)]
+
+
+def bench_import_time(module="mdx.mdx_ext"):
+    """
+    新しいインタプリタで module を import する時間を -X importtime で計測し、
+    DEFERRED_MODULES のうち import 時に読み込まれたものを調べる
+    """
+    best = None
+    pattern = re.compile(r"import time:\s+\d+\s+\|\s+(\d+)\s+\|\s+(\S+)")
+    for _ in range(IMPORT_REPEAT):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                              capture_output=True, text=True, check=True)
+        for line in proc.stderr.splitlines():
+            match = pattern.match(line)
+            if match and match.group(2) == module:
+                cumulative = int(match.group(1)) / 1e6
+                best = cumulative if best is None else min(best, cumulative)
+    proc = subprocess.run(
+        [sys.executable, "-c",
+         "import sys, json, {}; print(json.dumps([m for m in {!r} if m in sys.modules]))".format(
+             module, DEFERRED_MODULES)],
+        capture_output=True, text=True, check=True)
+    return [_result("import_time", None, "none", wall_sec=best, module=module,
+                    loaded_deferred_modules=json.loads(proc.stdout))]
+
+
+def run(sizes, transport, repeat, import_only=False):
+    results = []
+    if import_only:
+        sizes = []
+    for vm_count in sizes:
+        results += bench_name_lookup(vm_count, transport, repeat)
+        results += bench_power_cycle(vm_count, transport, repeat)
+        results += bench_ranged_deploy(vm_count, transport, repeat)
+        results += bench_page_iteration(vm_count, transport, repeat)
+        results += bench_snapshot(vm_count, transport, repeat)
+        results += bench_json_decode(vm_count, repeat)
+    results += bench_import_time()
+    return {
+        "meta": {
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "transport": transport,
+            "sizes": list(sizes),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline):
+    """
+    baseline と比較し、API呼び出し数の増加と所要時間の大幅な増加を回帰として返す
+    """
+    def key(result):
+        return (result["name"], result["vm_count"], result["transport"])
+
+    base = {key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = base.get(key(result))
+        if old is None:
+            continue
+        if "requests" in result and "requests" in old and result["requests"] > old["requests"]:
+            regressions.append("{} (vm_count={}): requests {} -> {}".format(
+                result["name"], result["vm_count"], old["requests"], result["requests"]))
+        if result.get("loaded_deferred_modules"):
+            regressions.append("{}: loads {} at import".format(
+                result["module"], ", ".join(result["loaded_deferred_modules"])))
+        if (result.get("wall_sec") and old.get("wall_sec")
+                and result["wall_sec"] > old["wall_sec"] * WALL_TIME_TOLERANCE):
+            regressions.append("{} (vm_count={}): wall_sec {:.4f} -> {:.4f}".format(
+                result["name"], result["vm_count"], old["wall_sec"], result["wall_sec"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="mdx REST client overhead benchmark")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="comma separated VM counts")
+    parser.add_argument("--transport", choices=("inprocess", "http"), default="inprocess")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--output", help="write the JSON report to this file (default: stdout)")
+    parser.add_argument("--baseline", help="compare with a previous JSON report")
+    parser.add_argument("--import-only", action="store_true", help="measure import time only")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    report = run(sizes, args.transport, args.repeat, args.import_only)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f))
+        for regression in regressions:
+            print("regression: {}".format(regression), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,6 @@
-from importlib.metadata import version
-
-__version__ = version("mdx")
\ No newline at end of file
+def __getattr__(name):
+    # パッケージのメタデータの検索は、__version__ を参照した時にのみ行う
+    if name == "__version__":
+        from importlib.metadata import version
+        return version("mdx")
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
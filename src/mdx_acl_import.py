@@ -0,0 +1,184 @@
+#
+# mdx Allow ACL の一括登録のためのファイルの読み込みと結果の出力
+#
+import csv
+import json
+import os
+
+from .mdx_reconcile import ACL_RULE_FIELDS
+
+# ファイルの拡張子→形式
+ACL_IMPORT_FORMATS = {
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".json": "jsonl",
+}
+# 結果のレポートの列
+ACL_IMPORT_REPORT_COLUMNS = ("row", "result", "kind", "segment", "id", "error") + ACL_RULE_FIELDS
+
+
+class AclRuleError(ValueError):
+    """
+    ACLのルールとして解釈できない行
+    """
+
+
+def _detect_format(path, format):
+    if format is not None:
+        return format
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in ACL_IMPORT_FORMATS:
+        raise ValueError("unknown acl rule file format: {}".format(path))
+    return ACL_IMPORT_FORMATS[ext]
+
+
+def read_acl_rows(source, format=None):
+    """
+    CSV または JSON Lines のファイルから、ACLのルールを1行ずつ読み込むジェネレータ。
+
+    CSV は1行目を見出し (segment, src_address, src_mask, src_port, dst_address, dst_mask, dst_port, protocol)
+    とする。JSON Lines は1行に1つのルールのオブジェクトを記述し、空行と "#" で始まる行は読み飛ばす。
+
+    :param source: ファイルのパス、またはファイルオブジェクト
+    :param format: "csv" または "jsonl"。省略時はファイルの拡張子から判定する
+    :returns: (行番号, ルールのdict) のタプルを返すジェネレータ。JSONとして解釈できない行は
+      ルールの代わりに AclRuleError を返す
+    """
+    if isinstance(source, (str, os.PathLike)):
+        format = _detect_format(os.fspath(source), format)
+        with open(source, encoding="utf-8-sig", newline="") as f:
+            yield from read_acl_rows(f, format)
+        return
+    if format is None:
+        raise ValueError("format is required for file objects")
+
+    if format == "csv":
+        reader = csv.DictReader(source)
+        for row in reader:
+            yield reader.line_num, {k.strip(): v for k, v in row.items() if k is not None}
+        return
+
+    for row_number, line in enumerate(source, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            rule = json.loads(line)
+        except ValueError as e:
+            yield row_number, AclRuleError("invalid json: {}".format(e))
+            continue
+        if not isinstance(rule, dict):
+            yield row_number, AclRuleError("a rule must be a json object")
+            continue
+        yield row_number, rule
+
+
+def _empty(value):
+    return value is None or str(value).strip() == ""
+
+
+def _parse_address(ipaddress, rule, field, mask_field):
+    value = str(rule.get(field, "")).strip()
+    if _empty(value):
+        raise AclRuleError("{} is required".format(field))
+    mask = rule.get(mask_field)
+    try:
+        if "/" in value:
+            # CIDR表記の場合はマスクを分けて扱う
+            if not _empty(mask):
+                raise AclRuleError("{} is given both as cidr and {}".format(field, mask_field))
+            interface = ipaddress.ip_interface(value)
+            return interface.ip, interface.network.prefixlen
+        address = ipaddress.ip_address(value)
+    except ValueError as e:
+        raise AclRuleError(str(e)) from e
+    if _empty(mask):
+        return address, address.max_prefixlen
+    mask = str(mask).strip()
+    if mask.isdigit():
+        prefixlen = int(mask)
+    else:
+        # 255.255.255.0 のようなネットマスク表記
+        try:
+            prefixlen = ipaddress.ip_network("0.0.0.0/{}".format(mask)).prefixlen
+        except ValueError as e:
+            raise AclRuleError("invalid {}: {}".format(mask_field, mask)) from e
+    if prefixlen > address.max_prefixlen:
+        raise AclRuleError("invalid {}: {}".format(mask_field, mask))
+    return address, prefixlen
+
+
+def normalize_acl_rule(rule, segment_id=None):
+    """
+    ACLのルールのアドレスとマスクを ipaddress で解釈して正規化し、IPv4/IPv6のどちらのルールかを判定する。
+
+    アドレスは "10.0.0.0/24" のようなCIDR表記でもよく、マスクはプレフィックス長とネットマスク表記の
+    どちらでもよい。マスクを省略した場合は単一のアドレスとする。ポートを省略した場合は "Any" とする。
+
+    :param rule: ルールのdict
+    :param segment_id: rule に segment がない場合に使用するネットワークセグメントID
+    :returns: ("acl_ipv4" または "acl_ipv6", add_allow_acl_ipv4_info() などに渡す仕様) のタプル
+    :raises AclRuleError: ルールとして解釈できない場合
+    """
+    # ipaddress はルールを解釈する時にのみ読み込む
+    import ipaddress
+    segment = rule.get("segment")
+    if _empty(segment):
+        segment = segment_id
+    if _empty(segment):
+        raise AclRuleError("segment is required")
+    src_address, src_mask = _parse_address(ipaddress, rule, "src_address", "src_mask")
+    dst_address, dst_mask = _parse_address(ipaddress, rule, "dst_address", "dst_mask")
+    if src_address.version != dst_address.version:
+        raise AclRuleError("src_address and dst_address must be the same ip version")
+    protocol = rule.get("protocol")
+    if _empty(protocol):
+        raise AclRuleError("protocol is required")
+    spec = {
+        "segment": str(segment).strip(),
+        "src_address": src_address.compressed,
+        "src_mask": str(src_mask),
+        "src_port": "Any" if _empty(rule.get("src_port")) else str(rule["src_port"]).strip(),
+        "dst_address": dst_address.compressed,
+        "dst_mask": str(dst_mask),
+        "dst_port": "Any" if _empty(rule.get("dst_port")) else str(rule["dst_port"]).strip(),
+        "protocol": str(protocol).strip(),
+    }
+    return "acl_ipv{}".format(src_address.version), spec
+
+
+def write_acl_import_report(results, destination, format=None):
+    """
+    一括登録の行毎の結果を CSV または JSON Lines で出力する
+
+    :param results: MdxResourceExt.import_acl_rules() の返り値
+    :param destination: ファイルのパス、またはファイルオブジェクト
+    :param format: "csv" または "jsonl"。省略時はファイルの拡張子から判定する
+    """
+    if isinstance(destination, (str, os.PathLike)):
+        format = _detect_format(os.fspath(destination), format)
+        with open(destination, "w", encoding="utf-8", newline="") as f:
+            write_acl_import_report(results, f, format)
+        return
+    if format is None:
+        raise ValueError("format is required for file objects")
+
+    rows = []
+    for result in results:
+        row = {column: result.get(column) for column in ("row", "result", "kind", "id")}
+        row["error"] = None if result.get("error") is None else str(result["error"])
+        spec = result.get("spec") or {}
+        row["segment"] = spec.get("segment")
+        for field in ACL_RULE_FIELDS:
+            row[field] = spec.get(field)
+        rows.append(row)
+
+    if format == "csv":
+        writer = csv.DictWriter(destination, fieldnames=ACL_IMPORT_REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+        return
+    for row in rows:
+        destination.write(json.dumps(row, ensure_ascii=False) + "\n")
+
@@ -0,0 +1,1270 @@
+#
+# mdx asyncio client
+#
+import asyncio
+import collections
+import contextvars
+import copy
+import functools
+import itertools
+import json
+import logging
+import re
+import time
+import urllib
+
+import aiohttp
+
+from .mdx_history import HISTORY_SYNC_PAGE_SIZE, HistoryPageSelector
+from .mdx_metrics import MdxMetrics, normalize_endpoint
+from .mdx_trace import NOOP_TRACER, traced, traced_iter
+from .mdx_lib import (
+    IDEMPOTENT_METHODS,
+    MdxRestException,
+    MdxTimeoutException,
+    MdxTokenManager,
+    RetryPolicy,
+    _parse_retry_after,
+    DEFAULT_CONNECT_TIMEOUT_SEC,
+    DEFAULT_MDX_ENDPOINT,
+    DEFAULT_POOL_MAXSIZE,
+    DEFAULT_READ_TIMEOUT_SEC,
+    DEFAULT_TOKEN_REFRESH_MARGIN_SEC,
+    TASK_CORRELATION_INTERVAL_SEC,
+    TASK_CORRELATION_RETRY,
+    bounded_delay,
+    current_deadline,
+    deadline_scope,
+    reserve_rate_limit,
+)
+from .mdx_ext import (
+    PAGE_MAX_WORKERS,
+    PAGE_SNAPSHOT_RETRY,
+    VM_NAME_INDEX_TTL_SEC,
+    VmNameIndex,
+    _check_destroyable,
+    _clone_spec,
+    _deploy_spec,
+    _destroy_error,
+    _find_project_id,
+    _is_stale_vm_info,
+    _index_deployed_vms,
+    _power_operation_target,
+    _ready_vm_result,
+    _watch_ready_vms,
+    default_polling_policy,
+)
+from .mdx_validate import validate_spec, validate_specs
+from .mdx_wait import LIST_PAGE_SIZE, VM_NOT_FOUND, BaseVmStateWaiter
+
+# コネクションプール全体で保持するコネクション数の上限
+DEFAULT_ASYNC_POOL_LIMIT = 100
+# keep-aliveしたコネクションを保持する秒数
+DEFAULT_KEEPALIVE_TIMEOUT_SEC = 30
+
+logger = logging.getLogger(__name__)
+
+
+async def _aiter_pages(fetch_page, page_size, consistent=False, max_workers=PAGE_MAX_WORKERS):
+    """
+    ページ分割されたAPIの結果を順に返す非同期イテレータ。mdx_ext._iter_pages() のasyncio版で、
+    2ページ目以降は最大 max_workers 並行で取得する。
+    """
+    if consistent:
+        for item in await _fetch_consistent_pages(fetch_page, page_size, max_workers):
+            yield item
+        return
+    first = await fetch_page(1, page_size)
+    for item in first["results"]:
+        yield item
+    if first["next"] is None:
+        return
+    pages = _fetch_rest_pages(fetch_page, page_size, first, max_workers)
+    try:
+        async for page in pages:
+            for item in page["results"]:
+                yield item
+    finally:
+        await pages.aclose()
+
+
+async def _fetch_rest_pages(fetch_page, page_size, first, max_workers):
+    """
+    2ページ目以降を並行に取得し、ページ順に返す非同期イテレータ。
+
+    先読みするページは max_workers 件までとし、呼び出し側が途中で打ち切った場合は取得中のページを
+    キャンセルする。
+    """
+    last_page = max(2, -(-first["count"] // page_size))
+    page_numbers = iter(range(2, last_page + 1))
+    window = collections.deque(
+        asyncio.ensure_future(_fetch_page_or_none(fetch_page, page_number, page_size))
+        for page_number in itertools.islice(page_numbers, max_workers))
+    try:
+        page = None
+        while window:
+            page = await window.popleft()
+            if page is None:
+                # 取得中に件数が減ってページがなくなった
+                return
+            page_number = next(page_numbers, None)
+            if page_number is not None:
+                window.append(asyncio.ensure_future(
+                    _fetch_page_or_none(fetch_page, page_number, page_size)))
+            yield page
+    finally:
+        for task in window:
+            task.cancel()
+        if window:
+            await asyncio.gather(*window, return_exceptions=True)
+    current_page = last_page
+    while page["next"] is not None:
+        current_page += 1
+        page = await _fetch_page_or_none(fetch_page, current_page, page_size)
+        if page is None:
+            return
+        yield page
+
+
+async def _fetch_consistent_pages(fetch_page, page_size, max_workers):
+    """
+    mdx_ext._fetch_consistent_pages() のasyncio版。
+    """
+    items = []
+    for i in range(PAGE_SNAPSHOT_RETRY):
+        first = await fetch_page(1, page_size)
+        pages = [first]
+        if first["next"] is not None:
+            pages.extend([page async for page in
+                          _fetch_rest_pages(fetch_page, page_size, first, max_workers)])
+        counts = set(page["count"] for page in pages)
+        items = [item for page in pages for item in page["results"]]
+        uuids = set(item["uuid"] for item in items)
+        if len(counts) == 1 and len(items) == len(uuids) == first["count"]:
+            return items
+        logger.debug("pages are changed while fetching: retry {}".format(i))
+    logger.warning("pages are changed while fetching, duplicated items are removed")
+    seen = set()
+    unique_items = []
+    for item in items:
+        if item["uuid"] not in seen:
+            seen.add(item["uuid"])
+            unique_items.append(item)
+    return unique_items
+
+
+async def _to_thread(func, *args):
+    """
+    ブロックする関数を別スレッドで実行する。asyncio.to_thread() (Python 3.9以降) がない場合は
+    既定のexecutorで実行する。
+    """
+    if hasattr(asyncio, "to_thread"):
+        return await asyncio.to_thread(func, *args)
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, functools.partial(context.run, func, *args))
+
+
+async def _fetch_page_or_none(fetch_page, page, page_size):
+    try:
+        return await fetch_page(page, page_size)
+    except MdxRestException as e:
+        if e.status_code == 404:
+            return None
+        raise
+
+
+class AsyncMdxResponse(object):
+    """
+    aiohttpのレスポンスを読み込んだ結果。requests.Response と同じ属性でアクセスできる。
+    """
+
+    def __init__(self, status_code, text, headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers if headers is not None else {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncMdxLib(object):
+    """
+    mdxのREST APIに対応したasyncio版pythonライブラリ
+
+    MdxLib と同じAPIをコルーチンとして提供する。HTTPコネクションは1つの aiohttp.ClientSession で
+    プールされ、全てのAPI呼び出しで共有される。使用後は close() を呼ぶか、async with文で使用すること。
+
+    :param endpoint: mdx REST API エンドポイント URL
+    :param init_token: mdx REST API 認証トークン
+    :param pool_limit: コネクションプール全体で保持するコネクション数の上限
+    :param pool_maxsize: ホスト毎に保持するコネクション数の上限
+    :param keepalive_timeout: keep-aliveしたコネクションを保持する秒数
+    :param token_refresh_margin_sec: トークンの有効期限の何秒前からリフレッシュするか
+    :param session: 共有する aiohttp.ClientSession (オプショナル)。指定した場合、close() では閉じない。
+    :param retry_policy: 一時的なエラーに対する再試行の方針 (RetryPolicy)。省略時は既定値
+    :param rate_limiter: 要求レートの制限 (TokenBucketRateLimiter)。省略時は制限しない
+    :param connect_timeout_sec: HTTP接続のタイムアウト(秒)
+    :param read_timeout_sec: HTTP応答の読み込みのタイムアウト(秒)
+    :param metrics: API呼び出しなどの計測値の記録先 (MdxMetrics)。省略時はインスタンス毎に作成する
+    :param tracer: API呼び出しや待ち合わせのスパンの記録先。省略時は記録しない
+    """
+
+    def __init__(self, endpoint=DEFAULT_MDX_ENDPOINT, init_token=None,
+                 pool_limit=DEFAULT_ASYNC_POOL_LIMIT,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT_SEC,
+                 token_refresh_margin_sec=DEFAULT_TOKEN_REFRESH_MARGIN_SEC,
+                 session=None, retry_policy=None, rate_limiter=None,
+                 connect_timeout_sec=DEFAULT_CONNECT_TIMEOUT_SEC,
+                 read_timeout_sec=DEFAULT_READ_TIMEOUT_SEC, metrics=None, tracer=None):
+        self._endpoint = endpoint
+        self.metrics = MdxMetrics() if metrics is None else metrics
+        self.tracer = NOOP_TRACER if tracer is None else tracer
+        self._connect_timeout_sec = connect_timeout_sec
+        self._read_timeout_sec = read_timeout_sec
+        self._token_manager = MdxTokenManager(init_token, token_refresh_margin_sec)
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self._retry_policy = retry_policy
+        self._rate_limiter = rate_limiter
+        self._pool_limit = pool_limit
+        self._pool_maxsize = pool_maxsize
+        self._keepalive_timeout = keepalive_timeout
+        self._session = session
+        self._own_session = session is None
+        # イベントループ内で生成する
+        self._refresh_lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._pool_limit,
+                                             limit_per_host=self._pool_maxsize,
+                                             keepalive_timeout=self._keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._own_session = True
+        return self._session
+
+    async def close(self):
+        """
+        プールしているHTTPコネクションを閉じる
+        """
+        if self._own_session and self._session is not None:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def _token(self):
+        return self._token_manager.token
+
+    @_token.setter
+    def _token(self, token):
+        self._token_manager.set_token(token)
+
+    async def _call_api(
+        self, api, method="GET", data=None, with_token=True, refresh_token=True,
+        idempotent=None
+    ):
+        """
+        APIを呼び出す。トークンのリフレッシュと再試行は MdxLib._call_api と同様。
+        """
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        if with_token and refresh_token and self._token_manager.needs_refresh():
+            await self._refresh_token(self._token)
+        token = self._token
+        res = await self._send_with_retry(api, method, data, with_token, idempotent)
+        if res.status_code == 401 and with_token and refresh_token:
+            logger.debug("token is rejected, refresh and retry: {}".format(api))
+            self._token_manager.increment("unauthorized_count")
+            await self._refresh_token(token)
+            res = await self._send_with_retry(api, method, data, with_token, idempotent)
+        return res
+
+    async def _send_with_retry(self, api, method, data, with_token, idempotent):
+        attempt = 1
+        while True:
+            try:
+                res = await self._send(api, method, data, with_token)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                connect_error = isinstance(e, (aiohttp.ClientConnectorError,
+                                               aiohttp.ConnectionTimeoutError))
+                if not self._retry_policy.should_retry(attempt, idempotent,
+                                                       connect_error=connect_error):
+                    if isinstance(e, asyncio.TimeoutError):
+                        phase = "connect" if connect_error else "read"
+                        raise MdxTimeoutException(
+                            "mdxlib: {} {}: {} timeout".format(method, api, phase), phase) from e
+                    raise
+                delay = self._retry_policy.backoff(attempt)
+                reason = type(e).__name__
+                logger.debug("{} {}: {!r}, retry after {:.1f}s".format(method, api, e, delay))
+            else:
+                if not self._retry_policy.should_retry(attempt, idempotent, res.status_code):
+                    return res
+                delay = self._retry_policy.backoff(
+                    attempt, _parse_retry_after(res.headers.get("Retry-After")))
+                reason = res.status_code
+                logger.debug("{} {}: status {}, retry after {:.1f}s".format(
+                    method, api, res.status_code, delay))
+            self._token_manager.increment("retry_count")
+            self.metrics.count_retry(method, api, reason)
+            await self._sleep(bounded_delay(delay, "retry"), "retry")
+            attempt += 1
+
+    async def _sleep(self, sec, operation):
+        self.metrics.observe_wait(operation, sec)
+        await asyncio.sleep(sec)
+
+    def _timeout(self):
+        """
+        aiohttp に渡すタイムアウト。期限が設定されていれば全体の時間を残り時間に制限する
+        """
+        total = None
+        deadline = current_deadline()
+        if deadline is not None:
+            total = deadline.remaining()
+            if total <= 0:
+                raise deadline.exception("request")
+        return aiohttp.ClientTimeout(total=total, sock_connect=self._connect_timeout_sec,
+                                     sock_read=self._read_timeout_sec)
+
+    async def _send(self, api, method, data, with_token):
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        }
+        if with_token:
+            if self._token is None:
+                raise MdxRestException("mdxlib: token is not specified")
+            headers["Authorization"] = "JWT %s" % self._token
+        url = urllib.parse.urljoin(self._endpoint, api)
+        kwargs = {"headers": headers, "timeout": self._timeout()}
+        if method == "GET":
+            if data is not None:
+                kwargs["params"] = {k: str(v) for k, v in data.items()}
+        elif method == "POST":
+            kwargs["data"] = json.dumps(data)
+        elif method == "PUT":
+            kwargs["data"] = data
+        if self._rate_limiter is not None:
+            wait = reserve_rate_limit(self._rate_limiter)
+            if wait > 0:
+                await self._sleep(wait, "rate_limit")
+        self._token_manager.increment("request_count")
+        started = time.monotonic()
+        status_code = None
+        with self.tracer.span("{} {}".format(method, normalize_endpoint(api)),
+                              {"http.request.method": method, "url.path": api.split("?", 1)[0],
+                               "mdx.endpoint": self._endpoint}) as span:
+            try:
+                async with self._get_session().request(method, url, **kwargs) as res:
+                    response = AsyncMdxResponse(res.status, await res.text(), res.headers)
+                    status_code = res.status
+                    return response
+            finally:
+                span.set_attribute("http.response.status_code", status_code)
+                self.metrics.observe_request(method, api, status_code, time.monotonic() - started)
+
+    async def _refresh_token(self, stale_token=None):
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            if stale_token is not None and self._token != stale_token:
+                return
+            data = {"token": self._token}
+            res = await self._call_api(
+                "/api/refresh/", method="POST", data=data, refresh_token=False,
+                idempotent=True,
+            )
+            if res.status_code != 200:
+                raise MdxRestException("mdxlib: token refresh failed", res.status_code)
+            self._token = res.json()["token"]
+            self._token_manager.increment("refresh_count")
+            self.metrics.count_refresh()
+
+    async def _request(self, api, name, method="GET", data=None, expected=200):
+        res = await self._call_api(api, method=method, data=data)
+        if res.status_code != expected:
+            raise MdxRestException(
+                "mdxlib: {} is failed: {}".format(name, res.text),
+                status_code=res.status_code,
+            )
+        return res
+
+    def _predict_vmnames(self, s):
+        match = re.fullmatch(r"(.*)\[(\d+)-(\d+)\](.*)", s)
+        if not match:
+            single_range = re.fullmatch(r"(.*)\[(\d+)\](.*)", s)
+            if single_range:
+                return [s.replace('[', '').replace(']', '')]
+            else:
+                return [s]
+
+        prefix, start, end, suffix = match.groups()
+        width = max(len(start), len(end))
+        return [f"{prefix}{str(i).zfill(width)}{suffix}" for i in range(int(start), int(end) + 1)]
+
+    async def _correlate_tasks(self, project_id, vm_names, task_ids):
+        """
+        デプロイで返されたタスクIDと仮想マシンを対応付ける。 MdxLib._correlate_tasks() を参照のこと。
+        """
+        with self.tracer.span("mdx.task_correlation", {"mdx.project_id": project_id,
+                                                       "mdx.vm_names": vm_names}):
+            pending_task_ids = set(task_ids)
+            tasks = {}
+            remaining = list(vm_names)
+            for i in range(TASK_CORRELATION_RETRY):
+                vm_list = await self.get_vm_list(project_id)
+                vm_ids = {}
+                for vm_info in vm_list['results']:
+                    vm_ids.setdefault(vm_info['name'], []).append(vm_info['uuid'])
+                candidates = [(vm_name, vm_id) for vm_name in remaining for vm_id in vm_ids.get(vm_name, [])]
+                histories = await asyncio.gather(
+                    *[self.get_vm_history(vm_id) for _vm_name, vm_id in candidates])
+                for (vm_name, _vm_id), vm_histories in zip(candidates, histories):
+                    if vm_name in tasks:
+                        continue
+                    for vm_history in vm_histories['results']:
+                        if vm_history['uuid'] in pending_task_ids:
+                            tasks[vm_name] = vm_history
+                            pending_task_ids.discard(vm_history['uuid'])
+                            break
+                remaining = [vm_name for vm_name in remaining if vm_name not in tasks]
+                if not remaining or not pending_task_ids:
+                    break
+                logger.debug("correlate tasks: retry {} remaining {}".format(i, remaining))
+                await self._sleep(bounded_delay(TASK_CORRELATION_INTERVAL_SEC, "task_correlation"),
+                                  "task_correlation")
+        return [tasks[vm_name] for vm_name in vm_names if vm_name in tasks]
+
+    async def refresh_token(self):
+        await self._refresh_token()
+
+    def get_token_stats(self):
+        """
+        HTTPリクエスト数とトークンリフレッシュ回数を取得する。
+        詳細は MdxTokenManager.get_stats() を参照のこと。
+        """
+        return self._token_manager.get_stats()
+
+    async def login(self, auth_info):
+        """
+        mdx REST APIデバッグ時のトークンの取得。 MdxLib.login() を参照のこと。
+        """
+        res = await self._call_api("/api/login/", method="POST", data=auth_info,
+                                   with_token=False, refresh_token=False, idempotent=True)
+        if res.status_code != 200:
+            raise MdxRestException(
+                "mdxlib: login is failed: {}".format(res.text), res.status_code
+            )
+        self._token = res.json()["token"]
+
+    async def deploy_vm(self, mdx_vm_spec) -> list:
+        """
+        VMを作成(デプロイ)する。 MdxLib.deploy_vm() を参照のこと。
+        """
+        res = await self._request("/api/vm/deploy/", "deploy vm", method="POST",
+                                  data=mdx_vm_spec, expected=202)
+        logger.debug("deploy vm: {}".format(res.text))
+        task_ids = res.json()['task_id']
+        vm_names = self._predict_vmnames(mdx_vm_spec['vm_name'])
+        return await self._correlate_tasks(mdx_vm_spec['project'], vm_names, task_ids)
+
+    async def clone_vm(self, original_vm_id: str, mdx_vm_spec: dict):
+        """
+        VMをクローンする。 MdxLib.clone_vm() を参照のこと。
+        """
+        res = await self._request(f"/api/vm/{original_vm_id}/clone/", "clone_vm",
+                                  method="POST", data=copy.deepcopy(mdx_vm_spec),
+                                  expected=202)
+        logger.debug("clone_vm: {}".format(res.text))
+        return res.json()["task_id"]
+
+    async def destroy_vm(self, vm_id):
+        res = await self._request("/api/vm/{}/destroy/".format(vm_id), "destroy vm",
+                                  method="POST", expected=202)
+        return res.json()["task_id"]
+
+    async def shutdown_vm(self, vm_id):
+        res = await self._request("/api/vm/{}/shutdown/".format(vm_id), "shutdown vm",
+                                  method="POST", expected=202)
+        return res.json()
+
+    async def power_off_vm(self, vm_id):
+        res = await self._request("/api/vm/{}/power_off/".format(vm_id), "power_off vm",
+                                  method="POST", expected=202)
+        return res.json()
+
+    async def power_on_vm(self, vm_id, service_level="spot"):
+        data = {'service_level': service_level}
+        res = await self._request("/api/vm/{}/power_on/".format(vm_id), "power_on vm",
+                                  method="POST", data=data, expected=202)
+        return res.json()
+
+    async def reboot_vm(self, vm_id):
+        res = await self._request("/api/vm/{}/reboot/".format(vm_id), "reboot vm",
+                                  method="POST", expected=202)
+        return res.json()
+
+    # その他
+    async def get_assigned_projects(self):
+        res = await self._request("/api/project/assigned/", "get project")
+        return res.json()
+
+    async def get_project_history(self, project_id, page=1, page_size=10000):
+        data = dict(page=page, page_size=page_size)
+        res = await self._request("/api/history/project/{}/".format(project_id),
+                                  "get project history", data=data)
+        return res.json()
+
+    async def get_vm_list(self, project_id, page=1, page_size=10000):
+        data = dict(page=page, page_size=page_size)
+        res = await self._request("/api/vm/project/{}/".format(project_id),
+                                  "get vm list", data=data)
+        return res.json()
+
+    async def get_vm_history(self, vm_id, page=1, page_size=1000):
+        res = await self._request(
+            "/api/history/vm/{}/?page={}&page_size={}".format(vm_id, page, page_size),
+            "get vm history")
+        return res.json()
+
+    async def get_vm_info(self, vm_id):
+        """
+        vm_idで指定した仮想マシンの詳細情報を取得する。 MdxLib.get_vm_info() を参照のこと。
+        """
+        res = await self._request("/api/vm/{}/".format(vm_id), "get vm info")
+        result = res.json()
+        result["vm_id"] = vm_id
+        return result
+
+    async def get_vm_catalogs(self, project_id):
+        res = await self._request(
+            "/api/catalog/project/{}/?page=1&page_size=10000".format(project_id),
+            "get_vm_catalog")
+        return res.json()
+
+    async def get_allow_acl_ipv4_info(self, segment_id):
+        res = await self._request(
+            "/api/acl/segment/{}/?page=1&page_size=10000".format(segment_id),
+            "get_allow_acl_ipv4_info")
+        return res.json()
+
+    async def add_allow_acl_ipv4_info(self, allow_acl_spec):
+        res = await self._request("/api/acl/", "add_allow_acl_ipv4_info", method="POST",
+                                  data=allow_acl_spec, expected=201)
+        return res.json()
+
+    async def edit_allow_acl_ipv4_info(self, acl_ipv4_id, allow_acl_spec):
+        res = await self._request("/api/acl/{}/".format(acl_ipv4_id),
+                                  "edit_allow_acl_ipv4_info", method="PUT",
+                                  data=json.dumps(allow_acl_spec))
+        return res.json()
+
+    async def delete_allow_acl_ipv4_info(self, acl_ipv4_id):
+        await self._request("/api/acl/{}/".format(acl_ipv4_id),
+                            "delete_allow_acl_ipv4_info", method="DELETE", expected=204)
+
+    async def get_allow_acl_ipv6_info(self, segment_id):
+        res = await self._request(
+            "/api/acl_v6/segment/{}/?page=1&page_size=10000".format(segment_id),
+            "get_allow_acl_ipv6_info")
+        return res.json()
+
+    async def add_allow_acl_ipv6_info(self, allow_acl_spec):
+        res = await self._request("/api/acl_v6/", "add_allow_acl_ipv6_info", method="POST",
+                                  data=allow_acl_spec, expected=201)
+        return res.json()
+
+    async def edit_allow_acl_ipv6_info(self, acl_ipv6_id, allow_acl_spec):
+        res = await self._request("/api/acl_v6/{}/".format(acl_ipv6_id),
+                                  "edit_allow_acl_ipv6_info", method="PUT",
+                                  data=json.dumps(allow_acl_spec))
+        return res.json()
+
+    async def delete_allow_acl_ipv6_info(self, acl_ipv6_id):
+        await self._request("/api/acl_v6/{}/".format(acl_ipv6_id),
+                            "delete_allow_acl_ipv6_info", method="DELETE", expected=204)
+
+    async def get_segments(self, project_id):
+        res = await self._request("/api/segment/project/{}/all/".format(project_id),
+                                  "get_segments")
+        return res.json()
+
+    async def get_segment_summary(self, project_id, segment_id):
+        res = await self._request("/api/segment/{}/summary".format(segment_id),
+                                  "get_segment_summary")
+        return res.json()
+
+    # dnat
+    async def get_dnat(self, project_id, page=1, page_size=10000):
+        data = dict(page=page, page_size=page_size)
+        res = await self._request("/api/dnat/project/{}".format(project_id), "get_dnat",
+                                  data=data)
+        return res.json()
+
+    async def add_dnat(self, project_id, nat_spec):
+        res = await self._request("/api/dnat/", "add_dnat", method="POST", data=nat_spec,
+                                  expected=201)
+        return res.json()
+
+    async def edit_dnat(self, project_id, dnat_id, nat_spec):
+        res = await self._request("/api/dnat/{}/".format(dnat_id), "edit_dnat",
+                                  method="PUT", data=json.dumps(nat_spec))
+        return res.json()
+
+    async def delete_dnat(self, project_id, dnat_id):
+        # 返り値(json)なし
+        return await self._request("/api/dnat/{}/".format(dnat_id), "delete_dnat",
+                                   method="DELETE", expected=204)
+
+    async def get_assignable_global_ipv4(self, project_id):
+        res = await self._request(
+            "/api/global_ip/project/{}/assignable/".format(project_id),
+            "get_assignable_global_ipv4")
+        return res.json()
+
+
+class AsyncVmStateWaiter(BaseVmStateWaiter):
+    """
+    mdx_wait.VmStateWaiter のasyncio版。確認時期、確認方法、完了の判定は VmStateWaiter と共通で、
+    待機は asyncio.sleep で行い、vm_info API は並行して呼び出す。
+
+    :param mdxlib: AsyncMdxLib
+    :param project_id: プロジェクトID
+    :param policy: 確認間隔と期限 (PollingPolicy)。省略時は既定値の PollingPolicy
+
+    .. code-block:: python
+
+      waiter = mdx.create_state_waiter()
+      futures = [waiter.watch(vm_id, "PowerON") for vm_id in vm_ids]
+      async for watch in waiter.iter_completed():
+          print(watch.vm_id, watch.future.exception())
+    """
+
+    async def run(self):
+        """
+        登録した全ての待ち合わせが完了するまで待つ
+        """
+        async for _watch in self.iter_completed():
+            pass
+
+    async def iter_completed(self):
+        """
+        登録した待ち合わせを、完了したものから順に VmStateWatch として返す非同期ジェネレータ
+        """
+        while self._pending:
+            delay = self._next_delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            expired = self._expire_all()
+            if expired is not None:
+                for watch in expired:
+                    yield watch
+                return
+            info_ids, list_ids = self._plan(time.monotonic())
+            try:
+                statuses, errors = await self._poll_statuses(info_ids, list_ids)
+            except Exception as e:
+                for watch in self._fail_all(e):
+                    yield watch
+                return
+            completed, detail = self._apply(info_ids | list_ids, statuses, errors, time.monotonic())
+            for watch in completed:
+                yield watch
+            if not detail:
+                continue
+            vm_infos, errors = await self._poll_vm_info(set(watch.vm_id for watch in detail),
+                                                        self._mdxlib.get_vm_info)
+            now = time.monotonic()
+            for watch in detail:
+                if self._apply_detail(watch, vm_infos.get(watch.vm_id), errors.get(watch.vm_id), now):
+                    yield watch
+        logger.debug("wait_until finished")
+
+    async def _poll_statuses(self, info_ids, list_ids):
+        statuses, errors = await self._poll_vm_info(info_ids, self._get_vm_info)
+        page = 1
+        while list_ids:
+            vm_list = await self._mdxlib.get_vm_list(self._project_id, page=page,
+                                                     page_size=LIST_PAGE_SIZE)
+            self._select_listed(vm_list, list_ids, statuses)
+            if vm_list["next"] is None:
+                break
+            page += 1
+        return statuses, errors
+
+    async def _poll_vm_info(self, vm_ids, get_vm_info):
+        # 仮想マシン毎に失敗を記録し、他の仮想マシンの確認は続ける
+        vm_ids = list(vm_ids)
+        results = await asyncio.gather(*[get_vm_info(vm_id) for vm_id in vm_ids],
+                                       return_exceptions=True)
+        statuses = {}
+        errors = {}
+        for vm_id, result in zip(vm_ids, results):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if isinstance(result, Exception):
+                errors[vm_id] = result
+            elif result is not None:
+                statuses[vm_id] = result
+        return statuses, errors
+
+    async def _get_vm_info(self, vm_id):
+        try:
+            return await self._mdxlib.get_vm_info(vm_id)
+        except MdxRestException as e:
+            if e.status_code != 404:
+                raise
+            return None
+
+
+class AsyncMdxResourceExt(object):
+    """
+    MdxResourceExt のasyncio版。
+
+    各メソッドは MdxResourceExt の同名メソッドと同じ引数・返り値のコルーチンであり、
+    ``*_iter`` は非同期ジェネレータとなる。状態の待ち合わせは asyncio.sleep で行うため、
+    1つのイベントループで多数の仮想マシンの操作を並行して実行できる。
+
+    事前状態の確認、仕様の組み立て、待ち合わせの確認時期と完了の判定は MdxResourceExt と共通の
+    処理を使用し、このクラスはAPI呼び出しと待機のみを行う。
+
+    以下のメソッドは MdxResourceExt のみにある。複数の仮想マシンの操作は asyncio.gather() で
+    各メソッドを並行して呼び出すこと。
+
+    - power_on_vms(), power_off_vms(), shutdown_vms(), reboot_vms()
+    - snapshot()
+    - reconcile_acl(), reconcile_dnat(), import_acl_rules()
+    - set_first_password(), set_first_passwords(), wait_ssh_ready(), wait_ssh_ready_iter()
+
+    :param init_token: mdx ユーザポータルから取得した mdx REST API 認証トークン
+    :param endpoint: mdx REST API エンドポイント URL (オプショナル)
+    :param vm_index_ttl_sec: 仮想マシン名→仮想マシンIDの索引の有効期間(秒)
+    :param polling_policy: 状態の待ち合わせの確認間隔と期限 (PollingPolicy)
+    :param cache: リソースのキャッシュ (ResourceCache)。省略時はキャッシュしない
+    :param lib_options: AsyncMdxLib に渡すオプション (pool_limit, session, metrics, tracer など)
+
+    .. code-block:: python
+
+      async with AsyncMdxResourceExt(token) as mdx:
+          await mdx.set_current_project_by_name(project_name)
+          await asyncio.gather(*[mdx.reboot_vm(name) for name in vm_names])
+    """
+
+    def __init__(self, init_token=None, endpoint=DEFAULT_MDX_ENDPOINT,
+                 vm_index_ttl_sec=VM_NAME_INDEX_TTL_SEC, polling_policy=None, cache=None,
+                 **lib_options):
+        self._mdxlib = AsyncMdxLib(endpoint=endpoint, init_token=init_token, **lib_options)
+        self._project_id = None
+        self._vm_index = VmNameIndex(vm_index_ttl_sec)
+        if polling_policy is None:
+            polling_policy = default_polling_policy()
+        self._polling_policy = polling_policy
+        self._cache = cache
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """
+        プールしているHTTPコネクションを閉じる
+        """
+        await self._mdxlib.close()
+
+    def _check_project_id(self):
+        if self._project_id is None:
+            raise MdxRestException("call set_project_id to set target mdx project")
+
+    def _cache_scope(self, per_project=True):
+        # 利用者毎に参照できるプロジェクトが異なるため、ディスクのキャッシュを共有しても
+        # 他の利用者のキャッシュを参照しないよう、トークンの利用者をスコープに含める
+        return "{}#{}#{}".format(self._mdxlib._endpoint, self._mdxlib._token_manager.identity,
+                                 self._project_id if per_project else "")
+
+    async def _cached(self, resource, loader, per_project=True):
+        if self._cache is None:
+            return await loader()
+        scope = self._cache_scope(per_project)
+        missing = object()
+        value = self._cache.get(resource, scope, missing)
+        if value is missing:
+            value = await loader()
+            self._cache.put(resource, scope, value)
+        return value
+
+    def _invalidate_cache(self, resource):
+        if self._cache is not None:
+            self._cache.invalidate(resource, self._cache_scope())
+
+    def invalidate_cache(self, resource=None):
+        """
+        キャッシュを破棄する。 MdxResourceExt.invalidate_cache() を参照のこと。
+        """
+        if self._cache is None:
+            return
+        if resource is None:
+            self._cache.clear()
+        else:
+            self._cache.invalidate(resource)
+
+    @traced
+    async def refresh_token(self):
+        """
+        mdx REST API 認証トークンを更新する
+        """
+        await self._mdxlib.refresh_token()
+
+    def get_token_stats(self):
+        """
+        HTTPリクエスト数とトークンリフレッシュ回数を取得する
+        """
+        return self._mdxlib.get_token_stats()
+
+    def validate_specs(self, kind, specs):
+        """
+        複数の仕様を、API を呼び出さずにまとめて検証する。 MdxResourceExt.validate_specs() を参照のこと。
+        """
+        return validate_specs(kind, specs)
+
+    @property
+    def metrics(self):
+        """
+        API呼び出しなどの計測値 (MdxMetrics)
+        """
+        return self._mdxlib.metrics
+
+    def get_metrics(self):
+        """
+        計測値を取得する。 MdxResourceExt.get_metrics() を参照のこと。
+        """
+        return self._mdxlib.metrics.snapshot()
+
+    @traced
+    async def deploy_vm(self, vm_name, vm_spec, wait_for=True, timeout=None) -> list:
+        '''
+        仮想マシンのデプロイを実行する。 MdxResourceExt.deploy_vm() を参照のこと。
+        複数の仮想マシンを作成する場合は全ての仮想マシンを並行して待つ。
+        '''
+        with deadline_scope(timeout):
+            vm_ids = await self._deploy_vm(vm_name, vm_spec)
+            if wait_for:
+                vm_infos = {vm_info["vm_id"]: vm_info
+                            async for vm_info in self._iter_deployed_vms(vm_name, vm_ids)}
+                return [vm_infos[vm_id] for vm_id in vm_ids]
+            return [await self._mdxlib.get_vm_info(vm_id) for vm_id in vm_ids]
+
+    @traced_iter
+    async def deploy_vm_iter(self, vm_name, vm_spec):
+        '''
+        仮想マシンのデプロイを実行し、IPv4アドレスが付与された仮想マシンから順に仮想マシン情報を返す
+        非同期ジェネレータ。デプロイはイテレートを開始した時点で実行する。
+        '''
+        vm_ids = await self._deploy_vm(vm_name, vm_spec)
+        async for vm_info in self._iter_deployed_vms(vm_name, vm_ids):
+            yield vm_info
+
+    async def _deploy_vm(self, vm_name, vm_spec):
+        self._check_project_id()
+        vm_spec = _deploy_spec(vm_spec, vm_name, self._project_id)
+        return _index_deployed_vms(self._vm_index, await self._mdxlib.deploy_vm(vm_spec))
+
+    async def _iter_deployed_vms(self, vm_name, vm_ids, operation="deploy"):
+        # 全ての仮想マシンの起動とIPv4アドレスの付与を、仮想マシン一覧の取得でまとめて待つ
+        waiter = self.create_state_waiter()
+        _watch_ready_vms(waiter, vm_ids, operation)
+        async for watch in waiter.iter_completed():
+            yield _ready_vm_result(vm_name, watch)
+
+    @traced
+    async def clone_vm(self, original_vm_name, vm_name, vm_spec, power_on=False, wait_for=True,
+                       timeout=None):
+        '''
+        仮想マシンのクローンを実行する。 MdxResourceExt.clone_vm() を参照のこと。
+        '''
+        with deadline_scope(timeout):
+            self._check_project_id()
+            vm_spec = _clone_spec(vm_spec, vm_name, self._project_id)
+
+            org_vm_id, _ = await self._find_vm_info(original_vm_name)
+
+            await self._mdxlib.clone_vm(org_vm_id, vm_spec)
+            vm_id = await self._find_vm(vm_name)
+
+            if power_on:
+                # クローン完了前に起動しようとすると失敗するので待機する
+                await self._wait_until(vm_id, "PowerOFF", operation="clone")
+                await self._mdxlib.power_on_vm(vm_id, vm_spec.get('service_level'))
+                if wait_for:
+                    # 起動とIPv4アドレスの付与を待つ
+                    return [vm_info async for vm_info in
+                            self._iter_deployed_vms(vm_name, [vm_id], operation="power_on")][0]
+
+            return await self._mdxlib.get_vm_info(vm_id)
+
+    @traced
+    async def destroy_vm(self, vm_name, wait_for=True, timeout=None):
+        """
+        仮想マシンの削除を実行する。事前に仮想マシンを PowerOFF 状態にしておく必要がある。
+        """
+        with deadline_scope(timeout):
+            self._check_project_id()
+            vm_id, vm_info = await self._find_vm_info(vm_name)
+
+            _check_destroyable(vm_info["status"])
+
+            await self._mdxlib.destroy_vm(vm_id)
+            self._vm_index.remove(vm_name)
+            if not wait_for:
+                return
+
+            # 仮想マシン情報から消えるまで待つ
+            try:
+                await self._wait_until(vm_id, VM_NOT_FOUND, operation="destroy")
+            except MdxRestException as e:
+                raise _destroy_error(vm_name, e)
+
+    @traced
+    async def power_on_vm(self, vm_name, service_level="spot", wait_for=True, timeout=None):
+        """
+        仮想マシンの起動 (PowerON) を実行する。
+        """
+        await self._power_vm("power_on", vm_name, wait_for, timeout, service_level)
+
+    @traced
+    async def power_off_vm(self, vm_name, wait_for=True, timeout=None):
+        """
+        仮想マシンの強制停止 (PowerOFF) を実行する。
+        """
+        await self._power_vm("power_off", vm_name, wait_for, timeout)
+
+    @traced
+    async def power_shutdown_vm(self, vm_name, wait_for=True, timeout=None):
+        """
+        仮想マシンのゲストOSのシャットダウンを実行する。
+        """
+        await self._power_vm("shutdown", vm_name, wait_for, timeout)
+
+    @traced
+    async def reboot_vm(self, vm_name, wait_for=True, timeout=None):
+        """
+        仮想マシンの再起動を実行する。
+        """
+        await self._power_vm("reboot", vm_name, wait_for, timeout)
+
+    async def _power_vm(self, operation, vm_name, wait_for, timeout, service_level="spot"):
+        with deadline_scope(timeout):
+            self._check_project_id()
+            vm_id, vm_info = await self._find_vm_info(vm_name)
+
+            status = await self._request_power_operation(operation, vm_id, service_level,
+                                                         vm_info=vm_info)
+            if status is not None and wait_for:
+                # 再起動中も PowerON のままのため、再起動のタスクがなくなるまで待つ
+                await self._wait_until(vm_id, status, operation=operation,
+                                       idle=operation == "reboot")
+
+    async def _request_power_operation(self, operation, vm_id, service_level="spot", vm_info=None):
+        """
+        MdxResourceExt._request_power_operation() のasyncio版
+        """
+        if vm_info is None:
+            vm_info = await self._mdxlib.get_vm_info(vm_id)
+        status = _power_operation_target(operation, vm_info["status"])
+        if status is None:
+            return None
+        if operation == "power_on":
+            await self._mdxlib.power_on_vm(vm_id, service_level)
+        elif operation == "reboot":
+            await self._mdxlib.reboot_vm(vm_id)
+        elif operation == "power_off":
+            await self._mdxlib.power_off_vm(vm_id)
+        else:
+            await self._mdxlib.shutdown_vm(vm_id)
+        return status
+
+    @traced
+    async def get_vm_info(self, vm_name):
+        """
+        仮想マシンの詳細情報を取得する。 MdxResourceExt.get_vm_info() を参照のこと。
+        """
+        self._check_project_id()
+        return (await self._get_vm_by_vm_name(vm_name))[1]
+
+    @traced
+    async def get_vm_list(self):
+        """
+        プロジェクトに属する仮想マシン情報を取得する
+        """
+        self._check_project_id()
+        return [vm_info async for vm_info in self.vm_info_iter()]
+
+    @traced
+    async def get_vm_catalogs(self):
+        self._check_project_id()
+        return await self._cached("vm_catalogs",
+                                  lambda: self._mdxlib.get_vm_catalogs(self._project_id))
+
+    @traced
+    async def get_vm_history(self, vm_name):
+        self._check_project_id()
+        vm_id = await self._get_vm_id_by_vm_name(vm_name)
+        if vm_id is None:
+            return None
+        return await self._mdxlib.get_vm_history(vm_id)
+
+    @traced
+    async def get_assigned_projects(self):
+        return await self._cached("assigned_projects", self._mdxlib.get_assigned_projects,
+                                  per_project=False)
+
+    def set_current_project_id(self, project_id):
+        """
+        操作対象のmdxのプロジェクトIDを設定する
+        """
+        self._project_id = project_id
+        self._vm_index.clear()
+
+    @traced
+    async def set_current_project_by_name(self, project_name):
+        """
+        操作対象のmdxのプロジェクトをプロジェクト名で設定する
+        """
+        project_id = _find_project_id(await self.get_assigned_projects(), project_name)
+        if project_id is None and self._cache is not None:
+            # キャッシュした後に割り当てられたプロジェクトの可能性がある
+            self._cache.invalidate("assigned_projects", self._cache_scope(per_project=False))
+            project_id = _find_project_id(await self.get_assigned_projects(), project_name)
+        if project_id is not None:
+            self.set_current_project_id(project_id)
+            return
+
+        raise MdxRestException(f"mdx_ext: project {project_name} is not found")
+
+    def invalidate_vm_index(self):
+        """
+        仮想マシン名→仮想マシンIDの索引を破棄する
+        """
+        self._vm_index.clear()
+
+    @traced
+    async def get_current_project(self):
+        if self._project_id is None:
+            return None
+        for org in await self.get_assigned_projects():
+            for proj in org["projects"]:
+                if proj["uuid"] == self._project_id:
+                    return proj
+        return None
+
+    # network
+    @traced
+    async def get_allow_acl_ipv4_info(self, segment_id):
+        self._check_project_id()
+        return await self._mdxlib.get_allow_acl_ipv4_info(segment_id)
+
+    @traced
+    async def add_allow_acl_ipv4_info(self, allow_acl_spec):
+        self._check_project_id()
+        validate_spec("acl_ipv4", allow_acl_spec)
+        return await self._mdxlib.add_allow_acl_ipv4_info(allow_acl_spec)
+
+    @traced
+    async def edit_allow_acl_ipv4_info(self, allow_acl_id, allow_acl_spec):
+        self._check_project_id()
+        validate_spec("acl_ipv4_edit", allow_acl_spec)
+        return await self._mdxlib.edit_allow_acl_ipv4_info(allow_acl_id, allow_acl_spec)
+
+    @traced
+    async def delete_allow_acl_ipv4_info(self, acl_ipv4_id):
+        self._check_project_id()
+        await self._mdxlib.delete_allow_acl_ipv4_info(acl_ipv4_id)
+
+    @traced
+    async def get_allow_acl_ipv6_info(self, segment_id):
+        self._check_project_id()
+        return await self._mdxlib.get_allow_acl_ipv6_info(segment_id)
+
+    @traced
+    async def add_allow_acl_ipv6_info(self, allow_acl_spec):
+        self._check_project_id()
+        validate_spec("acl_ipv6", allow_acl_spec)
+        return await self._mdxlib.add_allow_acl_ipv6_info(allow_acl_spec)
+
+    @traced
+    async def edit_allow_acl_ipv6_info(self, allow_acl_id, allow_acl_spec):
+        self._check_project_id()
+        validate_spec("acl_ipv6_edit", allow_acl_spec)
+        return await self._mdxlib.edit_allow_acl_ipv6_info(allow_acl_id, allow_acl_spec)
+
+    @traced
+    async def delete_allow_acl_ipv6_info(self, acl_ipv6_id):
+        self._check_project_id()
+        await self._mdxlib.delete_allow_acl_ipv6_info(acl_ipv6_id)
+
+    # project
+    @traced
+    async def get_project_history(self):
+        self._check_project_id()
+        return [history async for history in self.project_history_iter()]
+
+    @traced
+    async def sync_project_history(self, store):
+        """
+        プロジェクト操作履歴をローカルのストアに差分同期する。 MdxResourceExt.sync_project_history() を参照のこと。
+        """
+        self._check_project_id()
+        # ストアはファイルを同期的に読み書きするため、イベントループを止めないよう別スレッドで呼び出す
+        selector = HistoryPageSelector(await _to_thread(store.watermark, self._project_id))
+        changed = 0
+        page = 1
+        while True:
+            res = await self._mdxlib.get_project_history(self._project_id, page=page,
+                                                         page_size=HISTORY_SYNC_PAGE_SIZE)
+            entries, done = selector.select(res)
+            changed += await _to_thread(store.upsert, entries, self._project_id)
+            if done:
+                return changed
+            page += 1
+
+    @traced_iter
+    def vm_info_iter(self, consistent=False):
+        """
+        仮想マシン一覧を非同期イテレータとして返す。 MdxResourceExt.vm_info_iter() を参照のこと。
+        """
+        self._check_project_id()
+        return _aiter_pages(
+            lambda page, page_size: self._mdxlib.get_vm_list(self._project_id, page=page,
+                                                             page_size=page_size),
+            page_size=100, consistent=consistent)
+
+    @traced_iter
+    def project_history_iter(self, consistent=False):
+        """
+        プロジェクト操作履歴を非同期イテレータとして返す。
+        """
+        self._check_project_id()
+        return _aiter_pages(
+            lambda page, page_size: self._mdxlib.get_project_history(self._project_id,
+                                                                     page=page,
+                                                                     page_size=page_size),
+            page_size=10000, consistent=consistent)
+
+    @traced
+    async def get_assignable_global_ipv4(self):
+        self._check_project_id()
+        return await self._cached(
+            "assignable_global_ipv4",
+            lambda: self._mdxlib.get_assignable_global_ipv4(self._project_id))
+
+    @traced_iter
+    def dnat_iter(self, consistent=False):
+        """
+        DNAT情報を非同期イテレータとして返す。
+        """
+        self._check_project_id()
+        return _aiter_pages(
+            lambda page, page_size: self._mdxlib.get_dnat(self._project_id, page=page,
+                                                          page_size=page_size),
+            page_size=100, consistent=consistent)
+
+    @traced
+    async def get_segments(self):
+        self._check_project_id()
+        return await self._cached("segments",
+                                  lambda: self._mdxlib.get_segments(self._project_id))
+
+    @traced
+    async def get_segment_summary(self, segment_id):
+        self._check_project_id()
+        return await self._mdxlib.get_segment_summary(self._project_id, segment_id)
+
+    @traced
+    async def get_dnat(self):
+        return [dnat async for dnat in self.dnat_iter()]
+
+    @traced
+    async def add_dnat(self, dnat_spec):
+        validate_spec("dnat", dnat_spec)
+        try:
+            return await self._mdxlib.add_dnat(self._project_id, dnat_spec)
+        finally:
+            self._invalidate_cache("assignable_global_ipv4")
+
+    @traced
+    async def edit_dnat(self, dnat_id, dnat_spec):
+        validate_spec("dnat", dnat_spec)
+        try:
+            return await self._mdxlib.edit_dnat(self._project_id, dnat_id, dnat_spec)
+        finally:
+            self._invalidate_cache("assignable_global_ipv4")
+
+    @traced
+    async def delete_dnat(self, dnat_id):
+        try:
+            await self._mdxlib.delete_dnat(self._project_id, dnat_id)
+        finally:
+            self._invalidate_cache("assignable_global_ipv4")
+
+    async def _get_vm_id_by_vm_name(self, vm_name, refresh=False):
+        vm_id = None if refresh else self._vm_index.get(vm_name)
+        if vm_id is not None:
+            return vm_id
+        vm_infos = [vm_info async for vm_info in self.vm_info_iter()]
+        return self._vm_index.rebuild(vm_infos).get(vm_name)
+
+    async def _get_vm_by_vm_name(self, vm_name):
+        """
+        MdxResourceExt._get_vm_by_vm_name() のasyncio版
+        """
+        for refresh in (False, True):
+            vm_id = await self._get_vm_id_by_vm_name(vm_name, refresh)
+            if vm_id is None:
+                break
+            try:
+                vm_info = await self._mdxlib.get_vm_info(vm_id)
+            except MdxRestException as e:
+                if e.status_code != 404:
+                    raise
+                vm_info = None
+            if not _is_stale_vm_info(vm_name, vm_id, vm_info):
+                return vm_id, vm_info
+        return None, None
+
+    async def _find_vm(self, vm_name):
+        vm_id = await self._get_vm_id_by_vm_name(vm_name)
+        if vm_id is None:
+            raise Exception("vm {} is not found".format(vm_name))
+        self._mdxlib.tracer.set_attribute("mdx.vm_id", vm_id)
+        return vm_id
+
+    async def _find_vm_info(self, vm_name):
+        vm_id, vm_info = await self._get_vm_by_vm_name(vm_name)
+        if vm_id is None:
+            raise Exception("vm {} is not found".format(vm_name))
+        self._mdxlib.tracer.set_attribute("mdx.vm_id", vm_id)
+        return vm_id, vm_info
+
+    def create_state_waiter(self):
+        """
+        現在のプロジェクトの仮想マシンの状態をまとめて待つ AsyncVmStateWaiter を作成する。
+        MdxResourceExt.create_state_waiter() を参照のこと。
+        """
+        self._check_project_id()
+        return AsyncVmStateWaiter(self._mdxlib, self._project_id, self._polling_policy)
+
+    async def _wait_until(self, vm_id, status, operation=None, idle=False):
+        waiter = self.create_state_waiter()
+        future = waiter.watch(vm_id, status, operation=operation, idle=idle)
+        await waiter.run()
+        future.result()
@@ -0,0 +1,220 @@
+#
+# mdx 変更の少ないリソースのキャッシュ
+#
+import copy
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+# リソース毎のキャッシュの有効期間(秒)
+DEFAULT_CACHE_TTL_SEC = {
+    "vm_catalogs": 3600,
+    "segments": 600,
+    "assigned_projects": 600,
+    "assignable_global_ipv4": 60,
+}
+# DiskCacheBackend の既定の保存先
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "mdx")
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCacheBackend(object):
+    """
+    プロセス内のメモリにキャッシュを保持するバックエンド
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        """
+        :returns: (値, 有効期限(UNIX時刻)) のタプル。存在しない場合は ``None``
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        # 呼び出し側で値を変更してもキャッシュに影響しないよう複製して返す
+        return copy.deepcopy(entry[0]), entry[1]
+
+    def set(self, key, value, expires_at):
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+
+class DiskCacheBackend(object):
+    """
+    ディレクトリにキー毎のJSONファイルとしてキャッシュを保持するバックエンド。
+    プロセスを再起動してもキャッシュが残る。
+
+    :param directory: 保存先ディレクトリ。省略時は DEFAULT_CACHE_DIR
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self._directory = os.path.expanduser(directory)
+        os.makedirs(self._directory, mode=0o700, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self._directory, name + ".json")
+
+    def _load(self, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning("{}: broken cache file".format(path))
+            return None
+
+    def get(self, key):
+        """
+        :returns: (値, 有効期限(UNIX時刻)) のタプル。存在しない場合は ``None``
+        """
+        entry = self._load(self._path(key))
+        if entry is None or entry["key"] != key:
+            return None
+        return entry["value"], entry["expires_at"]
+
+    def set(self, key, value, expires_at):
+        # 書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(dict(key=key, value=value, expires_at=expires_at), f)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self):
+        keys = []
+        for name in os.listdir(self._directory):
+            if not name.endswith(".json"):
+                continue
+            entry = self._load(os.path.join(self._directory, name))
+            if entry is not None:
+                keys.append(entry["key"])
+        return keys
+
+    def clear(self):
+        for key in self.keys():
+            self.delete(key)
+
+
+class ResourceCache(object):
+    """
+    変更の少ないリソース(カタログ、セグメント、プロジェクト、グローバルIPなど)のキャッシュ。
+
+    リソース名とスコープ(エンドポイント、利用者、プロジェクトID)の組をキーとし、リソース毎の有効期間を過ぎたものは破棄する。
+
+    :param backend: MemoryCacheBackend または DiskCacheBackend。省略時は MemoryCacheBackend
+    :param ttl_sec: リソース名→有効期間(秒)の辞書。DEFAULT_CACHE_TTL_SEC を上書きする。
+      0を指定したリソースはキャッシュしない。
+
+    .. code-block:: python
+
+      cache = ResourceCache(DiskCacheBackend(), ttl_sec={"segments": 3600})
+      mdx = MdxResourceExt(token, cache=cache)
+    """
+
+    def __init__(self, backend=None, ttl_sec=None):
+        if backend is None:
+            backend = MemoryCacheBackend()
+        self._backend = backend
+        self._ttl_sec = dict(DEFAULT_CACHE_TTL_SEC)
+        if ttl_sec is not None:
+            self._ttl_sec.update(ttl_sec)
+        self._lock = threading.Lock()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    @staticmethod
+    def _key(resource, scope):
+        return "{}|{}".format(resource, scope)
+
+    def get(self, resource, scope, default=None):
+        """
+        キャッシュした値を取得する
+
+        :param resource: リソース名
+        :param scope: スコープ
+        :param default: キャッシュがない、または有効期限切れの場合に返す値
+        """
+        if self._ttl_sec.get(resource, 0) <= 0:
+            return default
+        entry = self._backend.get(self._key(resource, scope))
+        if entry is None or entry[1] <= time.time():
+            with self._lock:
+                self.miss_count += 1
+            return default
+        with self._lock:
+            self.hit_count += 1
+        return entry[0]
+
+    def put(self, resource, scope, value):
+        """
+        値をキャッシュする。有効期間が0のリソースは何もしない。
+        """
+        ttl_sec = self._ttl_sec.get(resource, 0)
+        if ttl_sec <= 0:
+            return
+        self._backend.set(self._key(resource, scope), value, time.time() + ttl_sec)
+
+    def get_or_load(self, resource, scope, loader):
+        """
+        キャッシュした値を返す。キャッシュがない場合は loader() の結果をキャッシュして返す。
+        """
+        missing = object()
+        value = self.get(resource, scope, missing)
+        if value is missing:
+            value = loader()
+            self.put(resource, scope, value)
+        return value
+
+    def invalidate(self, resource, scope=None):
+        """
+        キャッシュを破棄する
+
+        :param resource: リソース名
+        :param scope: スコープ。省略時は全てのスコープのキャッシュを破棄する
+        """
+        if scope is not None:
+            self._backend.delete(self._key(resource, scope))
+            return
+        prefix = self._key(resource, "")
+        for key in self._backend.keys():
+            if key.startswith(prefix):
+                self._backend.delete(key)
+
+    def clear(self):
+        """
+        全てのキャッシュを破棄する
+        """
+        self._backend.clear()
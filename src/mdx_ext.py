@@ -1,83 +1,442 @@
 #
 # mdx extension
 #
-import ipaddress
+import collections
+import heapq
+import itertools
 import json
-import jsonschema
 import logging
 import os
-import pexpect
-import re
 import sys
+import threading
 import time
 
-from .mdx_lib import MdxLib, MdxRestException, DEFAULT_MDX_ENDPOINT
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+from .mdx_acl_import import AclRuleError, normalize_acl_rule, read_acl_rows, write_acl_import_report
+from .mdx_history import sync_project_history
+from .mdx_inventory import VmInventory, list_state
+from .mdx_lib import (
+    Deadline,
+    MdxLib,
+    MdxRestException,
+    MdxTimeoutException,
+    DEFAULT_MDX_ENDPOINT,
+    RetryPolicy,
+    current_deadline,
+    deadline_scope,
+    submit_in_context,
+)
+from .mdx_probe import SSH_PROBE_INTERVAL_SEC, SSH_PROBE_MAX_CONNECTIONS, probe_ssh_iter
+from .mdx_reconcile import ACTION_ORDER, acl_rule_key, plan_acl, plan_dnat
+from .mdx_trace import traced, traced_iter
+from .mdx_validate import MDX_VM_SPEC_SCHEMA, validate_spec, validate_specs  # noqa: F401
+from .mdx_wait import PollingPolicy, VmStateWaiter, VM_NOT_FOUND
 
 SLEEP_TIME_SEC = 5
 SLEEP_COUNT = 120
 DEPLOY_VM_SLEEP_COUNT = 240
+# IPv4アドレスの付与を待つ期限(秒)
+IP_ASSIGN_TIMEOUT_SEC = SLEEP_TIME_SEC * DEPLOY_VM_SLEEP_COUNT
 DELETABLE_STATE = ["PowerOFF", "Deallocated"]
+# 仮想マシン名→仮想マシンIDの索引の有効期間
+VM_NAME_INDEX_TTL_SEC = 60
+# 複数の仮想マシンをまとめて操作する際に同時に実行するAPI呼び出しの最大数
+FLEET_MAX_WORKERS = 8
+# ページ分割されたAPIの2ページ目以降を並列に取得する最大数
+PAGE_MAX_WORKERS = 4
+# ページを取得する間に要素が増減した場合に取得し直す回数
+PAGE_SNAPSHOT_RETRY = 3
+# 初期パスワード設定のSSHの対話の応答を待つ秒数
+SSH_DIALOGUE_TIMEOUT_SEC = 30
+# reconcile_acl(), reconcile_dnat() で使用する、仕様の種類毎の追加・編集・削除のメソッド
+RECONCILE_METHODS = {
+    "acl_ipv4": ("add_allow_acl_ipv4_info", "edit_allow_acl_ipv4_info", "delete_allow_acl_ipv4_info"),
+    "acl_ipv6": ("add_allow_acl_ipv6_info", "edit_allow_acl_ipv6_info", "delete_allow_acl_ipv6_info"),
+    "dnat": ("add_dnat", "edit_dnat", "delete_dnat"),
+}
+# SSH接続の待ち合わせの期限(秒)
+SSH_READY_TIMEOUT_SEC = 600
+# SSH接続を受け付けない仮想マシンへの初期パスワード設定の試行回数の上限(初回を含む)
+SSH_CONNECT_MAX_ATTEMPTS = 20
+# SSH接続を受け付けない仮想マシンに再接続するまでの最初の待ち時間(秒)
+SSH_CONNECT_INITIAL_BACKOFF_SEC = 2
+# SSH接続を受け付けない仮想マシンに再接続するまでの待ち時間の上限(秒)
+SSH_CONNECT_MAX_BACKOFF_SEC = 30
+# sshd がまだ起動していない仮想マシンに接続した場合の ssh の出力
+SSH_NOT_READY_PATTERNS = (
+    "Connection refused",
+    "No route to host",
+    "Connection timed out",
+    "Connection reset by peer",
+    "Connection closed by",
+    "kex_exchange_identification",
+)
 
 logger = logging.getLogger(__name__)
-# project_id, vm_name, os_typeを外した
-# 通常プロジェクト
-MDX_VM_SPEC_SCHEMA = {
-    "additionalProperties": False,
-    "type": "object",
-    "properties": {
-        "catalog": {
-            "type": "string"
-        },
-        "template_name": {
-            "type": "string"
-        },
-        "pack_num": {
-            "type": "integer"
-        },
-        "pack_type": {
-            "type": "string",
-            "enum": [
-                "cpu",
-                "gpu"
-            ]
-        },
-        "gpu": {
-            "type": "string"
-        },
-        "disk_size": {
-            "type": "integer"  # GB
-        },
-        "network_adapters": {
-            "type": "array",
-            "items": {
-                "type": "object",
-                "additionalProperties": False,
-                "properties": {
-                    "adapter_number": {
-                        "type": "integer"
-                    },
-                    "segment": {
-                        "type": "string"
-                    }
-                }
-            }
-        },
-        "shared_key": {
-            "type": "string"
-        },
-        "storage_network": {
-            "type": "string",
-            "enum": [
-                "sr-iov",
-                "pvrdma",
-                "portgroup",
-            ],
-        },
-        "service_level": {
-            "type": "string"
-        }
-    }
-}
+
+
+class _SshNotReady(MdxRestException):
+    """
+    仮想マシンがまだSSH接続を受け付けていない
+    """
+
+
+def _first_password_dialogue(host, password, ssh_key, username):
+    """
+    仮想マシンにSSHで接続し、初回ログイン時のパスワード変更の対話を行う
+
+    :returns: "done" (設定した) または "already_set" (パスワード変更を求められずにログインできた)
+    :raises _SshNotReady: 仮想マシンがまだSSH接続を受け付けていない場合
+    """
+    ssh_args = ("-o StrictHostKeyChecking=no " +
+                "-o UserKnownHostsFile=/dev/null " +
+                "-o PreferredAuthentications=publickey")
+    cmd = "ssh {} -i {} {}@{}".format(ssh_args, os.path.expanduser(ssh_key), username, host)
+    timeout = SSH_DIALOGUE_TIMEOUT_SEC
+    deadline = current_deadline()
+    if deadline is not None:
+        if deadline.expired():
+            raise deadline.exception("ssh")
+        timeout = min(timeout, deadline.remaining())
+    # pexpect はこのメソッドでしか使わないため、一覧の取得などでは読み込まない
+    import pexpect
+    conn = pexpect.spawn(cmd, encoding='utf-8', timeout=timeout)
+    try:
+        index = conn.expect(["New password: ", r"[$#] $", "Permission denied"] +
+                            list(SSH_NOT_READY_PATTERNS))
+        if index == 1:
+            # パスワード変更を求められずにシェルのプロンプトが表示された
+            conn.sendline("exit")
+            return "already_set"
+        if index == 2:
+            raise MdxRestException("{}: ssh authentication is failed".format(host))
+        if index >= 3:
+            raise _SshNotReady("{}: ssh is not ready: {}".format(host, conn.after))
+        conn.sendline(password)
+        conn.expect("Retype new password: ")
+        conn.sendline(password)
+        conn.expect("passwd: password updated successfully")
+        return "done"
+    except pexpect.EOF as e:
+        # 認証前に切断された場合は、sshd の起動途中とみなす
+        raise _SshNotReady("{}: ssh is not ready: connection closed".format(host)) from e
+    except pexpect.TIMEOUT as e:
+        if deadline is not None and deadline.expired():
+            raise deadline.exception("ssh") from e
+        raise
+    finally:
+        conn.close(force=True)
+
+
+def _has_ipv4_address(vm_info):
+    import ipaddress
+    try:
+        ipaddress.ip_address(vm_info["service_networks"][0]["ipv4_address"][0])
+        return True
+    except (IndexError, KeyError, ValueError):
+        return False
+
+
+# 以下は MdxResourceExt と mdx_async.AsyncMdxResourceExt で共有する、API呼び出しを伴わない処理
+
+def _deploy_spec(vm_spec, vm_name, project_id):
+    """
+    デプロイの仕様を検証し、APIに渡す固定値の項目を設定する
+    """
+    # 専有プロジェクトの場合
+    # "cpu": CPU数(※専有プロジェクトの場合に必要)
+    # "memory": メモリ量(GB) (※専有プロジェクトの場合に必要)
+    validate_spec("vm_deploy", vm_spec)
+
+    # OSタイプ、デプロイ後の起動指定は固定値とする
+    vm_spec["os_type"] = "Linux"
+    vm_spec["power_on"] = True
+
+    vm_spec["project"] = project_id
+    vm_spec["vm_name"] = vm_name
+    return vm_spec
+
+
+def _clone_spec(vm_spec, vm_name, project_id):
+    """
+    クローンの仕様を検証し、APIに渡す固定値の項目を設定する
+    """
+    validate_spec("vm_clone", vm_spec)
+
+    # OSタイプ指定は固定値とする
+    vm_spec["os_type"] = "Linux"
+    vm_spec["project"] = project_id
+    vm_spec["vm_name"] = vm_name
+    return vm_spec
+
+
+def _index_deployed_vms(vm_index, deployed_vm_tasks):
+    """
+    デプロイのタスクから仮想マシン名の索引を更新し、仮想マシンIDのリストを返す
+    """
+    for vm_task in deployed_vm_tasks:
+        if vm_task.get('object_name') is not None:
+            vm_index.put(vm_task['object_name'], vm_task['object_uuid'])
+    return [vm_task['object_uuid'] for vm_task in deployed_vm_tasks]
+
+
+def _power_operation_target(operation, status):
+    """
+    電源操作の事前状態を確認し、完了時の状態を返す。
+    既に操作後の状態であれば None を返す。操作できない状態であれば例外を送出する。
+
+    :param operation: "power_on", "power_off", "shutdown", "reboot"
+    :param status: 仮想マシンの現在の状態
+    """
+    if operation == "power_on":
+        if status == "PowerON":
+            logger.debug("vm is already power on")
+            return None
+        if status not in DELETABLE_STATE:
+            raise MdxRestException(
+                "mdxext: power_off_vm vm status is not PowerOFF or deallocated but {}".format(status))
+        return "PowerON"
+    if operation == "reboot":
+        # 事前条件　PowerOn
+        if status != "PowerON":
+            raise MdxRestException("mdxext: reboot_vm vm status is not PowerON but {}".format(status))
+        return "PowerON"
+
+    # power_off, shutdown
+    # 事前条件　PowerOn
+    if status in DELETABLE_STATE:
+        logger.debug("vm is already power off or deallocated")
+        return None
+    if status != "PowerON":
+        name = "power_off_vm" if operation == "power_off" else "power_shutdown_vm"
+        raise MdxRestException("mdxext: {} vm status is not PowerON but {}".format(name, status))
+    return "PowerOFF"
+
+
+def _check_destroyable(status):
+    """
+    削除の事前状態を確認し、削除できない状態であれば例外を送出する
+    """
+    if status not in DELETABLE_STATE:
+        raise MdxRestException(
+            "mdxext: destroy_vm vm status is not PowerOFF or Deallocated but {}, please power_off first".format(status))
+
+
+def _destroy_error(vm_name, e):
+    """
+    削除の待ち合わせで発生した例外を、送出する例外に変換する
+    """
+    if isinstance(e, MdxTimeoutException):
+        return MdxTimeoutException("destroy_vm is failed: {}".format(vm_name), e.phase)
+    return MdxRestException("destroy_vm is failed: {}".format(vm_name))
+
+
+def _watch_ready_vms(waiter, vm_ids, operation):
+    """
+    仮想マシンの起動とIPv4アドレスの付与を待つ待ち合わせを waiter に登録する
+    """
+    for vm_id in vm_ids:
+        waiter.watch(vm_id, "PowerON", operation=operation,
+                     condition=_has_ipv4_address, condition_operation="ip_assign",
+                     condition_timeout_sec=IP_ASSIGN_TIMEOUT_SEC)
+
+
+def _ready_vm_result(vm_name, watch):
+    """
+    _watch_ready_vms() で登録した待ち合わせの結果の仮想マシン情報を返す。失敗した場合は例外を送出する
+    """
+    e = watch.future.exception()
+    if e is not None:
+        if watch.reached:
+            raise MdxTimeoutException("{}: timeout: allocate ip address".format(vm_name),
+                                      "ip_assign") from e
+        raise e
+    return watch.future.result()
+
+
+def _is_stale_vm_info(vm_name, vm_id, vm_info):
+    """
+    索引から引いた仮想マシンIDの仮想マシン情報が、削除された (vm_info が None) または名前が変更された
+    仮想マシンのものであれば ``True`` を返す
+    """
+    if vm_info is not None and vm_info.get("name", vm_name) == vm_name:
+        return False
+    logger.debug("{}: {} in the vm name index is stale".format(vm_name, vm_id))
+    return True
+
+
+def _iter_pages(fetch_page, page_size, consistent=False, max_workers=PAGE_MAX_WORKERS):
+    """
+    ページ分割されたAPIの結果を順に返すイテレータ。
+
+    1ページ目の件数(count)から最終ページを求め、2ページ目以降は最大 max_workers 並列で取得する。
+    取得中に件数が増えて最終ページに続き(next)がある場合は、以降のページを順に取得する。
+
+    :param fetch_page: ページ番号とページサイズを引数とし、ページ(dict)を返す関数
+    :param consistent: ``True`` の場合、 _fetch_consistent_pages() で検証した結果を返す
+    """
+    if consistent:
+        for item in _fetch_consistent_pages(fetch_page, page_size, max_workers):
+            yield item
+        return
+    first = fetch_page(1, page_size)
+    for item in first["results"]:
+        yield item
+    if first["next"] is None:
+        return
+    for page in _fetch_rest_pages(fetch_page, page_size, first, max_workers):
+        for item in page["results"]:
+            yield item
+
+
+def _fetch_rest_pages(fetch_page, page_size, first, max_workers):
+    """
+    2ページ目以降を並列に取得し、ページ順に返すイテレータ。
+
+    先読みするページは max_workers 件までとし、呼び出し側が途中で打ち切った場合は未取得のページを取得しない。
+    """
+    last_page = max(2, -(-first["count"] // page_size))
+    page_numbers = iter(range(2, last_page + 1))
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    window = collections.deque(
+        submit_in_context(executor, _fetch_page_or_none, fetch_page, page_number, page_size)
+        for page_number in itertools.islice(page_numbers, max_workers))
+    try:
+        page = None
+        while window:
+            page = window.popleft().result()
+            if page is None:
+                # 取得中に件数が減ってページがなくなった
+                return
+            page_number = next(page_numbers, None)
+            if page_number is not None:
+                window.append(submit_in_context(executor, _fetch_page_or_none, fetch_page,
+                                                page_number, page_size))
+            yield page
+    finally:
+        for future in window:
+            future.cancel()
+        # 打ち切られた場合に、取得中のページの完了を待たない
+        executor.shutdown(wait=False)
+    current_page = last_page
+    while page["next"] is not None:
+        current_page += 1
+        page = _fetch_page_or_none(fetch_page, current_page, page_size)
+        if page is None:
+            return
+        yield page
+
+
+def _fetch_page_or_none(fetch_page, page, page_size):
+    try:
+        return fetch_page(page, page_size)
+    except MdxRestException as e:
+        # 範囲外のページは404となる
+        if e.status_code == 404:
+            return None
+        raise
+
+
+def _fetch_consistent_pages(fetch_page, page_size, max_workers):
+    """
+    全ページを取得して、全ページの件数(count)が一致し、uuidの重複がなく、件数と要素数が一致すること
+    を検証する。ページを取得する間に要素が増減して検証に失敗した場合は PAGE_SNAPSHOT_RETRY 回まで
+    取得し直す。それでも一致しない場合は重複を除いた結果を返す。
+    """
+    items = []
+    for i in range(PAGE_SNAPSHOT_RETRY):
+        first = fetch_page(1, page_size)
+        pages = [first]
+        if first["next"] is not None:
+            pages.extend(_fetch_rest_pages(fetch_page, page_size, first, max_workers))
+        counts = set(page["count"] for page in pages)
+        items = [item for page in pages for item in page["results"]]
+        uuids = set(item["uuid"] for item in items)
+        if len(counts) == 1 and len(items) == len(uuids) == first["count"]:
+            return items
+        logger.debug("pages are changed while fetching: retry {}".format(i))
+    logger.warning("pages are changed while fetching, duplicated items are removed")
+    seen = set()
+    unique_items = []
+    for item in items:
+        if item["uuid"] not in seen:
+            seen.add(item["uuid"])
+            unique_items.append(item)
+    return unique_items
+
+
+def _find_project_id(org_list, project_name):
+    for org in org_list:
+        for proj in org["projects"]:
+            if proj["name"] == project_name:
+                return proj["uuid"]
+    return None
+
+
+def default_polling_policy():
+    """
+    既定の PollingPolicy を作成する。確認間隔は最大 SLEEP_TIME_SEC の3倍、期限は
+    SLEEP_TIME_SEC * SLEEP_COUNT 秒とする。
+    """
+    return PollingPolicy(max_interval_sec=SLEEP_TIME_SEC * 3,
+                         timeout_sec=SLEEP_TIME_SEC * SLEEP_COUNT)
+
+
+class VmNameIndex(object):
+    """
+    仮想マシン名から仮想マシンIDを引く索引。
+
+    仮想マシン一覧の1回の走査で構築し、ttl_sec 秒経過すると無効になる。
+    同名の仮想マシンがある場合は一覧で先に現れたものを採用する。
+
+    :param ttl_sec: 索引の有効期間(秒)。0を指定すると索引を使用しない。
+    """
+
+    def __init__(self, ttl_sec=VM_NAME_INDEX_TTL_SEC):
+        self.ttl_sec = ttl_sec
+        self._index = {}
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def is_expired(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return now >= self._expires_at
+
+    def get(self, vm_name):
+        """
+        索引が有効期間内であれば仮想マシンIDを返す。それ以外は None を返す。
+        """
+        with self._lock:
+            if self.is_expired():
+                return None
+            return self._index.get(vm_name)
+
+    def rebuild(self, vm_infos):
+        """
+        仮想マシン一覧(get_vm_list() の要素)から索引を作り直し、作り直した索引(dict)を返す
+        """
+        index = {}
+        for vm_info in vm_infos:
+            index.setdefault(vm_info["name"], vm_info["uuid"])
+        with self._lock:
+            self._index = index
+            self._expires_at = time.monotonic() + self.ttl_sec
+        return index
+
+    def put(self, vm_name, vm_id):
+        with self._lock:
+            self._index[vm_name] = vm_id
+
+    def remove(self, vm_name):
+        with self._lock:
+            self._index.pop(vm_name, None)
+
+    def clear(self):
+        with self._lock:
+            self._index = {}
+            self._expires_at = 0
 
 
 class MdxResourceExt(object):
@@ -88,37 +447,311 @@ class MdxResourceExt(object):
 
     :param init_token: mdx ユーザポータルから取得した mdx REST API 認証トークン
     :param endpoint: mdx REST API エンドポイント URL (オプショナル)
+    :param vm_index_ttl_sec: 仮想マシン名→仮想マシンIDの索引の有効期間(秒)。0を指定すると索引を使用しない。
+    :param polling_policy: 状態の待ち合わせの確認間隔と期限 (PollingPolicy)。省略時は既定値
+    :param cache: カタログ、セグメント、プロジェクト、グローバルIPのキャッシュ (ResourceCache)。
+      省略時はキャッシュしない。キャッシュしたリソースを変更する操作を行うと該当するキャッシュを破棄する。
+    :param lib_options: MdxLib に渡すオプション (pool_maxsize, keep_alive, token_refresh_margin_sec, retry_policy, rate_limiter,
+      connect_timeout_sec, read_timeout_sec, metrics, tracer など)。詳細は MdxLib を参照のこと。
+
+    HTTPコネクションは全てのメソッドで共有される。使用後は close() を呼ぶか、with文で使用すること。
+
+    .. code-block:: python
+
+      with MdxResourceExt(token, pool_maxsize=20) as mdx:
+          mdx.set_current_project_by_name(project_name)
+          mdx.get_vm_list()
     """
     # initの説明
 
-    def __init__(self, init_token=None, endpoint=DEFAULT_MDX_ENDPOINT):
-        self._mdxlib = MdxLib(endpoint=endpoint, init_token=init_token)
+    def __init__(self, init_token=None, endpoint=DEFAULT_MDX_ENDPOINT,
+                 vm_index_ttl_sec=VM_NAME_INDEX_TTL_SEC, polling_policy=None, cache=None,
+                 **lib_options):
+        self._mdxlib = MdxLib(endpoint=endpoint, init_token=init_token, **lib_options)
         self._project_id = None
+        self._vm_index = VmNameIndex(vm_index_ttl_sec)
+        if polling_policy is None:
+            polling_policy = default_polling_policy()
+        self._polling_policy = polling_policy
+        self._cache = cache
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        プールしているHTTPコネクションを閉じる
+        """
+        self._mdxlib.close()
 
     def _check_project_id(self):
         if self._project_id is None:
             raise MdxRestException("call set_project_id to set target mdx project")
 
+    def _cache_scope(self, per_project=True):
+        # 利用者毎に参照できるプロジェクトが異なるため、ディスクのキャッシュを共有しても
+        # 他の利用者のキャッシュを参照しないよう、トークンの利用者をスコープに含める
+        return "{}#{}#{}".format(self._mdxlib._endpoint, self._mdxlib._token_manager.identity,
+                                 self._project_id if per_project else "")
+
+    def _cached(self, resource, loader, per_project=True):
+        if self._cache is None:
+            return loader()
+        return self._cache.get_or_load(resource, self._cache_scope(per_project), loader)
+
+    def _invalidate_cache(self, resource):
+        if self._cache is not None:
+            self._cache.invalidate(resource, self._cache_scope())
+
+    def invalidate_cache(self, resource=None):
+        """
+        キャッシュを破棄する。他のクライアントでリソースを変更した場合などに呼び出す。
+
+        :param resource: リソース名 ("vm_catalogs", "segments", "assigned_projects",
+          "assignable_global_ipv4")。省略時は全てのキャッシュを破棄する
+        """
+        if self._cache is None:
+            return
+        if resource is None:
+            self._cache.clear()
+        else:
+            self._cache.invalidate(resource)
+
+    @traced
     def refresh_token(self):
         """
         mdx REST API 認証トークンを更新する
         """
         self._mdxlib.refresh_token()
 
+    def get_token_stats(self):
+        """
+        HTTPリクエスト数とトークンリフレッシュ回数を取得する
+
+        :returns: 以下のような統計情報
+
+        .. code-block:: json
+
+          {
+            "requests": "HTTPリクエスト数(リフレッシュを含む)",
+            "refreshes": "トークンリフレッシュ回数",
+            "unauthorized": "401応答によりリフレッシュ・再実行した回数",
+            "retries": "一時的なエラーにより再試行した回数",
+            "expires_at": "現在のトークンの有効期限(UNIX時刻)"
+          }
+
+        """
+        return self._mdxlib.get_token_stats()
+
+    def validate_specs(self, kind, specs):
+        """
+        複数の仕様を、API を呼び出さずにまとめて検証する。大量の仮想マシンやACLを操作する前の確認に使用する。
+
+        :param kind: 仕様の種類。 "vm_deploy", "vm_clone", "acl_ipv4", "acl_ipv4_edit", "acl_ipv6",
+          "acl_ipv6_edit", "dnat" のいずれか
+        :param specs: 仕様のリスト
+        :returns: 不正な仕様の位置とエラーのリスト。全て正しい場合は空のリスト。
+          詳細は mdx_validate.SpecValidatorRegistry.validate_many() を参照のこと。
+        """
+        return validate_specs(kind, specs)
+
+    @property
+    def metrics(self):
+        """
+        API呼び出しなどの計測値 (MdxMetrics)。 PrometheusExporter などのエクスポータに渡す
+        """
+        return self._mdxlib.metrics
+
+    def get_metrics(self):
+        """
+        API呼び出しの回数・所要時間・ステータス、トークンのリフレッシュ回数、再試行の回数、
+        待ち合わせのスリープ時間を取得する。詳細は MdxMetrics.snapshot() を参照のこと。
+
+        .. code-block:: python
+
+          metrics = mdx.get_metrics()
+          for request in metrics["requests"]:
+              print(request["method"], request["endpoint"], request["count"],
+                    request["latency_sec"]["sum"])
+
+        """
+        return self._mdxlib.metrics.snapshot()
+
+    @traced
     def set_first_password(self, host, password, ssh_key='~/.ssh/id_ed25519', username="mdxuser"):
+        """
+        仮想マシンにSSHで接続し、初回ログイン時に求められるパスワードを設定する
 
-        ssh_args = ("-o StrictHostKeyChecking=no " +
-                    "-o UserKnownHostsFile=/dev/null " +
-                    "-o PreferredAuthentications=publickey")
-        cmd = "ssh {} -i {} {}@{}".format(ssh_args, os.path.expanduser(ssh_key), username, host)
-        conn = pexpect.spawn(cmd, encoding='utf-8', timeout=30)
-        conn.expect("New password: ")
-        conn.sendline(password)
-        conn.expect("Retype new password: ")
-        conn.sendline(password)
-        conn.expect("passwd: password updated successfully")
+        :param host: 仮想マシンのIPアドレス
+        :param password: 設定するパスワード
+        :param ssh_key: SSH秘密鍵のパス
+        :param username: ユーザ名
+        :returns: "done" (設定した) または "already_set" (既に設定済み)
+        """
+        return _first_password_dialogue(host, password, ssh_key, username)
+
+    @traced
+    def set_first_passwords(self, hosts, password, ssh_key='~/.ssh/id_ed25519', username="mdxuser",
+                            max_workers=FLEET_MAX_WORKERS, retry_policy=None, timeout=None):
+        """
+        複数の仮想マシンの初回ログイン時のパスワード設定を、最大 max_workers 並列で実行する。
+
+        まだSSH接続を受け付けない仮想マシンは、retry_policy の待ち時間の後に再接続する。
+        待っている間も他の仮想マシンの設定は進め、一部の仮想マシンで失敗しても他の仮想マシンの処理は継続する。
+
+        .. code-block:: python
+
+          hosts = [vm_info["service_networks"][0]["ipv4_address"][0] for vm_info in vm_infos]
+          results = mdx.set_first_passwords(hosts, password, timeout=600)
+
+        :param hosts: 仮想マシンのIPアドレスのリスト
+        :param password: 設定するパスワード
+        :param ssh_key: SSH秘密鍵のパス
+        :param username: ユーザ名
+        :param max_workers: 同時に実行するSSH接続の最大数
+        :param retry_policy: SSH接続を受け付けない場合の再接続の方針 (RetryPolicy)。
+          省略時は SSH_CONNECT_MAX_ATTEMPTS 回まで、SSH_CONNECT_INITIAL_BACKOFF_SEC 秒から
+          SSH_CONNECT_MAX_BACKOFF_SEC 秒まで伸ばしながら再接続する
+        :param timeout: 全体の期限(秒)。期限までに設定できなかった仮想マシンは、
+          MdxTimeoutException を error とする failed となる
+        :returns: IPアドレスをキーとした以下のような結果
+
+        .. code-block:: json
+
+          {
+            "IPアドレス": {
+              "result": "done(設定した) / already_set(設定済み) / failed(失敗)",
+              "attempts": "SSH接続の試行回数",
+              "error": "失敗時の例外 (それ以外は None)"
+            }
+          }
 
-    def deploy_vm(self, vm_name, vm_spec, wait_for=True) -> list:
+        """
+        if retry_policy is None:
+            retry_policy = RetryPolicy(max_attempts=SSH_CONNECT_MAX_ATTEMPTS,
+                                       initial_backoff_sec=SSH_CONNECT_INITIAL_BACKOFF_SEC,
+                                       max_backoff_sec=SSH_CONNECT_MAX_BACKOFF_SEC)
+        with deadline_scope(timeout) as deadline:
+            results = self._set_first_passwords(hosts, password, ssh_key, username, max_workers,
+                                                retry_policy, deadline)
+        return {host: results[host] for host in hosts}
+
+    @staticmethod
+    def _set_first_passwords(hosts, password, ssh_key, username, max_workers, retry_policy,
+                             deadline):
+        results = {}
+        attempts = collections.Counter()
+        ready = collections.deque(dict.fromkeys(hosts))
+        # 再接続を待つホストの (再接続する時刻, 登録順, ホスト) のヒープ
+        retry_at = []
+        order = itertools.count()
+        running = {}
+
+        def result(host, status, error=None):
+            results[host] = {"result": status, "attempts": attempts[host], "error": error}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while ready or retry_at or running:
+                now = time.monotonic()
+                while retry_at and retry_at[0][0] <= now:
+                    ready.append(heapq.heappop(retry_at)[2])
+                expired = deadline is not None and deadline.expired(now)
+                if expired:
+                    # 実行中の対話は SSH_DIALOGUE_TIMEOUT_SEC と期限の短い方で打ち切られるため、終了を待つ
+                    for host in list(ready) + [host for _, _, host in retry_at]:
+                        result(host, "failed", deadline.exception("ssh"))
+                    ready.clear()
+                    retry_at = []
+                while ready and len(running) < max_workers:
+                    host = ready.popleft()
+                    attempts[host] += 1
+                    future = submit_in_context(executor, _first_password_dialogue, host, password,
+                                               ssh_key, username)
+                    running[future] = host
+                if not running and not retry_at:
+                    continue
+
+                delay = retry_at[0][0] - now if retry_at else None
+                if deadline is not None and not expired:
+                    remaining = deadline.remaining(now)
+                    delay = remaining if delay is None else min(delay, remaining)
+                if not running:
+                    time.sleep(max(0.0, delay))
+                    continue
+                done, _ = wait(running, timeout=delay, return_when=FIRST_COMPLETED)
+                for future in done:
+                    host = running.pop(future)
+                    try:
+                        status = future.result()
+                    except _SshNotReady as e:
+                        if retry_policy.should_retry(attempts[host], idempotent=False,
+                                                     connect_error=True):
+                            backoff = retry_policy.backoff(attempts[host])
+                            logger.debug("{}: retry in {:.1f}s: {}".format(host, backoff, e))
+                            heapq.heappush(retry_at, (time.monotonic() + backoff, next(order), host))
+                        else:
+                            result(host, "failed", e)
+                    except Exception as e:
+                        logger.debug("{}: set_first_password is failed: {}".format(host, e))
+                        result(host, "failed", e)
+                    else:
+                        result(host, status)
+        return results
+
+    @traced_iter
+    def wait_ssh_ready_iter(self, hosts, port=22, read_banner=True, timeout=SSH_READY_TIMEOUT_SEC,
+                            interval_sec=SSH_PROBE_INTERVAL_SEC,
+                            max_connections=SSH_PROBE_MAX_CONNECTIONS):
+        """
+        複数の仮想マシンのSSH接続の待ち合わせを行い、接続できるようになった仮想マシンから順に結果を返す
+        イテレータを返す。
+
+        IPv4アドレスが付与されても sshd がまだ起動していない場合があるため、ノンブロッキングソケットで
+        全ての仮想マシンに並行して接続を試み、SSHバナーを受信できた仮想マシンから返す。
+
+        .. code-block:: python
+
+          hosts = [vm_info["service_networks"][0]["ipv4_address"][0] for vm_info in vm_infos]
+          for host, result in mdx.wait_ssh_ready_iter(hosts):
+              if result["result"] == "ready":
+                  # 接続できるようになった仮想マシンからセットアップを始める
+                  setup(host)
+
+        :param hosts: 仮想マシンのIPアドレスのリスト
+        :param port: 接続するポート
+        :param read_banner: SSHバナーの受信まで待つ場合 ``True`` を指定。 ``False`` の場合はTCP接続のみ確認する
+        :param timeout: 待ち合わせの期限(秒)。deadline_scope() の期限の方が早い場合はそちらに従う。
+          ``None`` の場合は全ての仮想マシンに接続できるまで待つ
+        :param interval_sec: 接続に失敗した後、再び接続するまでの秒数
+        :param max_connections: 同時に接続を試みるソケット数の上限
+        :returns: (IPアドレス, 結果) のタプルを返すイテレータ。結果の詳細は mdx_probe.probe_ssh_iter() を参照のこと。
+        """
+        deadline = current_deadline()
+        if timeout is not None:
+            own = Deadline(timeout)
+            if deadline is None or own.expires_at < deadline.expires_at:
+                deadline = own
+        return probe_ssh_iter(hosts, port=port, read_banner=read_banner, interval_sec=interval_sec,
+                              max_connections=max_connections, deadline=deadline)
+
+    @traced
+    def wait_ssh_ready(self, hosts, port=22, read_banner=True, timeout=SSH_READY_TIMEOUT_SEC,
+                       interval_sec=SSH_PROBE_INTERVAL_SEC, max_connections=SSH_PROBE_MAX_CONNECTIONS):
+        """
+        複数の仮想マシンのSSH接続の待ち合わせを行い、全ての仮想マシンの結果を返す。
+        引数は wait_ssh_ready_iter() を参照のこと。
+
+        :returns: IPアドレスをキーとした結果。詳細は mdx_probe.probe_ssh_iter() を参照のこと。
+        """
+        results = dict(self.wait_ssh_ready_iter(hosts, port, read_banner, timeout, interval_sec,
+                                                max_connections))
+        return {host: results[host] for host in hosts}
+
+    @traced
+    def deploy_vm(self, vm_name, vm_spec, wait_for=True, timeout=None) -> list:
         '''
         仮想マシンのデプロイを実行する。wait_forが ``True`` の場合、仮想マシンにIPv4アドレスが付与されるまで待つ。
 
@@ -144,46 +777,50 @@ class MdxResourceExt(object):
             "template_name": "vCenter上の仮想マシンテンプレート名",
           }
 
-        :param wait_for: 仮想マシンにIPv4アドレスが付与されるまで待つ場合 ``True`` を指定
+        :param wait_for: 仮想マシンにIPv4アドレスが付与されるまで待つ場合 ``True`` を指定。
+          複数の仮想マシンを作成する場合は全ての仮想マシンを並行して待つ。
+        :param timeout: 操作全体の期限(秒)。API呼び出しと状態の待ち合わせで共有し、超えた場合は
+          MdxTimeoutException を送出する
         :returns: 仮想マシン情報。詳細は get_vm_info() を参照のこと。
         '''
-        # 専有プロジェクトの場合
-        # "cpu": CPU数(※専有プロジェクトの場合に必要)
-        # "memory": メモリ量(GB) (※専有プロジェクトの場合に必要)
-
-        self._check_project_id()
+        with deadline_scope(timeout):
+            deployed_vm_ids = self._deploy_vm(vm_name, vm_spec)
+            if wait_for:
+                vm_infos = {vm_info["vm_id"]: vm_info
+                            for vm_info in self._iter_deployed_vms(vm_name, deployed_vm_ids)}
+                return [vm_infos[vm_id] for vm_id in deployed_vm_ids]
+            return [self._mdxlib.get_vm_info(vm_id) for vm_id in deployed_vm_ids]
 
-        jsonschema.validate(vm_spec, MDX_VM_SPEC_SCHEMA)
+    @traced_iter
+    def deploy_vm_iter(self, vm_name, vm_spec):
+        '''
+        仮想マシンのデプロイを実行し、IPv4アドレスが付与された仮想マシンから順に仮想マシン情報を返す
+        イテレータを返す。引数は deploy_vm() を参照のこと。
 
-        # OSタイプ、デプロイ後の起動指定は固定値とする
-        vm_spec["os_type"] = "Linux"
-        vm_spec["power_on"] = True
+        .. code-block:: python
 
-        vm_spec["project"] = self._project_id
-        vm_spec["vm_name"] = vm_name
+          for vm_info in mdx.deploy_vm_iter("vm-[1-20]", vm_spec):
+              # 準備ができた仮想マシンからセットアップを始める
+              setup(vm_info)
 
-        deployed_vm_tasks = self._mdxlib.deploy_vm(vm_spec)
-        if wait_for:
-            for vm_task in deployed_vm_tasks:
-                vm_id = vm_task['object_uuid']
-                self._wait_until(vm_id, "PowerON")
-                for i in range(0, DEPLOY_VM_SLEEP_COUNT):
-                    vm_info = self._mdxlib.get_vm_info(vm_id)
-                    private_ip_address = vm_info["service_networks"][0]["ipv4_address"][0]
-                    logger.debug("{} {}".format(i, private_ip_address))
-                    try:
-                        ipaddress.ip_address(private_ip_address)
-                        break
-                    except ValueError:
-                        time.sleep(SLEEP_TIME_SEC)
-                else:
-                    raise MdxRestException("{}: timeout: allocate ip address".format(vm_name))
-        vm_infos = []
-        for task in deployed_vm_tasks:
-            vm_infos.append(self._mdxlib.get_vm_info(task['object_uuid']))
-        return vm_infos
+        '''
+        return self._iter_deployed_vms(vm_name, self._deploy_vm(vm_name, vm_spec))
 
-    def clone_vm(self, original_vm_name, vm_name, vm_spec, power_on=False, wait_for=True):
+    def _deploy_vm(self, vm_name, vm_spec):
+        self._check_project_id()
+        vm_spec = _deploy_spec(vm_spec, vm_name, self._project_id)
+        return _index_deployed_vms(self._vm_index, self._mdxlib.deploy_vm(vm_spec))
+
+    def _iter_deployed_vms(self, vm_name, vm_ids, operation="deploy"):
+        # 全ての仮想マシンの起動とIPv4アドレスの付与をまとめて待つ
+        waiter = self.create_state_waiter()
+        _watch_ready_vms(waiter, vm_ids, operation)
+        for watch in waiter.iter_completed():
+            yield _ready_vm_result(vm_name, watch)
+
+    @traced
+    def clone_vm(self, original_vm_name, vm_name, vm_spec, power_on=False, wait_for=True,
+                 timeout=None):
         '''
         仮想マシンのクローンを実行する。
 
@@ -210,158 +847,277 @@ class MdxResourceExt(object):
         :param power_on: クローン後起動する場合 ``True`` を指定
         :param wait_for: 仮想マシン起動後、仮想マシンにIPv4アドレスが付与されるまで待つ場合 ``True`` を指定
           power_on=Falseの場合、Trueを指定しても無効。
+        :param timeout: 操作全体の期限(秒)。API呼び出しと状態の待ち合わせで共有し、超えた場合は
+          MdxTimeoutException を送出する
         :returns: 仮想マシン情報。詳細は get_vm_info() を参照のこと。
         '''
+        with deadline_scope(timeout):
+            self._check_project_id()
+            vm_spec = _clone_spec(vm_spec, vm_name, self._project_id)
 
-        self._check_project_id()
-
-        # OSタイプ指定は固定値とする
-        vm_spec["os_type"] = "Linux"
-        vm_spec["project"] = self._project_id
-        vm_spec["vm_name"] = vm_name
-
-        org_vm_id = self._find_vm(original_vm_name)
+            org_vm_id, _ = self._find_vm_info(original_vm_name)
 
-        self._mdxlib.clone_vm(org_vm_id, vm_spec)
-        vm_id = self._find_vm(vm_name)
+            self._mdxlib.clone_vm(org_vm_id, vm_spec)
+            vm_id = self._find_vm(vm_name)
 
-        if power_on:
-            # クローン完了前に起動しようとすると失敗するので待機する
-            self._wait_until(vm_id, "PowerOFF")
-            self._mdxlib.power_on_vm(vm_id, vm_spec.get('service_level'))
-            if wait_for:
-                self._wait_until(vm_id, "PowerON")
-                for i in range(0, DEPLOY_VM_SLEEP_COUNT):
-                    vm_info = self._mdxlib.get_vm_info(vm_id)
-                    private_ip_address = vm_info["service_networks"][0]["ipv4_address"][0]
-                    logger.debug("{} {}".format(i, private_ip_address))
-                    if re.match(r"^[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+$", private_ip_address) is not None:
-                        break
-                    time.sleep(SLEEP_TIME_SEC)
-                else:
-                    raise MdxRestException("{}: timeout: allocate ip address".format(vm_name))
+            if power_on:
+                # クローン完了前に起動しようとすると失敗するので待機する
+                self._wait_until(vm_id, "PowerOFF", operation="clone")
+                self._mdxlib.power_on_vm(vm_id, vm_spec.get('service_level'))
+                if wait_for:
+                    # 起動とIPv4アドレスの付与を待つ
+                    return list(self._iter_deployed_vms(vm_name, [vm_id], operation="power_on"))[0]
 
-        return self._mdxlib.get_vm_info(vm_id)
+            return self._mdxlib.get_vm_info(vm_id)
 
-    def destroy_vm(self, vm_name, wait_for=True):
+    @traced
+    def destroy_vm(self, vm_name, wait_for=True, timeout=None):
         """
         仮想マシンの削除を実行する。事前に仮想マシンを PowerOFF 状態にしておく必要がある。
 
         :param vm_name: 仮想マシン名
         :param wait_for: 削除完了を待つ場合 ``True`` を指定
+        :param timeout: 操作全体の期限(秒)。API呼び出しと状態の待ち合わせで共有し、超えた場合は
+          MdxTimeoutException を送出する
         """
+        with deadline_scope(timeout):
+            self._check_project_id()
+            vm_id, vm_info = self._find_vm_info(vm_name)
 
-        self._check_project_id()
-        vm_id = self._find_vm(vm_name)
+            _check_destroyable(vm_info["status"])
 
-        vm_info = self._get_vm_info_by_id(vm_id)
-        if vm_info["status"] not in DELETABLE_STATE:
-            raise MdxRestException(
-                "mdxext: destroy_vm vm status is not PowerOFF or Deallocated but {}, please power_off first".format(vm_info["status"]))
-
-        # TODO: 仮想マシンの事前状態のチェックがmdx rest api側にない?
-        self._mdxlib.destroy_vm(vm_id)
+            # TODO: 仮想マシンの事前状態のチェックがmdx rest api側にない?
+            self._mdxlib.destroy_vm(vm_id)
+            self._vm_index.remove(vm_name)
+            if not wait_for:
+                return
 
-        for _i in range(0, SLEEP_COUNT):
             # 仮想マシン情報から消えるまで待つ
-            time.sleep(SLEEP_TIME_SEC)
-            res = self._mdxlib._call_api("/api/vm/{}/".format(vm_id), method="GET")
-            logger.debug("{}: destroy_vm status_code {} {}".format(vm_name, res.status_code, res.text))
-            if res.status_code == 404:
-                # 削除完了
-                break
-        else:
-            raise MdxRestException("destroy_vm is failed: {}".format(vm_name))
+            try:
+                self._wait_until(vm_id, VM_NOT_FOUND, operation="destroy")
+            except MdxRestException as e:
+                raise _destroy_error(vm_name, e)
 
-    def power_on_vm(self, vm_name, service_level="spot", wait_for=True):
+    @traced
+    def power_on_vm(self, vm_name, service_level="spot", wait_for=True, timeout=None):
         """
         仮想マシンの起動 (PowerON) を実行する。
 
         :param vm_name: 仮想マシン名
         :param wait_for: 起動の完了を待つ場合 ``True`` を指定
+        :param timeout: 操作全体の期限(秒)。API呼び出しと状態の待ち合わせで共有し、超えた場合は
+          MdxTimeoutException を送出する
         """
-        self._check_project_id()
-        vm_id = self._find_vm(vm_name)
+        with deadline_scope(timeout):
+            self._check_project_id()
+            vm_id, vm_info = self._find_vm_info(vm_name)
 
-        vm_info = self._get_vm_info_by_id(vm_id)
-        if vm_info["status"] == "PowerON":
-            logger.debug("vm is already power on")
-            return
-        if vm_info["status"] not in DELETABLE_STATE:
-            raise MdxRestException(
-                "mdxext: power_off_vm vm status is not PowerOFF or deallocated but {}".format(
-                    vm_info["status"]))
-        self._mdxlib.power_on_vm(vm_id, service_level)
-        if wait_for:
-            self._wait_until(vm_id, "PowerON")
+            status = self._request_power_operation("power_on", vm_id, service_level, vm_info=vm_info)
+            if status is not None and wait_for:
+                self._wait_until(vm_id, status, operation="power_on")
 
-    def power_off_vm(self, vm_name, wait_for=True):
+    @traced
+    def power_off_vm(self, vm_name, wait_for=True, timeout=None):
         """
         仮想マシンの強制停止 (PowerOFF) を実行する。
 
         :param vm_name: 仮想マシン名
         :param wait_for: 強制停止の完了を待つ場合 ``True`` を指定
+        :param timeout: 操作全体の期限(秒)。API呼び出しと状態の待ち合わせで共有し、超えた場合は
+          MdxTimeoutException を送出する
         """
-        self._check_project_id()
-        vm_id = self._find_vm(vm_name)
-
-        vm_info = self._get_vm_info_by_id(vm_id)
-        if vm_info["status"] in DELETABLE_STATE:
-            logger.debug("vm is already power off or deallocated")
-            return
-        if vm_info["status"] != "PowerON":
-            raise MdxRestException("mdxext: power_off_vm vm status is not PowerON but {}".format(vm_info["status"]))
+        with deadline_scope(timeout):
+            self._check_project_id()
+            vm_id, vm_info = self._find_vm_info(vm_name)
 
-        self._mdxlib.power_off_vm(vm_id)
-        if wait_for:
-            self._wait_until(vm_id, "PowerOFF")
+            status = self._request_power_operation("power_off", vm_id, vm_info=vm_info)
+            if status is not None and wait_for:
+                self._wait_until(vm_id, status, operation="power_off")
 
-    def power_shutdown_vm(self, vm_name, wait_for=True):
+    @traced
+    def power_shutdown_vm(self, vm_name, wait_for=True, timeout=None):
         """
         仮想マシンのゲストOSのシャットダウンを実行する。
 
         :param vm_name: 仮想マシン名
         :param wait_for: シャットダウンの完了を待つ場合 ``True`` を指定
+        :param timeout: 操作全体の期限(秒)。API呼び出しと状態の待ち合わせで共有し、超えた場合は
+          MdxTimeoutException を送出する
         """
-        self._check_project_id()
-        vm_id = self._find_vm(vm_name)
-
-        vm_info = self._get_vm_info_by_id(vm_id)
-        # 事前条件　PowerOn
-        if vm_info["status"] in DELETABLE_STATE:
-            logger.debug("vm is already power off or deallocated")
-            return
-        if vm_info["status"] != "PowerON":
-            raise MdxRestException("mdxext: power_shutdown_vm vm status is not PowerON but {}".format(vm_info["status"]))
-        # TODO: 操作履歴IDを返す?
-        self._mdxlib.shutdown_vm(vm_id)
+        with deadline_scope(timeout):
+            self._check_project_id()
+            vm_id, vm_info = self._find_vm_info(vm_name)
 
-        if wait_for:
-            self._wait_until(vm_id, "PowerOFF")
+            status = self._request_power_operation("shutdown", vm_id, vm_info=vm_info)
+            if status is not None and wait_for:
+                self._wait_until(vm_id, status, operation="shutdown")
 
-    def reboot_vm(self, vm_name, wait_for=True):
+    @traced
+    def reboot_vm(self, vm_name, wait_for=True, timeout=None):
         """
         仮想マシンの再起動を実行する。
 
         :param vm_name: 仮想マシン名
         :param wait_for: 再起動の完了を待つ場合 ``True`` を指定
+        :param timeout: 操作全体の期限(秒)。API呼び出しと状態の待ち合わせで共有し、超えた場合は
+          MdxTimeoutException を送出する
+        """
+        with deadline_scope(timeout):
+            # 実行履歴で確認したところ10秒で完了する
+            self._check_project_id()
+            vm_id, vm_info = self._find_vm_info(vm_name)
+
+            status = self._request_power_operation("reboot", vm_id, vm_info=vm_info)
+            if status is not None and wait_for:
+                # 再起動中も PowerON のままのため、再起動のタスクがなくなるまで待つ
+                self._wait_until(vm_id, status, operation="reboot", idle=True)
+
+    def _request_power_operation(self, operation, vm_id, service_level="spot", vm_info=None):
+        """
+        仮想マシンの事前状態を確認して電源操作を要求し、完了時の状態を返す。
+        既に操作後の状態であれば要求せずに None を返す。
+        事前状態が操作できない状態であれば例外を送出する。
+
+        :param vm_info: 取得済みの仮想マシン情報。省略時は取得する
         """
-        # 実行履歴で確認したところ10秒で完了する
+        if vm_info is None:
+            vm_info = self._get_vm_info_by_id(vm_id)
+        status = _power_operation_target(operation, vm_info["status"])
+        if status is None:
+            return None
+        if operation == "power_on":
+            self._mdxlib.power_on_vm(vm_id, service_level)
+        elif operation == "reboot":
+            self._mdxlib.reboot_vm(vm_id)
+        elif operation == "power_off":
+            self._mdxlib.power_off_vm(vm_id)
+        else:
+            # TODO: 操作履歴IDを返す?
+            self._mdxlib.shutdown_vm(vm_id)
+        return status
+
+    @traced
+    def power_on_vms(self, vm_names, service_level="spot", wait_for=True,
+                     max_workers=FLEET_MAX_WORKERS, timeout=None):
+        """
+        複数の仮想マシンの起動 (PowerON) をまとめて実行する。
+
+        仮想マシン名の解決は仮想マシン一覧の1回の取得で行い、状態の確認と起動の要求は
+        最大 max_workers 並列で実行し、起動の完了は全仮想マシンまとめて待つ。
+        一部の仮想マシンで失敗しても、他の仮想マシンの処理は継続する。
+
+        :param vm_names: 仮想マシン名のリスト
+        :param wait_for: 起動の完了を待つ場合 ``True`` を指定
+        :param max_workers: 同時に実行するAPI呼び出しの最大数
+        :param timeout: 操作全体の期限(秒)。期限までに完了しなかった仮想マシンは、
+          MdxTimeoutException を error とする failed となる
+        :returns: 仮想マシン名をキーとした以下のような結果
+
+        .. code-block:: json
+
+          {
+            "仮想マシン名": {
+              "vm_id": "仮想マシンID (見つからない場合は None)",
+              "result": "done(完了) / requested(要求のみ、wait_for=False) / skipped(操作済み) / failed(失敗)",
+              "error": "失敗時の例外 (それ以外は None)"
+            }
+          }
+
+        """
+        return self._power_vms("power_on", vm_names, wait_for, max_workers, timeout,
+                               service_level)
+
+    @traced
+    def power_off_vms(self, vm_names, wait_for=True, max_workers=FLEET_MAX_WORKERS,
+                      timeout=None):
+        """
+        複数の仮想マシンの強制停止 (PowerOFF) をまとめて実行する。
+        引数と返り値は power_on_vms() を参照のこと。
+        """
+        return self._power_vms("power_off", vm_names, wait_for, max_workers, timeout)
+
+    @traced
+    def shutdown_vms(self, vm_names, wait_for=True, max_workers=FLEET_MAX_WORKERS,
+                     timeout=None):
+        """
+        複数の仮想マシンのゲストOSのシャットダウンをまとめて実行する。
+        引数と返り値は power_on_vms() を参照のこと。
+        """
+        return self._power_vms("shutdown", vm_names, wait_for, max_workers, timeout)
+
+    @traced
+    def reboot_vms(self, vm_names, wait_for=True, max_workers=FLEET_MAX_WORKERS,
+                   timeout=None):
+        """
+        複数の仮想マシンの再起動をまとめて実行する。
+        引数と返り値は power_on_vms() を参照のこと。
+        """
+        return self._power_vms("reboot", vm_names, wait_for, max_workers, timeout)
+
+    def _power_vms(self, operation, vm_names, wait_for, max_workers, timeout,
+                   service_level="spot"):
+        with deadline_scope(timeout):
+            return self._power_vms_within_deadline(operation, vm_names, wait_for, max_workers,
+                                                   service_level)
+
+    def _power_vms_within_deadline(self, operation, vm_names, wait_for, max_workers,
+                                   service_level):
         self._check_project_id()
-        vm_id = self._find_vm(vm_name)
+        results = {}
+        vm_ids = {}
+        # 一覧の1回の取得で全ての仮想マシン名を解決する
+        vm_index = self._vm_index.rebuild(self.vm_info_iter())
+        for vm_name in vm_names:
+            if vm_name in vm_index:
+                vm_ids[vm_name] = vm_index[vm_name]
+            else:
+                results[vm_name] = self._fleet_result(
+                    None, "failed", MdxRestException("vm {} is not found".format(vm_name)))
+
+        waiting = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                submit_in_context(executor, self._request_power_operation, operation, vm_id,
+                                  service_level): vm_name
+                for vm_name, vm_id in vm_ids.items()
+            }
+            for future in as_completed(futures):
+                vm_name = futures[future]
+                vm_id = vm_ids[vm_name]
+                try:
+                    status = future.result()
+                except Exception as e:
+                    logger.debug("{}: {} is failed: {}".format(vm_name, operation, e))
+                    results[vm_name] = self._fleet_result(vm_id, "failed", e)
+                    continue
+                if status is None:
+                    results[vm_name] = self._fleet_result(vm_id, "skipped")
+                elif wait_for:
+                    waiting[vm_id] = status
+                else:
+                    results[vm_name] = self._fleet_result(vm_id, "requested")
+
+        if waiting:
+            # 再起動中も PowerON のままのため、再起動のタスクがなくなるまで待つ
+            errors = self._wait_until_all(waiting, operation=operation, idle=operation == "reboot")
+            for vm_name, vm_id in vm_ids.items():
+                if vm_id not in waiting:
+                    continue
+                if vm_id in errors:
+                    results[vm_name] = self._fleet_result(vm_id, "failed", errors[vm_id])
+                else:
+                    results[vm_name] = self._fleet_result(vm_id, "done")
 
-        vm_info = self._get_vm_info_by_id(vm_id)
-        # 事前条件　PowerOn
-        if vm_info["status"] != "PowerON":
-            raise MdxRestException("mdxext: reboot_vm vm status is not PowerON but {}".format(vm_info["status"]))
-        self._mdxlib.reboot_vm(vm_id)
+        return {vm_name: results[vm_name] for vm_name in vm_names}
 
-        if wait_for:
-            self._wait_until(vm_id, "PowerON")
+    @staticmethod
+    def _fleet_result(vm_id, result, error=None):
+        return {"vm_id": vm_id, "result": result, "error": error}
 
     def _get_vm_info_by_id(self, vm_id):
         return self._mdxlib.get_vm_info(vm_id)
 
+    @traced
     def get_vm_info(self, vm_name):
         """
         仮想マシンの詳細情報を取得する
@@ -418,11 +1174,9 @@ class MdxResourceExt(object):
 
         """
         self._check_project_id()
-        vm_id = self._get_vm_id_by_vm_name(vm_name)
-        if vm_id is None:
-            return None
-        return self._get_vm_info_by_id(vm_id)
+        return self._get_vm_by_vm_name(vm_name)[1]
 
+    @traced
     def get_vm_list(self):
         """
         プロジェクトに属する仮想マシン情報を取得する
@@ -445,6 +1199,72 @@ class MdxResourceExt(object):
         self._check_project_id()
         return list(self.vm_info_iter())
 
+    @traced
+    def snapshot(self, previous=None, max_workers=FLEET_MAX_WORKERS, timeout=None):
+        """
+        プロジェクトの全仮想マシンの詳細情報を取得し、索引付きのスナップショットを返す。
+
+        仮想マシン一覧を1回取得し、各仮想マシンの詳細情報を最大 max_workers 並列で取得する。
+        previous に前回のスナップショットを渡すと、一覧の状態(名前、状態、実行中のタスク)が変わった
+        仮想マシンと新しい仮想マシンのみ詳細情報を取得し直し、それ以外は前回の詳細情報を再利用する。
+
+        .. code-block:: python
+
+          inventory = mdx.snapshot()
+          vm = inventory.find_by_ip("10.1.0.10")
+          # 状態が変わった仮想マシンのみ取得し直す
+          inventory = mdx.snapshot(previous=inventory)
+
+        :param previous: 前回のスナップショット (VmInventory)
+        :param max_workers: 同時に実行するAPI呼び出しの最大数
+        :param timeout: 操作全体の期限(秒)
+        :returns: VmInventory。一覧の取得後に削除された仮想マシンは含まない。
+          詳細情報の取得に失敗した仮想マシンは info が ``None`` 、 error が例外となる
+        """
+        self._check_project_id()
+        with deadline_scope(timeout):
+            taken_at = time.time()
+            summaries = list(self.vm_info_iter())
+            self._vm_index.rebuild(summaries)
+
+            vms = []
+            fetching = []
+            for summary in summaries:
+                vm = {"vm_id": summary["uuid"], "name": summary["name"],
+                      "status": summary["status"], "summary": summary, "info": None, "error": None}
+                vms.append(vm)
+                old = None if previous is None else previous.get(vm["vm_id"])
+                if (old is not None and old["info"] is not None
+                        and list_state(old["summary"]) == list_state(summary)):
+                    vm["info"] = old["info"]
+                else:
+                    fetching.append(vm)
+
+            deleted = set()
+            if fetching:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {
+                        submit_in_context(executor, self._get_vm_info_by_id, vm["vm_id"]): vm
+                        for vm in fetching
+                    }
+                    for future in as_completed(futures):
+                        vm = futures[future]
+                        try:
+                            vm["info"] = future.result()
+                        except MdxRestException as e:
+                            if e.status_code == 404:
+                                deleted.add(vm["vm_id"])
+                                continue
+                            logger.debug("{}: get_vm_info is failed: {}".format(vm["name"], e))
+                            vm["error"] = e
+                        except Exception as e:
+                            logger.debug("{}: get_vm_info is failed: {}".format(vm["name"], e))
+                            vm["error"] = e
+
+        return VmInventory([vm for vm in vms if vm["vm_id"] not in deleted], taken_at=taken_at,
+                           fetched=len(fetching), reused=len(vms) - len(fetching))
+
+    @traced
     def get_vm_catalogs(self):
         """
         プロジェクトに紐づいた仮想マシンデプロイカタログ情報を取得する
@@ -470,8 +1290,10 @@ class MdxResourceExt(object):
 
         """
         self._check_project_id()
-        return self._mdxlib.get_vm_catalogs(self._project_id)
+        return self._cached("vm_catalogs",
+                            lambda: self._mdxlib.get_vm_catalogs(self._project_id))
 
+    @traced
     def get_vm_history(self, vm_name):
         """
         仮想マシンの操作履歴情報を取得する
@@ -506,6 +1328,7 @@ class MdxResourceExt(object):
             return None
         return self._mdxlib.get_vm_history(vm_id)
 
+    @traced
     def get_assigned_projects(self):
         """
         ユーザに紐付いたプロジェクト情報を取得する
@@ -531,27 +1354,40 @@ class MdxResourceExt(object):
 
         """
         # _check_project_idは不要
-        return self._mdxlib.get_assigned_projects()
+        return self._cached("assigned_projects", self._mdxlib.get_assigned_projects,
+                            per_project=False)
 
     def set_current_project_id(self, project_id):
         """
         操作対象のmdxのプロジェクトIDを設定する
         """
         self._project_id = project_id
+        self._vm_index.clear()
 
+    @traced
     def set_current_project_by_name(self, project_name):
         """
         操作対象のmdxのプロジェクトをプロジェクト名で設定する
         """
-        org_list = self._mdxlib.get_assigned_projects()
-        for org in org_list:
-            for proj in org["projects"]:
-                if proj["name"] == project_name:
-                    self._project_id = proj["uuid"]
-                    return
+        project_id = _find_project_id(self.get_assigned_projects(), project_name)
+        if project_id is None and self._cache is not None:
+            # キャッシュした後に割り当てられたプロジェクトの可能性がある
+            self._cache.invalidate("assigned_projects", self._cache_scope(per_project=False))
+            project_id = _find_project_id(self.get_assigned_projects(), project_name)
+        if project_id is not None:
+            self.set_current_project_id(project_id)
+            return
 
         raise MdxRestException(f"mdx_ext: project {project_name} is not found")
 
+    def invalidate_vm_index(self):
+        """
+        仮想マシン名→仮想マシンIDの索引を破棄する。
+        他のクライアントで仮想マシンを作成・削除した場合などに呼び出す。
+        """
+        self._vm_index.clear()
+
+    @traced
     def get_current_project(self):
         """
         操作対象のmdxのプロジェクトの取得
@@ -570,14 +1406,14 @@ class MdxResourceExt(object):
         """
         if self._project_id is None:
             return None
-        org_list = self._mdxlib.get_assigned_projects()
-        for org in org_list:
+        for org in self.get_assigned_projects():
             for proj in org["projects"]:
                 if proj["uuid"] == self._project_id:
                     return proj
         return None
 
     # network
+    @traced
     def get_allow_acl_ipv4_info(self, segment_id):
         """
         Allow ACL IPv4情報の取得
@@ -604,6 +1440,7 @@ class MdxResourceExt(object):
         self._check_project_id()
         return self._mdxlib.get_allow_acl_ipv4_info(segment_id)
 
+    @traced
     def add_allow_acl_ipv4_info(self, allow_acl_spec):
         """
         指定したセグメントにAllow ACL IPv4を追加する
@@ -625,8 +1462,10 @@ class MdxResourceExt(object):
 
         """
         self._check_project_id()
+        validate_spec("acl_ipv4", allow_acl_spec)
         return self._mdxlib.add_allow_acl_ipv4_info(allow_acl_spec)
 
+    @traced
     def edit_allow_acl_ipv4_info(self, allow_acl_id, allow_acl_spec):
         """
         指定したAllow ACL IPv4を編集する
@@ -647,9 +1486,11 @@ class MdxResourceExt(object):
 
         """
         self._check_project_id()
+        validate_spec("acl_ipv4_edit", allow_acl_spec)
         return self._mdxlib.edit_allow_acl_ipv4_info(allow_acl_id,
                                                      allow_acl_spec)
 
+    @traced
     def delete_allow_acl_ipv4_info(self, acl_ipv4_id):
         """
         :param acl_ipv4_id: 削除対象の Allow ACL IPv4 ID
@@ -657,6 +1498,7 @@ class MdxResourceExt(object):
         self._check_project_id()
         self._mdxlib.delete_allow_acl_ipv4_info(acl_ipv4_id)
 
+    @traced
     def get_allow_acl_ipv6_info(self, segment_id):
         """
         Allow ACL IPv6情報の取得
@@ -683,6 +1525,7 @@ class MdxResourceExt(object):
         self._check_project_id()
         return self._mdxlib.get_allow_acl_ipv6_info(segment_id)
 
+    @traced
     def add_allow_acl_ipv6_info(self, allow_acl_spec):
         """
         指定したセグメントにAllow ACL IPv6を追加する
@@ -704,8 +1547,10 @@ class MdxResourceExt(object):
 
         """
         self._check_project_id()
+        validate_spec("acl_ipv6", allow_acl_spec)
         return self._mdxlib.add_allow_acl_ipv6_info(allow_acl_spec)
 
+    @traced
     def edit_allow_acl_ipv6_info(self, allow_acl_id, allow_acl_spec):
         """
         指定したAllow ACL IPv6を編集する
@@ -726,9 +1571,11 @@ class MdxResourceExt(object):
 
         """
         self._check_project_id()
+        validate_spec("acl_ipv6_edit", allow_acl_spec)
         return self._mdxlib.edit_allow_acl_ipv6_info(allow_acl_id,
                                                      allow_acl_spec)
 
+    @traced
     def delete_allow_acl_ipv6_info(self, acl_ipv6_id):
         """
         :param acl_ipv6_id: 削除対象の Allow ACL IPv6 ID
@@ -736,7 +1583,74 @@ class MdxResourceExt(object):
         self._check_project_id()
         self._mdxlib.delete_allow_acl_ipv6_info(acl_ipv6_id)
 
+    @traced
+    def reconcile_acl(self, segment_id, ipv4=None, ipv6=None, prune=True, dry_run=False,
+                      max_workers=FLEET_MAX_WORKERS, timeout=None):
+        """
+        セグメントのAllow ACLを、指定したルールの集合に一致させる。
+
+        現在のルールを1回取得し、望ましいルールとの差分から最小の追加・編集・削除の計画を作成して、
+        最大 max_workers 並列で適用する。既に一致している場合は取得のみ行う。
+        一部のルールの変更に失敗しても、他のルールの変更は継続する。
+
+        .. code-block:: python
+
+          result = mdx.reconcile_acl(segment_id, ipv4=[
+              {"src_address": "0.0.0.0", "src_mask": "0", "src_port": "Any",
+               "dst_address": "10.1.0.0", "dst_mask": "16", "dst_port": "22", "protocol": "TCP"},
+          ], dry_run=True)
+
+        :param segment_id: ネットワークセグメントID
+        :param ipv4: 望ましいAllow ACL IPv4のリスト。仕様は add_allow_acl_ipv4_info() を参照のこと
+          (segment は省略できる)。 ``None`` の場合はIPv4のACLを変更しない
+        :param ipv6: 望ましいAllow ACL IPv6のリスト。 ``None`` の場合はIPv6のACLを変更しない
+        :param prune: 指定したルールにない既存のルールを削除(または編集して再利用)する場合 ``True`` を指定
+        :param dry_run: 計画の作成のみ行い、変更しない場合 ``True`` を指定
+        :param max_workers: 同時に実行するAPI呼び出しの最大数
+        :param timeout: 操作全体の期限(秒)
+        :returns: 以下のような結果
+
+        .. code-block:: json
+
+          {
+            "dry_run": "dry_run の値",
+            "unchanged": "変更の必要がなかったルール数",
+            "actions": [
+              {
+                "action": "add / edit / delete",
+                "kind": "acl_ipv4 / acl_ipv6",
+                "id": "編集・削除したルールのID (追加の場合は None)",
+                "spec": "追加・編集後のルール (削除の場合は None)",
+                "current": "編集・削除前のルール (追加の場合は None)",
+                "result": "done(完了) / planned(dry_run) / failed(失敗)",
+                "error": "失敗時の例外 (それ以外は None)"
+              }
+            ]
+          }
+
+        """
+        self._check_project_id()
+        desired = {}
+        for kind, specs in (("acl_ipv4", ipv4), ("acl_ipv6", ipv6)):
+            if specs is None:
+                continue
+            desired[kind] = [dict(spec, segment=segment_id) for spec in specs]
+            # 変更を始める前に全てのルールを検証する
+            for spec in desired[kind]:
+                validate_spec(kind, spec)
+
+        with deadline_scope(timeout):
+            actions = []
+            unchanged = 0
+            for kind, specs in desired.items():
+                current = self._get_acl(kind, segment_id)
+                kind_actions, kind_unchanged = plan_acl(kind, current, specs, prune)
+                actions += kind_actions
+                unchanged += kind_unchanged
+            return self._apply_reconcile_plan(actions, unchanged, dry_run, max_workers)
+
     # project
+    @traced
     def get_project_history(self):
         """
         プロジェクト内における操作履歴の情報を取得する
@@ -765,62 +1679,83 @@ class MdxResourceExt(object):
         self._check_project_id()
         return list(self.project_history_iter())
 
-    def vm_info_iter(self):
+    @traced
+    def sync_project_history(self, store):
+        """
+        プロジェクト操作履歴をローカルのストアに差分同期する。
+
+        前回の同期以降に開始した操作履歴と、前回の同期で未終了だった操作履歴のみを取得する。
+        同期した操作履歴は store.query() で検索できる。
+
+        .. code-block:: python
+
+          store = SqliteHistoryStore("history.db")
+          mdx.sync_project_history(store)
+          store.query(vm_name="vm1", since="2024-10-01 00:00:00")
+
+        :param store: SqliteHistoryStore または JsonlHistoryStore
+        :returns: 追加または更新した操作履歴の数
+        """
+        self._check_project_id()
+        return sync_project_history(
+            lambda page, page_size: self._mdxlib.get_project_history(self._project_id,
+                                                                     page=page,
+                                                                     page_size=page_size),
+            store, self._project_id)
+
+    @traced_iter
+    def vm_info_iter(self, consistent=False):
         """
         仮想マシン一覧をイテレータとして返す。
+
+        2ページ目以降は1ページ目の件数(count)から求めたページを並列に取得し、ページ順に返す。
+
+        :param consistent: ``True`` の場合、全ページを取得した後で件数と重複を検証し、
+          ページを取得する間に仮想マシンが増減していれば取得し直す
         """
         # TODO: 公開するか?決める
         self._check_project_id()
-        current_page = 1
-        page_size = 100
         # ページ番号で制御する(URLではなく)
-        while True:
-            vm_list = self._mdxlib.get_vm_list(self._project_id,
-                                               page=current_page,
-                                               page_size=page_size)
-            for vm_info in vm_list["results"]:
-                yield vm_info
-            # VM情報のロックが必要? (ページをめくる間にVMが増減したらどうするか?)
-            if vm_list["next"] is None:
-                # StopIteration is RuntimeError
-                return
-            current_page += 1
+        return _iter_pages(
+            lambda page, page_size: self._mdxlib.get_vm_list(self._project_id,
+                                                             page=page,
+                                                             page_size=page_size),
+            page_size=100, consistent=consistent)
 
-    def project_history_iter(self):
+    @traced_iter
+    def project_history_iter(self, consistent=False):
         """
         プロジェクト操作履歴をイテレータとして返す。
+
+        :param consistent: vm_info_iter() を参照のこと
         """
         self._check_project_id()
-        current_page = 1
-        page_size = 10000
-        while True:
-            history_list = self._mdxlib.get_project_history(self._project_id,
-                                                            page=current_page,
-                                                            page_size=page_size)
-            for history in history_list["results"]:
-                yield history
-
-            if history_list["next"] is None:
-                return
-            current_page += 1
+        return _iter_pages(
+            lambda page, page_size: self._mdxlib.get_project_history(self._project_id,
+                                                                     page=page,
+                                                                     page_size=page_size),
+            page_size=10000, consistent=consistent)
 
+    @traced
     def get_assignable_global_ipv4(self):
         self._check_project_id()
-        return self._mdxlib.get_assignable_global_ipv4(self._project_id)
+        return self._cached("assignable_global_ipv4",
+                            lambda: self._mdxlib.get_assignable_global_ipv4(self._project_id))
+
+    @traced_iter
+    def dnat_iter(self, consistent=False):
+        """
+        DNAT情報をイテレータとして返す。
 
-    def dnat_iter(self):
+        :param consistent: vm_info_iter() を参照のこと
+        """
         self._check_project_id()
-        current_page = 1
-        page_size = 100
-        while True:
-            dnat_list = self._mdxlib.get_dnat(self._project_id, page=current_page, page_size=page_size)
-            for dnat in dnat_list["results"]:
-                yield dnat
-
-            if dnat_list["next"] is None:
-                return
-            current_page += 1
+        return _iter_pages(
+            lambda page, page_size: self._mdxlib.get_dnat(self._project_id, page=page,
+                                                          page_size=page_size),
+            page_size=100, consistent=consistent)
 
+    @traced
     def get_segments(self):
         """
         プロジェクトに紐付いたネットワークセグメント情報を取得する。
@@ -839,8 +1774,9 @@ class MdxResourceExt(object):
 
         """
         self._check_project_id()
-        return self._mdxlib.get_segments(self._project_id)
+        return self._cached("segments", lambda: self._mdxlib.get_segments(self._project_id))
 
+    @traced
     def get_segment_summary(self, segment_id):
         """
         ネットワークセグメントのサマリ情報を取得する
@@ -860,6 +1796,7 @@ class MdxResourceExt(object):
         self._check_project_id()
         return self._mdxlib.get_segment_summary(self._project_id, segment_id)
 
+    @traced
     def get_dnat(self):
         """
         プロジェクトに属するDNAT情報の取得
@@ -880,6 +1817,7 @@ class MdxResourceExt(object):
         """
         return list(self.dnat_iter())
 
+    @traced
     def add_dnat(self, dnat_spec):
         """
         指定したセグメントにDNATを追加する
@@ -895,9 +1833,13 @@ class MdxResourceExt(object):
           }
 
         """
-        # TODO: validate
-        return self._mdxlib.add_dnat(self._project_id, dnat_spec)
+        validate_spec("dnat", dnat_spec)
+        try:
+            return self._mdxlib.add_dnat(self._project_id, dnat_spec)
+        finally:
+            self._invalidate_cache("assignable_global_ipv4")
 
+    @traced
     def edit_dnat(self, dnat_id, dnat_spec):
         """
         指定したDNAT情報を更新する
@@ -914,27 +1856,226 @@ class MdxResourceExt(object):
           }
 
         """
-        # TODO: validate
-        return self._mdxlib.edit_dnat(self._project_id, dnat_id, dnat_spec)
+        validate_spec("dnat", dnat_spec)
+        try:
+            return self._mdxlib.edit_dnat(self._project_id, dnat_id, dnat_spec)
+        finally:
+            self._invalidate_cache("assignable_global_ipv4")
 
+    @traced
     def delete_dnat(self, dnat_id):
         """
         DNATの削除を実行する
 
         :param dnat_id: DNAT ID
         """
-        self._mdxlib.delete_dnat(self._project_id, dnat_id)
+        try:
+            self._mdxlib.delete_dnat(self._project_id, dnat_id)
+        finally:
+            self._invalidate_cache("assignable_global_ipv4")
         # 返り値なし
 
-    def _get_vm_id_by_vm_name(self, vm_name):
-        target_vm = None
-        for vm in self.vm_info_iter():
-            if vm["name"] == vm_name:
-                target_vm = vm
+    def _get_acl(self, kind, segment_id):
+        if kind == "acl_ipv4":
+            return self._mdxlib.get_allow_acl_ipv4_info(segment_id)
+        return self._mdxlib.get_allow_acl_ipv6_info(segment_id)
+
+    @traced
+    def import_acl_rules(self, source, segment_id=None, format=None, report=None, dry_run=False,
+                         max_workers=FLEET_MAX_WORKERS, timeout=None):
+        """
+        CSV または JSON Lines のファイルから、Allow ACL をまとめて登録する。
+
+        ファイルを1行ずつ読み込み、アドレスとマスクを正規化してIPv4/IPv6のどちらのACLかを判定し、
+        既存のルールやファイル中の他の行と重複しないルールのみを、最大 max_workers 並列で登録する。
+        既存のルールはセグメント毎に1回だけ取得する。
+
+        .. code-block:: text
+
+          segment,src_address,src_mask,src_port,dst_address,dst_mask,dst_port,protocol
+          ,203.0.113.0/24,,Any,10.1.0.10,,22,TCP
+          ,2001:db8::,32,Any,2001:db8:1::10,128,443,TCP
+
+        :param source: ファイルのパス、またはファイルオブジェクト。形式は mdx_acl_import.read_acl_rows() を参照のこと
+        :param segment_id: segment 列が空の行に使用するネットワークセグメントID
+        :param format: "csv" または "jsonl"。省略時はファイルの拡張子から判定する
+        :param report: 行毎の結果を出力するファイルのパス (.csv または .jsonl)。省略時は出力しない
+        :param dry_run: 重複の確認までを行い、登録しない場合 ``True`` を指定
+        :param max_workers: 同時に実行するAPI呼び出しの最大数
+        :param timeout: 操作全体の期限(秒)
+        :returns: 以下のような、行毎の結果のリスト
+
+        .. code-block:: json
+
+          [
+            {
+              "row": "行番号",
+              "result": "done(登録した) / duplicate(登録済み) / invalid(不正な行) / failed(失敗) / planned(dry_run)",
+              "kind": "acl_ipv4 / acl_ipv6 (不正な行の場合は None)",
+              "id": "登録したAllow ACLのID (それ以外は None)",
+              "spec": "正規化したルール (不正な行の場合は読み込んだ行)",
+              "error": "不正な行・失敗時の例外 (それ以外は None)"
+            }
+          ]
+
+        """
+        self._check_project_id()
+        results = []
+        with deadline_scope(timeout):
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                running = {}
+                for result, add_method, spec in self._iter_acl_import_rows(
+                        source, segment_id, format, dry_run, results):
+                    if len(running) >= max_workers * 2:
+                        # 読み込みが登録より先に進みすぎないようにする
+                        done, _ = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self._finish_acl_import(running.pop(future), future)
+                    running[submit_in_context(executor, add_method, spec)] = result
+                for future in as_completed(running):
+                    self._finish_acl_import(running[future], future)
+        if report is not None:
+            write_acl_import_report(results, report)
+        return results
+
+    def _iter_acl_import_rows(self, source, segment_id, format, dry_run, results):
+        # 登録が必要な行について (結果, 登録のメソッド, 仕様) を返す
+        existing = {}
+        for row_number, rule in read_acl_rows(source, format):
+            result = {"row": row_number, "result": None, "kind": None, "id": None, "spec": None,
+                      "error": None}
+            results.append(result)
+            if isinstance(rule, AclRuleError):
+                result.update(result="invalid", error=rule)
+                continue
+            try:
+                kind, spec = normalize_acl_rule(rule, segment_id)
+                validate_spec(kind, spec)
+            except Exception as e:
+                result.update(result="invalid", spec=rule, error=e)
+                continue
+            result.update(kind=kind, spec=spec)
+
+            segment_key = (kind, spec["segment"])
+            if segment_key not in existing:
+                try:
+                    current = self._get_acl(kind, spec["segment"])
+                    existing[segment_key] = set(acl_rule_key(r) for r in current)
+                except Exception as e:
+                    logger.debug("{}: get {} is failed: {}".format(spec["segment"], kind, e))
+                    existing[segment_key] = e
+            keys = existing[segment_key]
+            if isinstance(keys, Exception):
+                result.update(result="failed", error=keys)
+                continue
+            key = acl_rule_key(spec)
+            if key in keys:
+                result["result"] = "duplicate"
+                continue
+            keys.add(key)
+            if dry_run:
+                result["result"] = "planned"
+                continue
+            add_method, _, _ = RECONCILE_METHODS[kind]
+            yield result, getattr(self, add_method), spec
+
+    @staticmethod
+    def _finish_acl_import(result, future):
+        try:
+            added = future.result()
+        except Exception as e:
+            logger.debug("row {}: add acl is failed: {}".format(result["row"], e))
+            result.update(result="failed", error=e)
+            return
+        result["result"] = "done"
+        if isinstance(added, dict):
+            result["id"] = added.get("uuid")
+
+    @traced
+    def reconcile_dnat(self, dnats, prune=True, dry_run=False, max_workers=FLEET_MAX_WORKERS,
+                       timeout=None):
+        """
+        プロジェクトのDNATを、指定したDNATの集合に一致させる。
+
+        DNATは転送元グローバルIPアドレスで対応付け、転送先が異なるものは編集する。
+        計画の作成と適用は reconcile_acl() と同様に行う。
+
+        :param dnats: 望ましいDNATのリスト。仕様は add_dnat() を参照のこと
+        :param prune: 指定したDNATにない既存のDNATを削除する場合 ``True`` を指定
+        :param dry_run: 計画の作成のみ行い、変更しない場合 ``True`` を指定
+        :param max_workers: 同時に実行するAPI呼び出しの最大数
+        :param timeout: 操作全体の期限(秒)
+        :returns: 結果。詳細は reconcile_acl() を参照のこと。
+        """
+        self._check_project_id()
+        for spec in dnats:
+            validate_spec("dnat", spec)
+        with deadline_scope(timeout):
+            actions, unchanged = plan_dnat(list(self.dnat_iter()), dnats, prune)
+            return self._apply_reconcile_plan(actions, unchanged, dry_run, max_workers)
+
+    def _apply_reconcile_plan(self, actions, unchanged, dry_run, max_workers):
+        for action in actions:
+            action["result"] = "planned"
+            action["error"] = None
+        if not dry_run:
+            for phase in ACTION_ORDER:
+                phase_actions = [action for action in actions if action["action"] == phase]
+                if not phase_actions:
+                    continue
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {
+                        submit_in_context(executor, self._apply_reconcile_action, action): action
+                        for action in phase_actions
+                    }
+                    for future in as_completed(futures):
+                        action = futures[future]
+                        try:
+                            future.result()
+                        except Exception as e:
+                            logger.debug("{} {} {} is failed: {}".format(
+                                action["action"], action["kind"], action["id"], e))
+                            action["result"] = "failed"
+                            action["error"] = e
+                        else:
+                            action["result"] = "done"
+        return {"dry_run": dry_run, "unchanged": unchanged, "actions": actions}
+
+    def _apply_reconcile_action(self, action):
+        add, edit, delete = RECONCILE_METHODS[action["kind"]]
+        if action["action"] == "add":
+            return getattr(self, add)(action["spec"])
+        if action["action"] == "edit":
+            return getattr(self, edit)(action["id"], action["spec"])
+        return getattr(self, delete)(action["id"])
+
+    def _get_vm_id_by_vm_name(self, vm_name, refresh=False):
+        vm_id = None if refresh else self._vm_index.get(vm_name)
+        if vm_id is not None:
+            return vm_id
+        # 索引が無効または見つからない場合は一覧を1回走査して作り直す
+        return self._vm_index.rebuild(self.vm_info_iter()).get(vm_name)
+
+    def _get_vm_by_vm_name(self, vm_name):
+        """
+        仮想マシン名から (仮想マシンID, 仮想マシン情報) を取得する。見つからない場合は (None, None) を返す。
+
+        索引の仮想マシンIDが、索引の作成後に削除または名前を変更された仮想マシンのものだった場合は、
+        索引を作り直して取得し直す。
+        """
+        for refresh in (False, True):
+            vm_id = self._get_vm_id_by_vm_name(vm_name, refresh)
+            if vm_id is None:
                 break
-        if target_vm is None:
-            return None
-        return target_vm["uuid"]
+            try:
+                vm_info = self._get_vm_info_by_id(vm_id)
+            except MdxRestException as e:
+                if e.status_code != 404:
+                    raise
+                vm_info = None
+            if not _is_stale_vm_info(vm_name, vm_id, vm_info):
+                return vm_id, vm_info
+        return None, None
 
     def _find_vm(self, vm_name):
         """
@@ -945,20 +2086,57 @@ class MdxResourceExt(object):
         vm_id = self._get_vm_id_by_vm_name(vm_name)
         if vm_id is None:
             raise Exception("vm {} is not found".format(vm_name))
+        self._mdxlib.tracer.set_attribute("mdx.vm_id", vm_id)
         return vm_id
 
-    def _wait_until(self, vm_id, status):
-        for _i in range(0, SLEEP_COUNT):
-            time.sleep(SLEEP_TIME_SEC)
-            vm_info = self._mdxlib.get_vm_info(vm_id)
-            logger.debug("waiting expected: {} actual: {}".format(
-                status, vm_info["status"]))
+    def _find_vm_info(self, vm_name):
+        """
+        _find_vm() と同様に仮想マシンを探し、(仮想マシンID, 仮想マシン情報) を返す。
+        索引の仮想マシンIDが古い場合は索引を作り直す。
+        """
+        vm_id, vm_info = self._get_vm_by_vm_name(vm_name)
+        if vm_id is None:
+            raise Exception("vm {} is not found".format(vm_name))
+        self._mdxlib.tracer.set_attribute("mdx.vm_id", vm_id)
+        return vm_id, vm_info
+
+    def create_state_waiter(self):
+        """
+        現在のプロジェクトの仮想マシンの状態をまとめて待つ VmStateWaiter を作成する。
 
-            if vm_info["status"] == status:
-                break
-        else:
-            raise MdxRestException("wait_until {} is failed".format(status))
-        logger.debug("wait_until finished")
+        .. code-block:: python
+
+          waiter = mdx.create_state_waiter()
+          for vm_id in vm_ids:
+              waiter.watch(vm_id, "PowerOFF", callback=lambda w: print(w.vm_id))
+          waiter.run()
+
+        """
+        self._check_project_id()
+        return VmStateWaiter(self._mdxlib, self._project_id, self._polling_policy,
+                             max_workers=FLEET_MAX_WORKERS)
+
+    def _wait_until(self, vm_id, status, operation=None, idle=False):
+        waiter = self.create_state_waiter()
+        future = waiter.watch(vm_id, status, operation=operation, idle=idle)
+        waiter.run()
+        future.result()
+
+    def _wait_until_all(self, targets, operation=None, idle=False):
+        """
+        複数の仮想マシンが指定した状態になるまでまとめて待つ。
+
+        :param targets: 仮想マシンIDをキー、待つ状態を値とするdict
+        :param operation: 操作種別 (PollingPolicy の学習に使用する)
+        :param idle: 状態に達したうえで実行中のタスクがなくなるまで待つ場合 ``True`` を指定
+        :returns: 失敗した仮想マシンIDをキー、例外を値とするdict
+        """
+        waiter = self.create_state_waiter()
+        futures = {vm_id: waiter.watch(vm_id, status, operation=operation, idle=idle)
+                   for vm_id, status in targets.items()}
+        waiter.run()
+        return {vm_id: future.exception() for vm_id, future in futures.items()
+                if future.exception() is not None}
 
 
 # デフォルトのresolverがIPv6のアドレスを返すが、接続できないときに以下のコードを実行する
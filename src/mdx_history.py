@@ -0,0 +1,330 @@
+#
+# mdx プロジェクト操作履歴のローカル保存と差分同期
+#
+import json
+import logging
+import os
+import threading
+
+# 差分同期で操作履歴を取得する際のページサイズ
+HISTORY_SYNC_PAGE_SIZE = 100
+# 操作履歴の日時の書式
+HISTORY_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+logger = logging.getLogger(__name__)
+
+
+def _format_datetime(value):
+    if value is None or isinstance(value, str):
+        return value
+    return value.strftime(HISTORY_DATETIME_FORMAT)
+
+
+def _is_finished(entry):
+    # 終了日時が記録されていない操作は、以降の同期で状態が変わりうる
+    return bool(entry.get("end_datetime"))
+
+
+def _start(entry):
+    return entry.get("start_datetime") or ""
+
+
+def _match(entry, project, project_id, vm_id, vm_name, type, status, since, until):
+    if project_id is not None and project != project_id:
+        return False
+    if vm_id is not None and entry.get("object_uuid") != vm_id:
+        return False
+    if vm_name is not None and entry.get("object_name") != vm_name:
+        return False
+    if type is not None and entry.get("type") != type:
+        return False
+    if status is not None and entry.get("status") != status:
+        return False
+    start = _start(entry)
+    if since is not None and start < since:
+        return False
+    if until is not None and start >= until:
+        return False
+    return True
+
+
+class SqliteHistoryStore(object):
+    """
+    操作履歴を SQLite データベースに保存するストア。
+
+    操作履歴IDを主キーとし、同じ操作履歴は最新の内容で上書きする。
+
+    :param path: データベースファイルのパス。省略時はメモリ上に作成する
+    """
+
+    def __init__(self, path=":memory:"):
+        # sqlite3 は SqliteHistoryStore を使う場合にのみ読み込む
+        import sqlite3
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS project_history ("
+            " uuid TEXT PRIMARY KEY,"
+            " project TEXT,"
+            " type TEXT,"
+            " object_uuid TEXT,"
+            " object_name TEXT,"
+            " status TEXT,"
+            " start_datetime TEXT,"
+            " end_datetime TEXT,"
+            " data TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS project_history_start"
+            " ON project_history (project, start_datetime)"
+        )
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def watermark(self, project_id):
+        """
+        差分同期で取得し直す必要のある操作履歴の開始日時を返す。
+
+        未終了の操作履歴があればその最も古い開始日時、なければ最新の開始日時を返す。
+
+        :param project_id: プロジェクトID
+        :returns: 開始日時。操作履歴が保存されていない場合は ``None``
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(start_datetime) FROM project_history"
+                " WHERE project = ? AND (end_datetime IS NULL OR end_datetime = '')",
+                (project_id,)).fetchone()
+            if row[0] is None:
+                row = self._conn.execute(
+                    "SELECT MAX(start_datetime) FROM project_history WHERE project = ?",
+                    (project_id,)).fetchone()
+        return row[0]
+
+    def upsert(self, entries, project_id=None):
+        """
+        操作履歴を保存する。
+
+        :param entries: 操作履歴のリスト
+        :param project_id: 操作履歴を取得したプロジェクトのID。省略時は操作履歴の project を使用する
+        :returns: 追加または更新した操作履歴の数
+        """
+        changed = 0
+        with self._lock:
+            for entry in entries:
+                data = json.dumps(entry, sort_keys=True, ensure_ascii=False)
+                project = entry.get("project") if project_id is None else project_id
+                row = self._conn.execute(
+                    "SELECT data, project FROM project_history WHERE uuid = ?",
+                    (entry["uuid"],)).fetchone()
+                if row is not None and row[0] == data and row[1] == project:
+                    continue
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO project_history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (entry["uuid"], project, entry.get("type"),
+                     entry.get("object_uuid"), entry.get("object_name"), entry.get("status"),
+                     entry.get("start_datetime"), entry.get("end_datetime"), data))
+                changed += 1
+            self._conn.commit()
+        return changed
+
+    def query(self, project_id=None, vm_id=None, vm_name=None, type=None, status=None,
+              since=None, until=None):
+        """
+        保存した操作履歴を検索する。指定した条件はすべて満たすものを返す。
+
+        :param project_id: プロジェクトID
+        :param vm_id: 操作対象オブジェクトID
+        :param vm_name: 操作対象オブジェクト名
+        :param type: 操作種別
+        :param status: ステータス
+        :param since: この日時以降に開始した操作 (datetime または "YYYY-mm-dd HH:MM:SS")
+        :param until: この日時より前に開始した操作 (datetime または "YYYY-mm-dd HH:MM:SS")
+        :returns: 開始日時の新しい順の操作履歴のリスト
+        """
+        conditions = []
+        params = []
+        for column, value in (("project", project_id), ("object_uuid", vm_id),
+                              ("object_name", vm_name), ("type", type), ("status", status)):
+            if value is not None:
+                conditions.append("{} = ?".format(column))
+                params.append(value)
+        if since is not None:
+            conditions.append("start_datetime >= ?")
+            params.append(_format_datetime(since))
+        if until is not None:
+            conditions.append("start_datetime < ?")
+            params.append(_format_datetime(until))
+        sql = "SELECT data FROM project_history"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY start_datetime DESC, uuid"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+class JsonlHistoryStore(object):
+    """
+    操作履歴を JSON Lines 形式のファイルに追記するストア。
+
+    追加または内容の変わった操作履歴を、取得したプロジェクトのIDとともに1行ずつ追記し、
+    読み込み時は同じ操作履歴IDの最後の行を採用する。検索はメモリ上に読み込んだ操作履歴に対して行う。
+
+    :param path: ファイルのパス
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        # 操作履歴ID→操作履歴を取得したプロジェクトのID
+        self._projects = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 書き込み途中で中断された行
+                        logger.warning("{}: skip broken line".format(path))
+                        continue
+                    if "entry" in record and "project_id" in record:
+                        entry, project = record["entry"], record["project_id"]
+                    else:
+                        # プロジェクトのIDを記録していない形式の行
+                        entry, project = record, record.get("project")
+                    self._entries[entry["uuid"]] = entry
+                    self._projects[entry["uuid"]] = project
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        pass
+
+    def watermark(self, project_id):
+        """
+        差分同期で取得し直す必要のある操作履歴の開始日時を返す。 SqliteHistoryStore.watermark() を参照のこと。
+        """
+        with self._lock:
+            entries = [e for uuid, e in self._entries.items() if self._projects.get(uuid) == project_id]
+        unfinished = [_start(e) for e in entries if not _is_finished(e)]
+        if unfinished:
+            return min(unfinished)
+        if entries:
+            return max(_start(e) for e in entries)
+        return None
+
+    def upsert(self, entries, project_id=None):
+        """
+        操作履歴を保存する。 SqliteHistoryStore.upsert() を参照のこと。
+        """
+        lines = []
+        with self._lock:
+            for entry in entries:
+                project = entry.get("project") if project_id is None else project_id
+                if self._entries.get(entry["uuid"]) == entry and \
+                        self._projects.get(entry["uuid"]) == project:
+                    continue
+                self._entries[entry["uuid"]] = entry
+                self._projects[entry["uuid"]] = project
+                record = {"project_id": project, "entry": entry}
+                lines.append(json.dumps(record, sort_keys=True, ensure_ascii=False) + "\n")
+            if lines:
+                with open(self._path, "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+        return len(lines)
+
+    def query(self, project_id=None, vm_id=None, vm_name=None, type=None, status=None,
+              since=None, until=None):
+        """
+        保存した操作履歴を検索する。 SqliteHistoryStore.query() を参照のこと。
+        """
+        since = _format_datetime(since)
+        until = _format_datetime(until)
+        with self._lock:
+            entries = [e for uuid, e in self._entries.items()
+                       if _match(e, self._projects.get(uuid), project_id, vm_id, vm_name, type,
+                                 status, since, until)]
+        entries.sort(key=lambda e: e["uuid"])
+        entries.sort(key=_start, reverse=True)
+        return entries
+
+
+def sync_project_history(fetch_page, store, project_id, page_size=HISTORY_SYNC_PAGE_SIZE):
+    """
+    操作履歴を取得してストアに保存する。
+
+    操作履歴は開始日時の新しい順に返されるため、先頭のページから順に取得し、
+    ストアの watermark() より前に開始した操作履歴に達したところで取得を打ち切る。
+    ストアが空の場合、またはページが開始日時の順に並んでいない場合はすべてのページを取得する。
+
+    :param fetch_page: ページ番号とページサイズを引数とし、ページ(dict)を返す関数
+    :param store: SqliteHistoryStore または JsonlHistoryStore
+    :param project_id: プロジェクトID。操作履歴とともにストアに記録する
+    :returns: 追加または更新した操作履歴の数
+    """
+    selector = HistoryPageSelector(store.watermark(project_id))
+    changed = 0
+    page = 1
+    while True:
+        entries, done = selector.select(fetch_page(page, page_size))
+        changed += store.upsert(entries, project_id)
+        if done:
+            break
+        page += 1
+    logger.debug("sync project history: project={} pages={} changed={}".format(
+        project_id, page, changed))
+    return changed
+
+
+class HistoryPageSelector(object):
+    """
+    差分同期で取得したページから、watermark 以降に開始した操作履歴を選び、以降のページの取得が必要かを判定する。
+
+    ページ内が開始日時の新しい順に並んでいない場合、または前のページより新しい操作履歴が現れた場合は、
+    APIが開始日時の順に返していないとみなして警告し、以降は打ち切らずに全ページを取得する。
+
+    :param watermark: ストアの watermark() の値
+    """
+
+    def __init__(self, watermark):
+        self.watermark = watermark
+        self.ordered = True
+        self._oldest_start = None
+
+    def select(self, res):
+        """
+        :param res: 操作履歴のページ
+        :returns: (保存する操作履歴のリスト, 以降のページの取得が不要なら ``True``) のタプル
+        """
+        results = sorted(res["results"], key=_start, reverse=True)
+        if results != res["results"] or \
+                (results and self._oldest_start is not None and _start(results[0]) > self._oldest_start):
+            if self.ordered:
+                logger.warning("project history is not ordered by start_datetime, fetch all pages")
+            self.ordered = False
+        if results:
+            oldest = _start(results[-1])
+            if self._oldest_start is None or oldest < self._oldest_start:
+                self._oldest_start = oldest
+        entries = results
+        if self.watermark is not None:
+            entries = [e for e in results if _start(e) >= self.watermark]
+        done = res["next"] is None or (self.ordered and len(entries) < len(results))
+        return entries, done
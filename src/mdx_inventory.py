@@ -0,0 +1,116 @@
+#
+# mdx プロジェクトの仮想マシンの一覧と詳細情報のスナップショット
+#
+import time
+
+# IPアドレスの索引に含めるネットワークの項目
+_NETWORK_FIELDS = ("service_networks", "storage_networks")
+
+
+def list_state(summary):
+    """
+    仮想マシン一覧の要素から、詳細情報を取得し直す必要があるかの判定に使う状態を返す
+    """
+    return (summary.get("name"), summary.get("status"), tuple(summary.get("running_tasks") or ()))
+
+
+def _addresses(info):
+    for field in _NETWORK_FIELDS:
+        for network in info.get(field) or ():
+            for address in (network.get("ipv4_address") or []) + (network.get("ipv6_address") or []):
+                yield address
+
+
+class VmInventory(object):
+    """
+    プロジェクトの全仮想マシンの一覧と詳細情報のスナップショット。 MdxResourceExt.snapshot() で作成する。
+
+    仮想マシン名、仮想マシンID、IPアドレス、状態、ESXiホストで仮想マシンを引く索引を持つ。
+    同名の仮想マシンがある場合、find_by_name() は一覧で先に現れたものを返す。
+
+    各仮想マシンは以下のようなdictで表す。
+
+    .. code-block:: json
+
+      {
+        "vm_id": "仮想マシンID",
+        "name": "仮想マシン名",
+        "status": "仮想マシンの状態",
+        "summary": "仮想マシン一覧の要素。詳細は MdxResourceExt.get_vm_list() を参照のこと",
+        "info": "仮想マシン情報 (取得に失敗した場合は None)。詳細は MdxResourceExt.get_vm_info() を参照のこと",
+        "error": "詳細情報の取得に失敗した場合の例外 (それ以外は None)"
+      }
+
+    :ivar taken_at: 一覧を取得した時刻(UNIX時刻)
+    :ivar fetched: 詳細情報を取得した仮想マシン数
+    :ivar reused: 前回のスナップショットの詳細情報を再利用した仮想マシン数
+    """
+
+    def __init__(self, vms, taken_at=None, fetched=0, reused=0):
+        self.taken_at = time.time() if taken_at is None else taken_at
+        self.fetched = fetched
+        self.reused = reused
+        self._vms = list(vms)
+        self._by_id = {}
+        self._by_name = {}
+        self._by_ip = {}
+        self._by_status = {}
+        self._by_esxi = {}
+        for vm in self._vms:
+            self._by_id[vm["vm_id"]] = vm
+            self._by_name.setdefault(vm["name"], vm)
+            self._by_status.setdefault(vm["status"], []).append(vm)
+            info = vm["info"]
+            if info is None:
+                continue
+            self._by_esxi.setdefault(info.get("esxi"), []).append(vm)
+            for address in _addresses(info):
+                self._by_ip.setdefault(address, vm)
+
+    def __len__(self):
+        return len(self._vms)
+
+    def __iter__(self):
+        return iter(self._vms)
+
+    def get(self, vm_id):
+        """
+        仮想マシンIDで仮想マシンを返す。存在しない場合は ``None``
+        """
+        return self._by_id.get(vm_id)
+
+    def find_by_name(self, vm_name):
+        """
+        仮想マシン名で仮想マシンを返す。存在しない場合は ``None``
+        """
+        return self._by_name.get(vm_name)
+
+    def find_by_ip(self, address):
+        """
+        サービスネットワークまたはストレージネットワークのIPアドレスで仮想マシンを返す。存在しない場合は ``None``
+        """
+        return self._by_ip.get(address)
+
+    def filter_by_status(self, status):
+        """
+        指定した状態 ("PowerON", "PowerOFF" など) の仮想マシンのリストを返す
+        """
+        return list(self._by_status.get(status, ()))
+
+    def filter_by_esxi(self, esxi):
+        """
+        指定したESXiホストで動作している仮想マシンのリストを返す
+        """
+        return list(self._by_esxi.get(esxi, ()))
+
+    def statuses(self):
+        """
+        状態→仮想マシン数のdictを返す
+        """
+        return {status: len(vms) for status, vms in self._by_status.items()}
+
+    def failed(self):
+        """
+        詳細情報の取得に失敗した仮想マシンのリストを返す
+        """
+        return [vm for vm in self._vms if vm["error"] is not None]
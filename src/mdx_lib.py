@@ -1,40 +1,609 @@
+import base64
+import contextlib
+import contextvars
 import copy
+import email.utils
+import hashlib
 import re
 import json
 import logging
+import threading
 import urllib
 import inspect
+import random
 import requests
 import time
+import urllib3
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from .mdx_metrics import MdxMetrics, normalize_endpoint
+from .mdx_trace import NOOP_TRACER
 
 DEFAULT_MDX_ENDPOINT = "https://oprpl.mdx.jp"
+# コネクションプールの既定値
+# pool_connections: キャッシュするホスト毎のプール数
+# pool_maxsize: ホスト毎に保持するコネクション数の上限
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+# トークンの有効期限(exp)のこの秒数前になったらリフレッシュする
+DEFAULT_TOKEN_REFRESH_MARGIN_SEC = 300
+# トークンの利用者を識別するJWTのクレーム。リフレッシュしても変わらない値を使う
+JWT_IDENTITY_CLAIMS = ("user_id", "sub", "username", "email")
+# デプロイしたタスクと仮想マシンの対応付けの試行回数と間隔
+TASK_CORRELATION_RETRY = 10
+TASK_CORRELATION_INTERVAL_SEC = 10
+# 再試行の既定値
+# 試行回数の上限(初回を含む)、待ち時間の初期値・倍率・上限(秒)、待ち時間をランダムに縮める割合
+DEFAULT_RETRY_MAX_ATTEMPTS = 4
+DEFAULT_RETRY_INITIAL_BACKOFF_SEC = 0.5
+DEFAULT_RETRY_MULTIPLIER = 2.0
+DEFAULT_RETRY_MAX_BACKOFF_SEC = 30
+DEFAULT_RETRY_JITTER = 0.5
+# 再試行するHTTPステータス
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Retry-After ヘッダに従って待つ時間の上限(秒)
+MAX_RETRY_AFTER_SEC = 60
+# 再実行しても結果の変わらないHTTPメソッド
+IDEMPOTENT_METHODS = ("GET", "PUT", "DELETE")
+# HTTPの接続と応答の読み込みのタイムアウトの既定値(秒)
+DEFAULT_CONNECT_TIMEOUT_SEC = 10
+DEFAULT_READ_TIMEOUT_SEC = 60
 
 logger = logging.getLogger(__name__)
 
 
+def _is_connect_error(e):
+    """
+    接続の確立に失敗した(要求がサーバに届いていない)例外かどうか
+    """
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
 class MdxRestException(Exception):
     def __init__(self, message, status_code=0):
         self.message = message
         self.status_code = status_code
 
 
+class MdxTimeoutException(MdxRestException):
+    """
+    HTTPのタイムアウト、または操作全体の期限(deadline)切れ
+
+    :ivar phase: 期限を超えた処理。"connect" (接続), "read" (応答の読み込み),
+      "request" (API呼び出し前に期限切れ), "retry" (再試行の待ち), "task_correlation" (デプロイタスクの対応付け),
+      "ssh" (初期パスワード設定のSSHの対話), "ssh_ready" (SSH接続の待ち合わせ)、
+      または状態の待ち合わせの操作種別 ("deploy", "ip_assign", "power_on" など)
+    """
+
+    def __init__(self, message, phase=None, status_code=0):
+        super().__init__(message, status_code)
+        self.phase = phase
+
+    def __str__(self):
+        return self.message
+
+
+class Deadline(object):
+    """
+    操作全体の期限。deadline_scope() で設定し、その中の全てのAPI呼び出しと待ち合わせで共有する。
+
+    :param timeout_sec: 期限(秒)
+    """
+
+    def __init__(self, timeout_sec):
+        self.timeout_sec = timeout_sec
+        self.expires_at = time.monotonic() + timeout_sec
+
+    def remaining(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, self.expires_at - now)
+
+    def expired(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return now >= self.expires_at
+
+    def exception(self, phase):
+        return MdxTimeoutException(
+            "deadline ({}s) is exceeded: {}".format(self.timeout_sec, phase), phase)
+
+
+_current_deadline = contextvars.ContextVar("mdx_deadline", default=None)
+
+
+def current_deadline():
+    """
+    現在のコンテキストの期限 (Deadline) を返す。設定されていない場合は ``None``
+    """
+    return _current_deadline.get()
+
+
+@contextlib.contextmanager
+def deadline_scope(timeout_sec):
+    """
+    with文の中の全てのAPI呼び出しと状態の待ち合わせで共有する期限を設定する。
+    外側で設定された期限の方が早い場合は外側の期限に従う。
+
+    :param timeout_sec: 期限(秒)。 ``None`` の場合は期限を設定しない
+    """
+    outer = _current_deadline.get()
+    if timeout_sec is None:
+        yield outer
+        return
+    deadline = Deadline(timeout_sec)
+    if outer is not None and outer.expires_at < deadline.expires_at:
+        deadline = outer
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """
+    現在のコンテキスト(期限など)を引き継いで executor で fn を実行する
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def bounded_delay(delay, phase):
+    """
+    待ち時間 delay が現在の期限に収まる場合はそのまま返し、収まらない場合は MdxTimeoutException を送出する
+    """
+    deadline = _current_deadline.get()
+    if deadline is not None and deadline.remaining() <= delay:
+        raise deadline.exception(phase)
+    return delay
+
+
+def reserve_rate_limit(rate_limiter):
+    """
+    rate_limiter のトークンを予約し、使用できるまでの待ち時間(秒)を返す。待ち時間が現在の期限に収まらない
+    場合は予約を取り消して MdxTimeoutException を送出する
+    """
+    wait = rate_limiter.reserve()
+    if wait <= 0:
+        return wait
+    try:
+        return bounded_delay(wait, "rate_limit")
+    except MdxTimeoutException:
+        rate_limiter.release()
+        raise
+
+
+def _decode_jwt_claims(token):
+    """
+    JWTのペイロード(クレームの辞書)を取り出す。
+    JWTとして解釈できない場合は None を返す。(署名の検証はしない)
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload.encode("ascii")))
+    except (AttributeError, IndexError, TypeError, ValueError):
+        return None
+    return claims if isinstance(claims, dict) else None
+
+
+def _decode_jwt_exp(token):
+    """
+    JWTのペイロードから有効期限(exp, UNIX時刻)を取り出す。
+    JWTとして解釈できない場合は None を返す。
+    """
+    try:
+        return float(_decode_jwt_claims(token)["exp"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _token_identity(token):
+    """
+    トークンの利用者を識別する文字列を返す。JWT_IDENTITY_CLAIMS のクレームのハッシュ値とし、
+    クレームがない場合はトークン自体のハッシュ値とする。
+    """
+    claims = _decode_jwt_claims(token) or {}
+    identity = [[name, claims[name]] for name in JWT_IDENTITY_CLAIMS if name in claims]
+    source = json.dumps(identity, sort_keys=True) if identity else token
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+
+
+class MdxTokenManager(object):
+    """
+    mdx REST API 認証トークンを管理する。
+
+    トークン(JWT)の有効期限を保持し、有効期限の refresh_margin_sec 秒前以降になった場合のみ
+    リフレッシュが必要と判断する。有効期限が取得できないトークンは、サーバが401を返すまで
+    リフレッシュしない。
+
+    :param token: 認証トークン
+    :param refresh_margin_sec: 有効期限の何秒前からリフレッシュ対象とするか
+    """
+
+    def __init__(self, token=None, refresh_margin_sec=DEFAULT_TOKEN_REFRESH_MARGIN_SEC):
+        self.refresh_margin_sec = refresh_margin_sec
+        self.request_count = 0
+        self.refresh_count = 0
+        self.unauthorized_count = 0
+        self.retry_count = 0
+        self._lock = threading.RLock()
+        self.set_token(token)
+
+    @property
+    def token(self):
+        return self._token
+
+    @property
+    def expires_at(self):
+        return self._expires_at
+
+    @property
+    def identity(self):
+        """
+        トークンの利用者を識別する文字列。キャッシュを利用者毎に分けるために使う
+        """
+        return self._identity
+
+    @property
+    def lock(self):
+        return self._lock
+
+    def set_token(self, token):
+        self._token = token
+        self._expires_at = None if token is None else _decode_jwt_exp(token)
+        self._identity = None if token is None else _token_identity(token)
+
+    def needs_refresh(self, now=None):
+        if self._token is None or self._expires_at is None:
+            return False
+        if now is None:
+            now = time.time()
+        return now >= self._expires_at - self.refresh_margin_sec
+
+    def increment(self, counter):
+        """
+        統計情報のカウンタ (request_count など) を1増やす。複数のスレッドからの呼び出しで数え漏れないよう、
+        ロックを取得して更新する
+        """
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get_stats(self):
+        """
+        リクエスト数とリフレッシュ回数を返す
+
+        :returns: 以下のような統計情報
+
+        .. code-block:: json
+
+          {
+            "requests": "HTTPリクエスト数(リフレッシュを含む)",
+            "refreshes": "トークンリフレッシュ回数",
+            "unauthorized": "401応答によりリフレッシュ・再実行した回数",
+            "retries": "一時的なエラーにより再試行した回数",
+            "expires_at": "現在のトークンの有効期限(UNIX時刻)"
+          }
+
+        """
+        return {
+            "requests": self.request_count,
+            "refreshes": self.refresh_count,
+            "unauthorized": self.unauthorized_count,
+            "retries": self.retry_count,
+            "expires_at": self._expires_at,
+        }
+
+
+def _parse_retry_after(value):
+    """
+    Retry-After ヘッダ(秒数またはHTTP日付)を待ち時間(秒)に変換する。解釈できない場合は None を返す。
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RetryPolicy(object):
+    """
+    一時的なエラーに対する再試行の方針。
+
+    接続エラー、タイムアウト、status_codes のHTTPステータスを一時的なエラーとし、
+    initial_backoff_sec から multiplier 倍ずつ max_backoff_sec まで伸ばした時間を、
+    jitter の割合までランダムに縮めて待ってから再試行する。
+    Retry-After ヘッダがある場合はその時間(max_retry_after_sec まで)待つ。
+
+    GET/PUT/DELETE は常に再試行する。POST は二重に実行されないよう、サーバに届いていないことが
+    明らかな場合(接続の確立に失敗した場合と429)のみ再試行する。
+
+    :param max_attempts: 試行回数の上限(初回を含む)。1を指定すると再試行しない
+    :param initial_backoff_sec: 最初の再試行までの待ち時間(秒)
+    :param multiplier: 待ち時間を伸ばす倍率
+    :param max_backoff_sec: 待ち時間の上限(秒)
+    :param jitter: 待ち時間をランダムに縮める割合 (0〜1)
+    :param status_codes: 再試行するHTTPステータス
+    :param max_retry_after_sec: Retry-After ヘッダに従って待つ時間の上限(秒)
+    """
+
+    def __init__(self, max_attempts=DEFAULT_RETRY_MAX_ATTEMPTS,
+                 initial_backoff_sec=DEFAULT_RETRY_INITIAL_BACKOFF_SEC,
+                 multiplier=DEFAULT_RETRY_MULTIPLIER,
+                 max_backoff_sec=DEFAULT_RETRY_MAX_BACKOFF_SEC,
+                 jitter=DEFAULT_RETRY_JITTER,
+                 status_codes=RETRY_STATUS_CODES,
+                 max_retry_after_sec=MAX_RETRY_AFTER_SEC):
+        self.max_attempts = max_attempts
+        self.initial_backoff_sec = initial_backoff_sec
+        self.multiplier = multiplier
+        self.max_backoff_sec = max_backoff_sec
+        self.jitter = jitter
+        self.status_codes = status_codes
+        self.max_retry_after_sec = max_retry_after_sec
+
+    def should_retry(self, attempt, idempotent, status_code=None, connect_error=False):
+        """
+        再試行するかどうかを判定する
+
+        :param attempt: 失敗した試行の回数(初回は1)
+        :param idempotent: 再実行しても結果の変わらない要求かどうか
+        :param status_code: HTTPステータス。例外で失敗した場合は ``None``
+        :param connect_error: 接続の確立に失敗した(要求がサーバに届いていない)かどうか
+        """
+        if attempt >= self.max_attempts:
+            return False
+        if status_code is None:
+            return idempotent or connect_error
+        if status_code not in self.status_codes:
+            return False
+        return idempotent or status_code == 429
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        再試行までの待ち時間(秒)を返す
+
+        :param attempt: 失敗した試行の回数(初回は1)
+        :param retry_after: Retry-After ヘッダの値(秒)
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after_sec)
+        interval = min(self.initial_backoff_sec * self.multiplier ** (attempt - 1),
+                       self.max_backoff_sec)
+        return interval * (1 - random.uniform(0, self.jitter))
+
+    def is_transient(self, e):
+        """
+        要求の失敗が一時的なエラー (時間をおいて同じ要求をやり直せば成功し得るもの) によるかどうかを判定する。
+        再試行しても失敗した例外を、状態の待ち合わせなどで後から確認し直すかどうかの判断に使用する。
+
+        :param e: 要求で発生した例外
+        """
+        if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        if isinstance(e, MdxTimeoutException):
+            # 操作全体の期限切れは一時的なエラーではない
+            return e.phase in ("connect", "read")
+        if isinstance(e, MdxRestException):
+            return e.status_code in self.status_codes
+        return False
+
+
+class TokenBucketRateLimiter(object):
+    """
+    トークンバケットによる要求レートの制限。
+
+    1秒あたり rate_per_sec 個のトークンを最大 burst 個まで貯め、要求毎に1個消費する。
+    トークンがない場合は補充されるまで待つ。1つのクライアントの全てのスレッド(コルーチン)で共有する。
+
+    :param rate_per_sec: 1秒あたりの要求数の上限
+    :param burst: 連続して送信できる要求数の上限。省略時は rate_per_sec (1以上)
+    """
+
+    def __init__(self, rate_per_sec, burst=None):
+        if rate_per_sec <= 0:
+            raise ValueError("rate_per_sec must be positive")
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst if burst is not None else max(1, rate_per_sec)
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        トークンを1個予約し、使用できるまでの待ち時間(秒)を返す
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._updated_at) * self.rate_per_sec)
+            self._updated_at = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate_per_sec
+
+    def release(self):
+        """
+        reserve() で予約したトークンを使わずに返す
+        """
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    def acquire(self):
+        """
+        トークンを1個消費する。トークンがない場合は補充されるまで待つ
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
 class MdxLib(object):
     """
     mdxのREST APIに対応したpythonライブラリ
 
     通常プロジェクトをサポートする。
+    HTTPコネクションはセッション内でプールされ、API呼び出し間で再利用される。
+    使用後は close() を呼ぶか、with文で使用すること。
+
+    :param endpoint: mdx REST API エンドポイント URL
+    :param init_token: mdx REST API 認証トークン
+    :param pool_connections: キャッシュするホスト毎のコネクションプール数
+    :param pool_maxsize: ホスト毎に保持するコネクション数の上限
+    :param pool_block: ``True`` の場合、ホスト毎のコネクション数が pool_maxsize を超えないよう、
+      空きが出るまで待つ
+    :param keep_alive: ``False`` の場合、リクエスト毎にコネクションを閉じる
+    :param token_refresh_margin_sec: トークンの有効期限の何秒前からリフレッシュするか
+    :param retry_policy: 一時的なエラーに対する再試行の方針 (RetryPolicy)。省略時は既定値
+    :param rate_limiter: 要求レートの制限 (TokenBucketRateLimiter)。省略時は制限しない
+    :param connect_timeout_sec: HTTP接続のタイムアウト(秒)
+    :param read_timeout_sec: HTTP応答の読み込みのタイムアウト(秒)
+    :param metrics: API呼び出しなどの計測値の記録先 (MdxMetrics)。省略時はインスタンス毎に作成する。
+      metrics 属性で参照できる
+    :param tracer: API呼び出しや待ち合わせのスパンの記録先 (OpenTelemetryTracer, RecordingTracer)。
+      省略時は記録しない
+
+    deadline_scope() で期限を設定した場合、各API呼び出しのタイムアウトは期限までの残り時間に切り詰める。
+    タイムアウトした場合は MdxTimeoutException を送出する。
     """
 
-    def __init__(self, endpoint=DEFAULT_MDX_ENDPOINT, init_token=None):
+    def __init__(self, endpoint=DEFAULT_MDX_ENDPOINT, init_token=None,
+                 pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 pool_block=False, keep_alive=True,
+                 token_refresh_margin_sec=DEFAULT_TOKEN_REFRESH_MARGIN_SEC,
+                 retry_policy=None, rate_limiter=None,
+                 connect_timeout_sec=DEFAULT_CONNECT_TIMEOUT_SEC,
+                 read_timeout_sec=DEFAULT_READ_TIMEOUT_SEC, metrics=None, tracer=None):
         self._endpoint = endpoint
-        self._token = init_token
+        self.metrics = MdxMetrics() if metrics is None else metrics
+        self.tracer = NOOP_TRACER if tracer is None else tracer
+        self._connect_timeout_sec = connect_timeout_sec
+        self._read_timeout_sec = read_timeout_sec
+        self._token_manager = MdxTokenManager(init_token, token_refresh_margin_sec)
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self._retry_policy = retry_policy
+        self._rate_limiter = rate_limiter
+        self._pool_maxsize = pool_maxsize
+        self._session = self._create_session(pool_connections, pool_maxsize,
+                                             pool_block, keep_alive)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _create_session(self, pool_connections, pool_maxsize, pool_block, keep_alive):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              pool_block=pool_block)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if not keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    def close(self):
+        """
+        プールしているHTTPコネクションを閉じる
+        """
+        self._session.close()
+
+    @property
+    def _token(self):
+        return self._token_manager.token
+
+    @_token.setter
+    def _token(self, token):
+        self._token_manager.set_token(token)
 
     def _call_api(
-        self, api, method="GET", data=None, with_token=True, refresh_token=True
+        self, api, method="GET", data=None, with_token=True, refresh_token=True,
+        idempotent=None
     ):
         """
-        内部のtokenをリフレッシュする
+        APIを呼び出す。
+
+        refresh_tokenが ``True`` の場合、トークンの有効期限が近ければ呼び出し前にリフレッシュし、
+        401が返った場合はリフレッシュしてから1度だけ再実行する。
+        一時的なエラーは retry_policy に従って再試行する。idempotent を省略した場合、
+        GET/PUT/DELETE を再実行しても結果の変わらない要求とみなす。
         """
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        if with_token and refresh_token and self._token_manager.needs_refresh():
+            self._refresh_token(self._token)
+        token = self._token
+        res = self._send_with_retry(api, method, data, with_token, idempotent)
+        if res.status_code == 401 and with_token and refresh_token:
+            logger.debug("token is rejected, refresh and retry: {}".format(api))
+            self._token_manager.increment("unauthorized_count")
+            self._refresh_token(token)
+            res = self._send_with_retry(api, method, data, with_token, idempotent)
+        return res
+
+    def _send_with_retry(self, api, method, data, with_token, idempotent):
+        attempt = 1
+        while True:
+            try:
+                res = self._send(api, method, data, with_token)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if not self._retry_policy.should_retry(attempt, idempotent,
+                                                       connect_error=_is_connect_error(e)):
+                    if isinstance(e, requests.exceptions.Timeout):
+                        phase = "connect" if isinstance(e, requests.exceptions.ConnectTimeout) else "read"
+                        raise MdxTimeoutException(
+                            "mdxlib: {} {}: {} timeout".format(method, api, phase), phase) from e
+                    raise
+                delay = self._retry_policy.backoff(attempt)
+                reason = type(e).__name__
+                logger.debug("{} {}: {}, retry after {:.1f}s".format(method, api, e, delay))
+            else:
+                if not self._retry_policy.should_retry(attempt, idempotent, res.status_code):
+                    return res
+                delay = self._retry_policy.backoff(
+                    attempt, _parse_retry_after(res.headers.get("Retry-After")))
+                reason = res.status_code
+                logger.debug("{} {}: status {}, retry after {:.1f}s".format(
+                    method, api, res.status_code, delay))
+            self._token_manager.increment("retry_count")
+            self.metrics.count_retry(method, api, reason)
+            self._sleep(bounded_delay(delay, "retry"), "retry")
+            attempt += 1
+
+    def _sleep(self, sec, operation):
+        self.metrics.observe_wait(operation, sec)
+        time.sleep(sec)
+
+    def _timeout(self):
+        """
+        requests に渡す (接続, 読み込み) のタイムアウト。期限が設定されていれば残り時間に切り詰める
+        """
+        connect, read = self._connect_timeout_sec, self._read_timeout_sec
+        deadline = current_deadline()
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise deadline.exception("request")
+            connect, read = min(connect, remaining), min(read, remaining)
+        return (connect, read)
+
+    def _send(self, api, method, data, with_token):
         headers = {
             "Content-Type": "application/json",
             "Accept": "application/json",
@@ -44,19 +613,31 @@ class MdxLib(object):
                 raise MdxRestException("mdxlib: token is not specified")
             headers["Authorization"] = "JWT %s" % self._token
         url = urllib.parse.urljoin(self._endpoint, api)
-        try:
-            if method == "GET":
-                res = requests.get(url, params=data, headers=headers)
-            elif method == "POST":
-                res = requests.post(url, data=json.dumps(data), headers=headers)
-            elif method == "PUT":
-                res = requests.put(url, data, headers=headers)
-            elif method == "DELETE":
-                res = requests.delete(url, headers=headers)
-            return res
-        finally:
-            if refresh_token:
-                self._refresh_token()
+        if self._rate_limiter is not None:
+            wait = reserve_rate_limit(self._rate_limiter)
+            if wait > 0:
+                self._sleep(wait, "rate_limit")
+        timeout = self._timeout()
+        self._token_manager.increment("request_count")
+        started = time.monotonic()
+        res = None
+        with self.tracer.span("{} {}".format(method, normalize_endpoint(api)),
+                              {"http.request.method": method, "url.path": api.split("?", 1)[0],
+                               "mdx.endpoint": self._endpoint}) as span:
+            try:
+                if method == "GET":
+                    res = self._session.get(url, params=data, headers=headers, timeout=timeout)
+                elif method == "POST":
+                    res = self._session.post(url, data=json.dumps(data), headers=headers, timeout=timeout)
+                elif method == "PUT":
+                    res = self._session.put(url, data, headers=headers, timeout=timeout)
+                elif method == "DELETE":
+                    res = self._session.delete(url, headers=headers, timeout=timeout)
+            finally:
+                status_code = None if res is None else res.status_code
+                span.set_attribute("http.response.status_code", status_code)
+                self.metrics.observe_request(method, api, status_code, time.monotonic() - started)
+        return res
 
     def _login(self, auth_info):
         # 運用時は不要になる. ポータルに置き換わる.
@@ -66,6 +647,7 @@ class MdxLib(object):
             data=auth_info,
             with_token=False,
             refresh_token=False,
+            idempotent=True,
         )
         if res.status_code != 200:
             raise MdxRestException(
@@ -74,29 +656,24 @@ class MdxLib(object):
         # token is body itself
         self._token = res.json()["token"]
 
-    def _refresh_token(self):
+    def _refresh_token(self, stale_token=None):
         # refresh token
-        data = {"token": self._token}
-        res = self._call_api(
-            "/api/refresh/", method="POST", data=data, refresh_token=False
-        )
-        if res.status_code != 200:
-            raise MdxRestException("mdxlib: token refresh failed")
-        resp_body = res.json()
-        self._token = resp_body["token"]
-
-    def _get_vm_info_by_name(self, project_id, vm_name, wait=True):
-
-        for _ in range(10):
-            vm_list = self.get_vm_list(project_id)
-
-            for vm_info in vm_list['results']:
-                if vm_info['name'] == vm_name:
-                    return vm_info
-            else:
-                if wait is False:
-                    return
-                time.sleep(10)
+        # stale_tokenを指定した場合、他のスレッドが既にリフレッシュ済みならなにもしない
+        with self._token_manager.lock:
+            if stale_token is not None and self._token != stale_token:
+                return
+            data = {"token": self._token}
+            # 同じトークンでのリフレッシュは再試行してよい
+            res = self._call_api(
+                "/api/refresh/", method="POST", data=data, refresh_token=False,
+                idempotent=True,
+            )
+            if res.status_code != 200:
+                raise MdxRestException("mdxlib: token refresh failed", res.status_code)
+            resp_body = res.json()
+            self._token = resp_body["token"]
+            self._token_manager.increment("refresh_count")
+            self.metrics.count_refresh()
 
     def _predict_vmnames(self, s):
         match = re.fullmatch(r"(.*)\[(\d+)-(\d+)\](.*)", s)
@@ -111,24 +688,57 @@ class MdxLib(object):
         width = max(len(start), len(end))
         return [f"{prefix}{str(i).zfill(width)}{suffix}" for i in range(int(start), int(end) + 1)]
 
-    def _get_task_info(self, project_id, vm_name, task_id):
-
-        vm_info = None
-        for _ in range(10):
-            vm_info = self._get_vm_info_by_name(project_id, vm_name)
-            if vm_info is not None:
-                break
-            time.sleep(10)
-        vm_histories = self.get_vm_history(vm_info['uuid'])
-        for vm_history in vm_histories['results']:
-            if vm_history['uuid'] == task_id:
-                return vm_history
-            else:
-                return None
+    def _correlate_tasks(self, project_id, vm_names, task_ids):
+        """
+        デプロイで返されたタスクIDと仮想マシンを対応付け、vm_namesの順にタスク(操作履歴)のリストを返す。
+
+        1回の試行につき仮想マシン一覧を1回取得して仮想マシン名→仮想マシンIDを求め、
+        対象の仮想マシンの操作履歴を並列に取得してタスクIDと照合する。
+        一覧に現れない、または履歴にタスクが現れない仮想マシンは次の試行で再度照合する。
+        """
+        with self.tracer.span("mdx.task_correlation", {"mdx.project_id": project_id,
+                                                       "mdx.vm_names": vm_names}):
+            pending_task_ids = set(task_ids)
+            tasks = {}
+            remaining = list(vm_names)
+            for i in range(TASK_CORRELATION_RETRY):
+                vm_list = self.get_vm_list(project_id)
+                vm_ids = {}
+                for vm_info in vm_list['results']:
+                    vm_ids.setdefault(vm_info['name'], []).append(vm_info['uuid'])
+                candidates = [(vm_name, vm_id) for vm_name in remaining for vm_id in vm_ids.get(vm_name, [])]
+                if candidates:
+                    max_workers = min(len(candidates), self._pool_maxsize)
+                    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                        histories = [submit_in_context(executor, self.get_vm_history, vm_id)
+                                     for _vm_name, vm_id in candidates]
+                        for (vm_name, _vm_id), future in zip(candidates, histories):
+                            vm_histories = future.result()
+                            if vm_name in tasks:
+                                continue
+                            for vm_history in vm_histories['results']:
+                                if vm_history['uuid'] in pending_task_ids:
+                                    tasks[vm_name] = vm_history
+                                    pending_task_ids.discard(vm_history['uuid'])
+                                    break
+                remaining = [vm_name for vm_name in remaining if vm_name not in tasks]
+                if not remaining or not pending_task_ids:
+                    break
+                logger.debug("correlate tasks: retry {} remaining {}".format(i, remaining))
+                self._sleep(bounded_delay(TASK_CORRELATION_INTERVAL_SEC, "task_correlation"),
+                            "task_correlation")
+        return [tasks[vm_name] for vm_name in vm_names if vm_name in tasks]
 
     def refresh_token(self):
         self._refresh_token()
 
+    def get_token_stats(self):
+        """
+        HTTPリクエスト数とトークンリフレッシュ回数を取得する。
+        詳細は MdxTokenManager.get_stats() を参照のこと。
+        """
+        return self._token_manager.get_stats()
+
     def login(self, auth_info):
         """
         mdx REST APIデバッグ時のトークンの取得。
@@ -193,15 +803,7 @@ class MdxLib(object):
         logger.debug("deploy vm: {}".format(res.text))
         task_ids = res.json()['task_id']
         vm_names = self._predict_vmnames(mdx_vm_spec['vm_name'])
-        tasks = []
-        for vm_name in vm_names:
-            for i, task_id in enumerate(task_ids):
-                task_info = self._get_task_info(mdx_vm_spec['project'], vm_name, task_id)
-                if task_info is not None:
-                    tasks.append(task_info)
-                    del task_ids[i]
-                    break
-        return tasks
+        return self._correlate_tasks(mdx_vm_spec['project'], vm_names, task_ids)
 
     def clone_vm(self, original_vm_id: str, mdx_vm_spec: dict):
         """
@@ -421,7 +1023,6 @@ class MdxLib(object):
         return res.json()
 
     def add_allow_acl_ipv4_info(self, allow_acl_spec):
-        # TODO: validate allow_acl_spec with jsonschema
         res = self._call_api("/api/acl/", data=allow_acl_spec, method="POST")
         if res.status_code != 201:
             raise MdxRestException(
@@ -431,7 +1032,6 @@ class MdxLib(object):
         return res.json()
 
     def edit_allow_acl_ipv4_info(self, acl_ipv4_id, allow_acl_spec):
-        # TODO: validate allow_acl_spec with jsonschema
         res = self._call_api("/api/acl/{}/".format(acl_ipv4_id),
                              data=json.dumps(allow_acl_spec), method="PUT")
         if res.status_code != 200:
@@ -464,7 +1064,6 @@ class MdxLib(object):
         return res.json()
 
     def add_allow_acl_ipv6_info(self, allow_acl_spec):
-        # TODO: validate allow_acl_spec with jsonschema
         res = self._call_api("/api/acl_v6/", data=allow_acl_spec, method="POST")
         if res.status_code != 201:
             raise MdxRestException(
@@ -474,7 +1073,6 @@ class MdxLib(object):
         return res.json()
 
     def edit_allow_acl_ipv6_info(self, acl_ipv6_id, allow_acl_spec):
-        # TODO: validate allow_acl_spec with jsonschema
         res = self._call_api("/api/acl_v6/{}/".format(acl_ipv6_id),
                              data=json.dumps(allow_acl_spec), method="PUT")
         if res.status_code != 200:
@@ -0,0 +1,315 @@
+#
+# mdx API呼び出しと待ち合わせの計測
+#
+import logging
+import re
+import threading
+
+# API呼び出しの所要時間のヒストグラムの境界(秒)
+DEFAULT_LATENCY_BUCKETS_SEC = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Prometheus のメトリクス名の接頭辞
+PROMETHEUS_PREFIX = "mdx"
+
+# APIのパスのうち、IDとみなす部分
+_ID_SEGMENT = re.compile(r"^([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|\d+)$")
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_endpoint(api):
+    """
+    APIのパスに含まれるID(UUIDや数値)を {id} に置き換え、同じ種類のAPIをまとめて集計できるようにする
+
+    :param api: APIのパス (例: "/api/vm/<仮想マシンID>/power_on/")
+    :returns: 正規化したパス (例: "/api/vm/{id}/power_on/")
+    """
+    path = api.split("?", 1)[0]
+    return "/".join("{id}" if _ID_SEGMENT.match(segment) else segment
+                    for segment in path.split("/"))
+
+
+class _Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets.append([bound, cumulative])
+        return {"sum": self.sum, "count": self.count, "buckets": buckets}
+
+
+class MdxMetrics(object):
+    """
+    API呼び出し、トークンのリフレッシュ、再試行、待ち合わせのスリープ時間の計測値。
+
+    MdxLib (AsyncMdxLib) 毎に作成され、同じインスタンスを渡せば複数のクライアントで共有できる。
+    snapshot() で計測値を取得するか、 PrometheusExporter などのエクスポータで出力する。
+
+    :param latency_buckets_sec: API呼び出しの所要時間のヒストグラムの境界(秒)
+    """
+
+    def __init__(self, latency_buckets_sec=DEFAULT_LATENCY_BUCKETS_SEC):
+        self.latency_buckets_sec = tuple(latency_buckets_sec)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        計測値を0に戻す
+        """
+        with self._lock:
+            self._requests = {}
+            self._refreshes = 0
+            self._retries = {}
+            self._waits = {}
+
+    def observe_request(self, method, api, status_code, elapsed_sec):
+        """
+        API呼び出しを記録する
+
+        :param method: HTTPメソッド
+        :param api: APIのパス。 normalize_endpoint() で正規化して集計する
+        :param status_code: HTTPステータス。応答がなかった場合は ``None``
+        :param elapsed_sec: 所要時間(秒)
+        """
+        key = (method, normalize_endpoint(api))
+        status = "error" if status_code is None else str(status_code)
+        with self._lock:
+            entry = self._requests.get(key)
+            if entry is None:
+                entry = self._requests[key] = {
+                    "statuses": {}, "latency": _Histogram(self.latency_buckets_sec)}
+            entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+            entry["latency"].observe(elapsed_sec)
+
+    def count_refresh(self):
+        """
+        トークンのリフレッシュを記録する
+        """
+        with self._lock:
+            self._refreshes += 1
+
+    def count_retry(self, method, api, reason):
+        """
+        再試行を記録する
+
+        :param reason: 再試行の理由 (HTTPステータスまたは例外のクラス名)
+        """
+        key = (method, normalize_endpoint(api), str(reason))
+        with self._lock:
+            self._retries[key] = self._retries.get(key, 0) + 1
+
+    def observe_wait(self, operation, sleep_sec):
+        """
+        待ち合わせのスリープを記録する
+
+        :param operation: 操作種別 ("deploy", "ip_assign", "task_correlation" など)
+        :param sleep_sec: スリープした時間(秒)
+        """
+        operation = operation or "wait"
+        with self._lock:
+            entry = self._waits.setdefault(operation, {"count": 0, "sleep_sec": 0.0})
+            entry["count"] += 1
+            entry["sleep_sec"] += sleep_sec
+
+    def snapshot(self):
+        """
+        計測値を取得する
+
+        :returns: 以下のような計測値
+
+        .. code-block:: json
+
+          {
+            "requests": [
+              {
+                "method": "HTTPメソッド",
+                "endpoint": "正規化したAPIのパス",
+                "count": "呼び出し回数",
+                "statuses": {"HTTPステータス (応答がない場合は error)": "回数"},
+                "latency_sec": {
+                  "sum": "所要時間の合計(秒)",
+                  "count": "回数",
+                  "buckets": [["境界(秒)", "境界以下の累積回数"]]
+                }
+              }
+            ],
+            "token_refreshes": "トークンのリフレッシュ回数",
+            "retries": [
+              {"method": "HTTPメソッド", "endpoint": "APIのパス", "reason": "理由", "count": "回数"}
+            ],
+            "waits": {
+              "操作種別": {"count": "スリープ回数", "sleep_sec": "スリープ時間の合計(秒)"}
+            }
+          }
+
+        """
+        with self._lock:
+            requests = []
+            for (method, endpoint), entry in sorted(self._requests.items()):
+                latency = entry["latency"].snapshot()
+                requests.append({
+                    "method": method,
+                    "endpoint": endpoint,
+                    "count": latency["count"],
+                    "statuses": dict(entry["statuses"]),
+                    "latency_sec": latency,
+                })
+            retries = [{"method": method, "endpoint": endpoint, "reason": reason, "count": count}
+                       for (method, endpoint, reason), count in sorted(self._retries.items())]
+            waits = {operation: dict(entry) for operation, entry in sorted(self._waits.items())}
+            return {
+                "requests": requests,
+                "token_refreshes": self._refreshes,
+                "retries": retries,
+                "waits": waits,
+            }
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join('{}="{}"'.format(name, _escape_label(value))
+                          for name, value in labels.items()) + "}"
+
+
+class PrometheusExporter(object):
+    """
+    MdxMetrics の計測値を Prometheus のテキスト形式で出力するエクスポータ。
+
+    :param metrics: MdxMetrics。 MdxResourceExt.metrics などで取得する
+    :param prefix: メトリクス名の接頭辞
+
+    .. code-block:: python
+
+      exporter = PrometheusExporter(mdx.metrics)
+      exporter.serve(9100)  # http://localhost:9100/metrics で公開する
+    """
+
+    def __init__(self, metrics, prefix=PROMETHEUS_PREFIX):
+        self.metrics = metrics
+        self.prefix = prefix
+        self._server = None
+
+    def export(self):
+        """
+        計測値を Prometheus のテキスト形式の文字列として返す
+        """
+        snapshot = self.metrics.snapshot()
+        p = self.prefix
+        lines = [
+            "# HELP {}_requests_total mdx REST API calls.".format(p),
+            "# TYPE {}_requests_total counter".format(p),
+        ]
+        for request in snapshot["requests"]:
+            for status, count in sorted(request["statuses"].items()):
+                lines.append("{}_requests_total{} {}".format(
+                    p, _labels(method=request["method"], endpoint=request["endpoint"],
+                               status=status), count))
+        lines += [
+            "# HELP {}_request_duration_seconds mdx REST API call latency.".format(p),
+            "# TYPE {}_request_duration_seconds histogram".format(p),
+        ]
+        for request in snapshot["requests"]:
+            latency = request["latency_sec"]
+            labels = dict(method=request["method"], endpoint=request["endpoint"])
+            for bound, count in latency["buckets"]:
+                lines.append("{}_request_duration_seconds_bucket{} {}".format(
+                    p, _labels(le=bound, **labels), count))
+            lines.append("{}_request_duration_seconds_bucket{} {}".format(
+                p, _labels(le="+Inf", **labels), latency["count"]))
+            lines.append("{}_request_duration_seconds_sum{} {}".format(
+                p, _labels(**labels), latency["sum"]))
+            lines.append("{}_request_duration_seconds_count{} {}".format(
+                p, _labels(**labels), latency["count"]))
+        lines += [
+            "# HELP {}_token_refreshes_total Token refreshes.".format(p),
+            "# TYPE {}_token_refreshes_total counter".format(p),
+            "{}_token_refreshes_total {}".format(p, snapshot["token_refreshes"]),
+            "# HELP {}_retries_total Retried API calls.".format(p),
+            "# TYPE {}_retries_total counter".format(p),
+        ]
+        for retry in snapshot["retries"]:
+            lines.append("{}_retries_total{} {}".format(
+                p, _labels(method=retry["method"], endpoint=retry["endpoint"],
+                           reason=retry["reason"]), retry["count"]))
+        lines += [
+            "# HELP {}_wait_sleep_seconds_total Time spent sleeping while polling.".format(p),
+            "# TYPE {}_wait_sleep_seconds_total counter".format(p),
+        ]
+        for operation, wait in snapshot["waits"].items():
+            lines.append("{}_wait_sleep_seconds_total{} {}".format(
+                p, _labels(operation=operation), wait["sleep_sec"]))
+        lines += [
+            "# HELP {}_wait_sleeps_total Sleeps while polling.".format(p),
+            "# TYPE {}_wait_sleeps_total counter".format(p),
+        ]
+        for operation, wait in snapshot["waits"].items():
+            lines.append("{}_wait_sleeps_total{} {}".format(
+                p, _labels(operation=operation), wait["count"]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        計測値をファイルに書き出す (node_exporter の textfile collector 向け)
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.export())
+
+    def serve(self, port, addr=""):
+        """
+        計測値を HTTP の /metrics で公開するスレッドを開始する
+
+        :param port: 待ち受けるポート番号
+        :param addr: 待ち受けるアドレス
+        :returns: http.server.ThreadingHTTPServer
+        """
+        # HTTPサーバは公開する場合にのみ必要なので、ここで読み込む
+        import http.server
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exporter.export().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self._server = http.server.ThreadingHTTPServer((addr, port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+        return self._server
+
+    def shutdown(self):
+        """
+        serve() で開始したHTTPサーバを停止する
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,212 @@
+#
+# mdx 仮想マシンのSSH接続の待ち合わせ
+#
+import errno
+import heapq
+import itertools
+import logging
+import selectors
+import socket
+import time
+
+# 接続を試みる間隔(秒)
+SSH_PROBE_INTERVAL_SEC = 2
+# 1回の接続(とバナーの受信)を待つ秒数
+SSH_PROBE_CONNECT_TIMEOUT_SEC = 5
+# 同時に接続を試みるソケット数の上限
+SSH_PROBE_MAX_CONNECTIONS = 256
+# SSHバナーとして読み込む最大バイト数 (RFC 4253 の識別文字列は255バイトまで)
+SSH_BANNER_MAX_BYTES = 255
+
+logger = logging.getLogger(__name__)
+
+
+class _ProbeTarget(object):
+
+    def __init__(self, host):
+        self.host = host
+        self.attempts = 0
+        self.address = None
+        self.sock = None
+        self.started_at = None
+        self.buffer = b""
+        self.last_error = None
+
+
+def _resolve(host, port):
+    """
+    ホストの接続先 (family, type, proto, canonname, sockaddr) を返す。IPアドレスの場合は名前解決しない
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM, flags=socket.AI_NUMERICHOST)
+    except socket.gaierror:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return infos[0]
+
+
+def _ready_result(target, started, banner):
+    return {"result": "ready", "attempts": target.attempts,
+            "elapsed_sec": time.monotonic() - started, "banner": banner, "error": None}
+
+
+def _failed_result(target, started, error):
+    return {"result": "failed", "attempts": target.attempts,
+            "elapsed_sec": time.monotonic() - started, "banner": None, "error": error}
+
+
+def probe_ssh_iter(hosts, port=22, read_banner=True, interval_sec=SSH_PROBE_INTERVAL_SEC,
+                   connect_timeout_sec=SSH_PROBE_CONNECT_TIMEOUT_SEC,
+                   max_connections=SSH_PROBE_MAX_CONNECTIONS, deadline=None):
+    """
+    複数のホストにノンブロッキングソケットで並行して接続を試み、SSH接続を受け付けたホストから順に結果を返す
+    ジェネレータ。
+
+    接続に失敗したホストは interval_sec 秒後に再び接続する。read_banner が ``True`` の場合は、
+    接続後に "SSH-" で始まるバナーを受信するまで待つ (sshd の起動途中で接続だけ受け付ける場合がある)。
+
+    ホスト名は接続を始める前に一度だけ名前解決する (名前解決はブロックするため、接続を待つ間には行わない)。
+    名前解決できないホストは、試行せずに socket.gaierror を error とする failed となる。
+
+    :param hosts: ホスト名またはIPアドレスのリスト
+    :param port: 接続するポート
+    :param read_banner: SSHバナーの受信まで待つ場合 ``True`` を指定
+    :param interval_sec: 接続に失敗した後、再び接続するまでの秒数
+    :param connect_timeout_sec: 1回の接続(とバナーの受信)を待つ秒数
+    :param max_connections: 同時に接続を試みるソケット数の上限
+    :param deadline: 期限 (mdx_lib.Deadline)。期限までに接続できなかったホストは、
+      MdxTimeoutException を error とする failed となる。 ``None`` の場合は全てのホストに接続できるまで待つ
+    :returns: (ホスト, 結果) のタプルを返すジェネレータ。結果は以下のようなdict
+
+    .. code-block:: json
+
+      {
+        "result": "ready(接続できた) / failed(期限切れ、名前解決の失敗)",
+        "attempts": "接続の試行回数",
+        "elapsed_sec": "接続できるまでの秒数",
+        "banner": "SSHバナー (read_banner=False の場合は None)",
+        "error": "失敗時の例外 (それ以外は None)"
+      }
+
+    """
+    started = time.monotonic()
+    targets = []
+    for host in dict.fromkeys(hosts):
+        target = _ProbeTarget(host)
+        try:
+            target.address = _resolve(host, port)
+        except OSError as e:
+            logger.debug("{}:{}: cannot resolve: {}".format(host, port, e))
+            yield host, _failed_result(target, started, e)
+            continue
+        targets.append(target)
+    selector = selectors.DefaultSelector()
+    # 接続を試みるホストの (時刻, 登録順, _ProbeTarget) のヒープ
+    pending = [(started, i, target) for i, target in enumerate(targets)]
+    order = itertools.count(len(pending))
+    connecting = set()
+    done = set()
+
+    def close(target, error):
+        selector.unregister(target.sock)
+        target.sock.close()
+        target.sock = None
+        target.buffer = b""
+        target.last_error = error
+        connecting.discard(target)
+
+    def ready(target, banner):
+        close(target, None)
+        done.add(target)
+        return target.host, _ready_result(target, started, banner)
+
+    def retry(target, error):
+        logger.debug("{}:{}: not ready: {}".format(target.host, port, error))
+        close(target, error)
+        heapq.heappush(pending, (time.monotonic() + interval_sec, next(order), target))
+
+    try:
+        while pending or connecting:
+            now = time.monotonic()
+            if deadline is not None and deadline.expired(now):
+                for target in list(connecting):
+                    close(target, target.last_error)
+                for target in targets:
+                    if target not in done:
+                        error = deadline.exception("ssh_ready")
+                        error.__cause__ = target.last_error
+                        yield target.host, _failed_result(target, started, error)
+                return
+
+            while pending and pending[0][0] <= now and len(connecting) < max_connections:
+                target = heapq.heappop(pending)[2]
+                target.attempts += 1
+                target.started_at = now
+                family, socktype, proto, _, address = target.address
+                try:
+                    sock = socket.socket(family, socktype, proto)
+                except OSError as e:
+                    target.last_error = e
+                    heapq.heappush(pending, (now + interval_sec, next(order), target))
+                    continue
+                sock.setblocking(False)
+                target.sock = sock
+                connecting.add(target)
+                # 接続の完了は書き込み可能になったことで検知する
+                selector.register(sock, selectors.EVENT_WRITE, target)
+                code = sock.connect_ex(address)
+                if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                    retry(target, OSError(code, errno.errorcode.get(code, str(code))))
+
+            if not pending and not connecting:
+                break
+            timeout = None
+            if pending and len(connecting) < max_connections:
+                timeout = pending[0][0] - now
+            if connecting:
+                first_timeout = min(t.started_at for t in connecting) + connect_timeout_sec - now
+                timeout = first_timeout if timeout is None else min(timeout, first_timeout)
+            if deadline is not None:
+                remaining = deadline.remaining(now)
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            timeout = max(0.0, timeout)
+
+            if not connecting:
+                time.sleep(timeout)
+                continue
+
+            for key, events in selector.select(timeout):
+                target = key.data
+                if events & selectors.EVENT_WRITE and key.events == selectors.EVENT_WRITE:
+                    code = target.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if code != 0:
+                        retry(target, OSError(code, errno.errorcode.get(code, str(code))))
+                    elif not read_banner:
+                        yield ready(target, None)
+                    else:
+                        selector.modify(target.sock, selectors.EVENT_READ, target)
+                    continue
+                try:
+                    data = target.sock.recv(SSH_BANNER_MAX_BYTES)
+                except OSError as e:
+                    retry(target, e)
+                    continue
+                if not data:
+                    retry(target, ConnectionResetError("connection closed before ssh banner"))
+                    continue
+                target.buffer += data
+                # RFC 4253 ではバナーの前に他の行を送る場合があるため、"SSH-" で始まる行を探す
+                while b"\n" in target.buffer or len(target.buffer) >= SSH_BANNER_MAX_BYTES:
+                    line, _, rest = target.buffer.partition(b"\n")
+                    banner = line.rstrip(b"\r").decode("ascii", "replace")
+                    if banner.startswith("SSH-"):
+                        yield ready(target, banner)
+                        break
+                    target.buffer = rest
+
+            now = time.monotonic()
+            for target in [t for t in connecting if now - t.started_at >= connect_timeout_sec]:
+                retry(target, socket.timeout("timed out"))
+    finally:
+        for target in list(connecting):
+            close(target, target.last_error)
+        selector.close()
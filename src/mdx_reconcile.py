@@ -0,0 +1,141 @@
+#
+# mdx ACL、DNAT の宣言的な設定 (現在の設定と望ましい設定の差分の計算)
+#
+
+# ACLのルールを識別する項目
+ACL_RULE_FIELDS = ("src_address", "src_mask", "src_port", "dst_address", "dst_mask", "dst_port",
+                   "protocol")
+# DNATを識別する項目 (グローバルIPアドレスは1つのDNATにしか割り当てられない)
+DNAT_KEY_FIELD = "pool_address"
+# DNATの設定内容の項目
+DNAT_RULE_FIELDS = ("segment", "dst_address")
+# アドレスとして正規化する項目
+_ADDRESS_FIELDS = ("src_address", "dst_address", "pool_address")
+# 計画を適用する順序。削除で空いたグローバルIPアドレスなどを、追加で使えるようにする
+ACTION_ORDER = ("delete", "edit", "add")
+
+
+def _normalize(field, value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    if field in _ADDRESS_FIELDS:
+        import ipaddress
+        try:
+            return ipaddress.ip_address(value).compressed
+        except ValueError:
+            return value
+    if field == "protocol":
+        return value.lower()
+    return value
+
+
+def acl_rule_key(rule):
+    """
+    ACLのルールを識別するキーを返す。アドレスの表記、マスクとポートの数値と文字列の違いは同一とみなす
+    """
+    return tuple(_normalize(field, rule.get(field)) for field in ACL_RULE_FIELDS)
+
+
+def _dnat_content(rule):
+    return tuple(_normalize(field, rule.get(field)) for field in DNAT_RULE_FIELDS)
+
+
+def _action(action, kind, spec=None, current=None):
+    return {
+        "action": action,
+        "kind": kind,
+        "id": None if current is None else current["uuid"],
+        "spec": spec,
+        "current": current,
+    }
+
+
+def plan_acl(kind, current, desired, prune=True):
+    """
+    ACLの現在の設定を望ましい設定にするための、最小の追加・編集・削除の計画を作成する。
+
+    ルールは acl_rule_key() のキーで対応付ける。望ましい設定にないルールは、不足しているルールへの編集に
+    再利用し、それでも余ったルールを削除、不足したルールを追加する。
+
+    :param kind: "acl_ipv4" または "acl_ipv6"
+    :param current: 現在のルールのリスト (get_allow_acl_ipv4_info() などの返り値)
+    :param desired: 望ましいルールのリスト
+    :param prune: 望ましい設定にないルールを削除・編集する場合 ``True`` を指定
+    :returns: (計画, 変更の必要がないルール数) のタプル。計画の要素は以下のようなdict
+
+    .. code-block:: json
+
+      {
+        "action": "add / edit / delete",
+        "kind": "acl_ipv4 / acl_ipv6 / dnat",
+        "id": "編集・削除するルールのID (追加の場合は None)",
+        "spec": "追加・編集後のルール (削除の場合は None)",
+        "current": "編集・削除前のルール (追加の場合は None)"
+      }
+
+    """
+    current_by_key = {}
+    for rule in current:
+        current_by_key.setdefault(acl_rule_key(rule), []).append(rule)
+
+    unchanged = 0
+    missing = []
+    seen = set()
+    for spec in desired:
+        key = acl_rule_key(spec)
+        if key in seen:
+            continue
+        seen.add(key)
+        matched = current_by_key.get(key)
+        if matched:
+            matched.pop()
+            unchanged += 1
+        else:
+            missing.append(spec)
+
+    actions = []
+    if prune:
+        # 重複して登録されているルールも、1つを残して余ったルールとして扱う
+        extra = [rule for rules in current_by_key.values() for rule in rules]
+        for rule, spec in zip(extra, missing):
+            actions.append(_action("edit", kind, spec, rule))
+        for rule in extra[len(missing):]:
+            actions.append(_action("delete", kind, current=rule))
+        missing = missing[len(extra):]
+    for spec in missing:
+        actions.append(_action("add", kind, spec))
+    return actions, unchanged
+
+
+def plan_dnat(current, desired, prune=True):
+    """
+    DNATの現在の設定を望ましい設定にするための、最小の追加・編集・削除の計画を作成する。
+
+    DNATは転送元グローバルIPアドレス (pool_address) で対応付け、転送先が異なる場合は編集する。
+
+    :param current: 現在のDNATのリスト (get_dnat() の返り値)
+    :param desired: 望ましいDNATのリスト
+    :param prune: 望ましい設定にないDNATを削除する場合 ``True`` を指定
+    :returns: (計画, 変更の必要がないDNAT数) のタプル。計画の詳細は plan_acl() を参照のこと。
+    """
+    current_by_key = {_normalize(DNAT_KEY_FIELD, rule[DNAT_KEY_FIELD]): rule for rule in current}
+    unchanged = 0
+    actions = []
+    seen = set()
+    for spec in desired:
+        key = _normalize(DNAT_KEY_FIELD, spec[DNAT_KEY_FIELD])
+        if key in seen:
+            continue
+        seen.add(key)
+        rule = current_by_key.pop(key, None)
+        if rule is None:
+            actions.append(_action("add", "dnat", spec))
+        elif _dnat_content(rule) != _dnat_content(spec):
+            actions.append(_action("edit", "dnat", spec, rule))
+        else:
+            unchanged += 1
+    if prune:
+        for rule in current_by_key.values():
+            actions.append(_action("delete", "dnat", current=rule))
+    return actions, unchanged
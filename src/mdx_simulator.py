@@ -0,0 +1,910 @@
+#
+# mdx REST API のローカルシミュレータ
+#
+import argparse
+import base64
+import datetime
+import heapq
+import http.server
+import io
+import ipaddress
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+import requests
+from requests.adapters import BaseAdapter
+
+from .mdx_history import HISTORY_DATETIME_FORMAT
+from .mdx_lib import MdxLib, _decode_jwt_claims
+
+# 状態遷移にかかる時間(秒)の既定値
+DEFAULT_DEPLOY_DELAY_SEC = 3
+DEFAULT_CLONE_DELAY_SEC = 3
+DEFAULT_POWER_DELAY_SEC = 1
+DEFAULT_DESTROY_DELAY_SEC = 1
+DEFAULT_IP_ASSIGN_DELAY_SEC = 2
+# 発行するトークンの有効期間(秒)
+DEFAULT_SIMULATOR_TOKEN_TTL_SEC = 3600
+# ページサイズを省略した場合の件数
+DEFAULT_SIMULATOR_PAGE_SIZE = 100
+# 接続断を模擬するエラー
+DISCONNECT = "disconnect"
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_jwt(claims):
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode("utf-8")).decode("ascii").rstrip("=")
+    return "{}.{}.{}".format(encode({"alg": "none", "typ": "JWT"}), encode(claims), "simulator")
+
+
+class _ErrorRule(object):
+
+    def __init__(self, count, status, method, path, retry_after):
+        self.count = count
+        self.status = status
+        self.method = method
+        self.path = None if path is None else re.compile(path)
+        self.retry_after = retry_after
+
+    def match(self, method, path):
+        if self.method is not None and self.method != method:
+            return False
+        return self.path is None or self.path.search(path) is not None
+
+
+class SimulatorResponse(object):
+    """
+    MdxSimulator.handle() の応答
+
+    :ivar status_code: HTTPステータス。接続断を模擬する場合は DISCONNECT
+    :ivar body: 応答本体 (JSONに変換する値)。本体がない場合は ``None``
+    :ivar headers: 応答ヘッダのdict
+    """
+
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def content(self):
+        if self.body is None:
+            return b""
+        return json.dumps(self.body, ensure_ascii=False).encode("utf-8")
+
+
+class MdxSimulator(object):
+    """
+    mdx REST API の状態を持つシミュレータ。
+
+    MdxLib が使用するAPI(ログイン、トークンのリフレッシュ、仮想マシンのデプロイ・クローン・電源操作・削除、
+    仮想マシン一覧・詳細・操作履歴、カタログ、セグメント、ACL(IPv4/IPv6)、DNAT、グローバルIP)を模擬する。
+    仮想マシンは Deploying→PowerON のように指定した時間をかけて状態遷移し、起動後しばらくしてから
+    IPv4アドレスが付与される。削除が完了した仮想マシンは404となる。
+
+    SimulatorAdapter でプロセス内から、 SimulatorServer でHTTPサーバとして使用する。
+
+    :param project_name: プロジェクト名
+    :param vm_count: 最初から存在する仮想マシンの数 (vm-0001, vm-0002, ... の PowerON の仮想マシン)
+    :param deploy_delay_sec: デプロイが完了して PowerON になるまでの時間(秒)
+    :param clone_delay_sec: クローンが完了して PowerOFF になるまでの時間(秒)
+    :param power_delay_sec: 電源操作が完了するまでの時間(秒)
+    :param destroy_delay_sec: 削除が完了するまでの時間(秒)
+    :param ip_assign_delay_sec: PowerON になってからIPv4アドレスが付与されるまでの時間(秒)
+    :param latency_sec: 応答までの遅延(秒)。(最小, 最大) のタプルを指定すると一様乱数とする
+    :param error_rate: 一時的なエラー(error_status)を返す確率
+    :param error_status: error_rate で返すHTTPステータス
+    :param token_ttl_sec: 発行するトークンの有効期間(秒)
+    :param seed: 遅延とエラーの乱数のシード
+    :param clock: 現在時刻(UNIX時刻)を返す関数。省略時は time.time
+
+    .. code-block:: python
+
+      sim = MdxSimulator(vm_count=100, latency_sec=0.01)
+      mdx = MdxResourceExt(sim.issue_token())
+      sim.attach(mdx)
+      mdx.set_current_project_by_name(sim.project_name)
+      mdx.deploy_vm("test-[1-3]", vm_spec)
+    """
+
+    def __init__(self, project_name="simulator", vm_count=0,
+                 deploy_delay_sec=DEFAULT_DEPLOY_DELAY_SEC,
+                 clone_delay_sec=DEFAULT_CLONE_DELAY_SEC,
+                 power_delay_sec=DEFAULT_POWER_DELAY_SEC,
+                 destroy_delay_sec=DEFAULT_DESTROY_DELAY_SEC,
+                 ip_assign_delay_sec=DEFAULT_IP_ASSIGN_DELAY_SEC,
+                 latency_sec=0, error_rate=0.0, error_status=503,
+                 token_ttl_sec=DEFAULT_SIMULATOR_TOKEN_TTL_SEC, seed=None, clock=time.time):
+        self.project_name = project_name
+        self.deploy_delay_sec = deploy_delay_sec
+        self.clone_delay_sec = clone_delay_sec
+        self.power_delay_sec = power_delay_sec
+        self.destroy_delay_sec = destroy_delay_sec
+        self.ip_assign_delay_sec = ip_assign_delay_sec
+        self.latency_sec = latency_sec
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.token_ttl_sec = token_ttl_sec
+        self._clock = clock
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._error_rules = []
+        self._request_counts = {}
+        self._tokens = set()
+        self._events = []
+        self._event_seq = itertools.count()
+
+        self.org_id = str(uuid.uuid4())
+        self.project_id = str(uuid.uuid4())
+        self._vms = {}
+        self._history = []
+        self._catalog_entries = [{
+            "uuid": str(uuid.uuid4()),
+            "name": "Ubuntu Server 22.04",
+            "type": "public",
+            "template_name": "UT-20240101-ubuntu-2204",
+            "os_type": "Linux",
+            "os_name": "Ubuntu",
+            "os_version": "22.04",
+            "hw_version": "vmx-19",
+            "description": "simulator catalog",
+            "login_username": "mdxuser",
+        }]
+        self._segments = {}
+        self._acls = {"ipv4": {}, "ipv6": {}}
+        self._dnats = {}
+        self._global_ips = ["192.0.2.{}".format(i) for i in range(10, 20)]
+        self.add_segment("default", default=True)
+        for i in range(vm_count):
+            self.add_vm("vm-{:04d}".format(i + 1))
+
+    # 状態の準備
+
+    def issue_token(self, user_id=1):
+        """
+        シミュレータが受け付けるトークンを発行する
+
+        :param user_id: トークンの利用者ID (user_id クレーム)
+        """
+        with self._lock:
+            token = _encode_jwt({"user_id": user_id,
+                                 "exp": int(self._clock() + self.token_ttl_sec),
+                                 "jti": str(uuid.uuid4())})
+            self._tokens.add(token)
+            return token
+
+    def add_segment(self, name, default=False):
+        """
+        ネットワークセグメントを追加し、セグメントIDを返す
+        """
+        with self._lock:
+            segment_id = str(uuid.uuid4())
+            index = len(self._segments)
+            self._segments[segment_id] = {
+                "uuid": segment_id,
+                "name": name,
+                "default": default,
+                "vlan_id": 100 + index,
+                "vni": 10000 + index,
+                "network": ipaddress.ip_network("10.{}.0.0/16".format(index)),
+                "next_host": 10,
+            }
+            return segment_id
+
+    def add_vm(self, vm_name, status="PowerON", segment_id=None):
+        """
+        状態遷移を経ずに仮想マシンを追加し、仮想マシンIDを返す。PowerON の場合はIPv4アドレスも付与する。
+        """
+        with self._lock:
+            vm = self._create_vm(vm_name, {}, status, segment_id)
+            if status == "PowerON":
+                self._assign_ip(vm)
+            return vm["uuid"]
+
+    def rename_vm(self, vm_id, vm_name):
+        """
+        APIを経ずに仮想マシン名を変更する (ポータルなど他のクライアントでの変更の再現)
+        """
+        with self._lock:
+            self._vms[vm_id]["name"] = vm_name
+
+    def remove_vm(self, vm_id):
+        """
+        状態遷移を経ずに仮想マシンを削除する (他のクライアントでの削除の再現)
+        """
+        with self._lock:
+            del self._vms[vm_id]
+
+    def fail_next(self, count=1, status=503, method=None, path=None, retry_after=None):
+        """
+        以降の要求に対してエラーを返すよう設定する。
+
+        :param count: エラーを返す回数
+        :param status: HTTPステータス。DISCONNECT を指定すると接続断とする
+        :param method: 対象のHTTPメソッド。省略時は全て
+        :param path: 対象のAPIのパスの正規表現。省略時は全て
+        :param retry_after: Retry-After ヘッダの値(秒)
+        """
+        with self._lock:
+            self._error_rules.append(_ErrorRule(count, status, method, path, retry_after))
+
+    def get_request_counts(self):
+        """
+        受け付けた要求の数を返す
+
+        :returns: "メソッド パス" (IDは {id} に置き換える) をキーとした要求数のdict
+        """
+        with self._lock:
+            return dict(self._request_counts)
+
+    def reset_request_counts(self):
+        with self._lock:
+            self._request_counts = {}
+
+    def attach(self, client):
+        """
+        MdxResourceExt または MdxLib の要求をこのシミュレータに送るようにする
+        """
+        mdxlib = getattr(client, "_mdxlib", client)
+        mdxlib._session.mount(mdxlib._endpoint, SimulatorAdapter(self))
+
+    def delay(self):
+        """
+        応答の遅延(秒)を返す
+        """
+        if isinstance(self.latency_sec, (tuple, list)):
+            return self._random.uniform(*self.latency_sec)
+        return self.latency_sec
+
+    # 要求の処理
+
+    def handle(self, method, path, query=None, body=None, headers=None):
+        """
+        要求を処理して SimulatorResponse を返す
+
+        :param method: HTTPメソッド
+        :param path: APIのパス
+        :param query: クエリ文字列のdict
+        :param body: 要求本体 (JSONの文字列またはbytes)
+        :param headers: 要求ヘッダのdict
+        """
+        query = query or {}
+        headers = headers or {}
+        with self._lock:
+            key = "{} {}".format(method, _normalize_path(path))
+            self._request_counts[key] = self._request_counts.get(key, 0) + 1
+            injected = self._injected_error(method, path)
+            if injected is not None:
+                return injected
+            self._advance(self._clock())
+            for route_method, pattern, handler_name, with_token in _ROUTES:
+                if route_method != method:
+                    continue
+                match = pattern.fullmatch(path)
+                if match is None:
+                    continue
+                if with_token and not self._authorized(headers):
+                    return SimulatorResponse(401, {"detail": "Signature has expired."})
+                try:
+                    data = _parse_body(body)
+                except ValueError:
+                    return SimulatorResponse(400, {"detail": "JSON parse error"})
+                return getattr(self, handler_name)(query, data, *match.groups())
+            return SimulatorResponse(404, {"detail": "Not found."})
+
+    def _injected_error(self, method, path):
+        for rule in self._error_rules:
+            if rule.count > 0 and rule.match(method, path):
+                rule.count -= 1
+                headers = {}
+                if rule.retry_after is not None:
+                    headers["Retry-After"] = str(rule.retry_after)
+                return SimulatorResponse(rule.status, {"detail": "injected error"}, headers)
+        self._error_rules = [rule for rule in self._error_rules if rule.count > 0]
+        if self.error_rate > 0 and self._random.random() < self.error_rate:
+            return SimulatorResponse(self.error_status, {"detail": "injected error"})
+        return None
+
+    def _authorized(self, headers):
+        authorization = headers.get("Authorization") or headers.get("authorization") or ""
+        if not authorization.startswith("JWT "):
+            return False
+        token = authorization[len("JWT "):]
+        return token in self._tokens and self._token_exp(token) > self._clock()
+
+    @staticmethod
+    def _token_exp(token):
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload.encode("ascii")))["exp"]
+
+    # 状態遷移
+
+    def _schedule(self, delay_sec, vm, kind, value=None):
+        heapq.heappush(self._events, (self._clock() + delay_sec, next(self._event_seq),
+                                      vm["uuid"], vm["_generation"], kind, value))
+
+    def _advance(self, now):
+        while self._events and self._events[0][0] <= now:
+            _due, _seq, vm_id, generation, kind, value = heapq.heappop(self._events)
+            vm = self._vms.get(vm_id)
+            # 削除済み、または後の操作で置き換えられた状態遷移は無視する
+            if vm is None or vm["_generation"] != generation:
+                continue
+            if kind == "ip":
+                self._assign_ip(vm)
+                continue
+            task = vm["_task"]
+            vm["_task"] = None
+            if task is not None:
+                task["status"] = "Completed"
+                task["progress"] = 100
+                task["end_datetime"] = self._format_time(now)
+            if kind == "destroy":
+                del self._vms[vm_id]
+                continue
+            vm["status"] = value
+            if value == "PowerON" and not vm["_ipv4"]:
+                self._schedule(self.ip_assign_delay_sec, vm, "ip")
+
+    def _assign_ip(self, vm):
+        segment = self._segments[vm["_segment"]]
+        vm["_ipv4"] = [str(segment["network"].network_address + segment["next_host"])]
+        segment["next_host"] += 1
+
+    def _create_vm(self, vm_name, spec, status, segment_id=None):
+        if segment_id is None:
+            adapters = spec.get("network_adapters") or []
+            segment_id = adapters[0].get("segment") if adapters else None
+        if segment_id not in self._segments:
+            segment_id = next(iter(self._segments))
+        vm_id = str(uuid.uuid4())
+        vm = {
+            "uuid": vm_id,
+            "name": vm_name,
+            "status": status,
+            "pack_type": spec.get("pack_type", "cpu"),
+            "pack_num": spec.get("pack_num", 1),
+            "gpu": spec.get("gpu", "0"),
+            "disk_size": spec.get("disk_size", 40),
+            "storage_network": spec.get("storage_network", "portgroup"),
+            "_segment": segment_id,
+            "_ipv4": [],
+            "_task": None,
+            "_generation": 0,
+        }
+        self._vms[vm_id] = vm
+        return vm
+
+    def _start_task(self, vm, type, delay_sec, kind, value=None):
+        now = self._clock()
+        task = {
+            "uuid": str(uuid.uuid4()),
+            "project": self.project_id,
+            "user_name": "simulator",
+            "type": type,
+            "object_uuid": vm["uuid"],
+            "object_name": vm["name"],
+            "start_datetime": self._format_time(now),
+            "end_datetime": None,
+            "status": "Running",
+            "progress": 0,
+            "error_message": "",
+            "error_detail": "",
+        }
+        self._history.append(task)
+        vm["_task"] = task
+        vm["_generation"] += 1
+        self._schedule(delay_sec, vm, kind, value)
+        return task
+
+    def _format_time(self, timestamp):
+        return datetime.datetime.fromtimestamp(timestamp).strftime(HISTORY_DATETIME_FORMAT)
+
+    # 応答の組み立て
+
+    def _paginate(self, query, items):
+        try:
+            page = int(query.get("page", 1))
+            page_size = int(query.get("page_size", DEFAULT_SIMULATOR_PAGE_SIZE))
+        except ValueError:
+            return SimulatorResponse(400, {"detail": "invalid page"})
+        if page < 1 or page_size < 1:
+            return SimulatorResponse(400, {"detail": "invalid page"})
+        start = (page - 1) * page_size
+        if page > 1 and start >= len(items):
+            return SimulatorResponse(404, {"detail": "Invalid page."})
+        end = start + page_size
+        return SimulatorResponse(200, {
+            "count": len(items),
+            "next": "?page={}".format(page + 1) if end < len(items) else None,
+            "previous": "?page={}".format(page - 1) if page > 1 else None,
+            "results": items[start:end],
+        })
+
+    def _vm_summary(self, vm):
+        return {
+            "uuid": vm["uuid"],
+            "name": vm["name"],
+            "status": vm["status"],
+            "vcenter": "vcenter-sim",
+            "running_tasks": [] if vm["_task"] is None else [vm["_task"]["type"]],
+        }
+
+    def _vm_detail(self, vm):
+        segment = self._segments[vm["_segment"]]
+        return {
+            "name": vm["name"],
+            "os_type": "Linux",
+            "status": vm["status"],
+            "vmware_tools": [{"status": "toolsOk" if vm["status"] == "PowerON" else "toolsNotRunning",
+                              "version": "12352"}],
+            "cpu": 3 * vm["pack_num"],
+            "memory": "{} GB".format(9 * vm["pack_num"]),
+            "gpu": vm["gpu"],
+            "service_networks": [{
+                "adapter_number": 1,
+                "ipv4_address": list(vm["_ipv4"]),
+                "ipv6_address": [],
+                "segment": segment["name"],
+            }],
+            "storage_networks": [{
+                "adapter_number": 2,
+                "ipv4_address": [],
+                "ipv6_address": [],
+                "type": vm["storage_network"],
+            }],
+            "hard_disks": [{"disk_number": 1, "device_key": 2000,
+                            "capacity": "{} GB".format(vm["disk_size"]), "datastore": "datastore-sim"}],
+            "dvd_media": "",
+            "vcenter": "vcenter-sim",
+            "esxi": "esxi-sim",
+            "pack_type": vm["pack_type"],
+            "pack_num": vm["pack_num"],
+        }
+
+    def _get_vm(self, vm_id):
+        return self._vms.get(vm_id)
+
+    def _check_project(self, project_id):
+        return project_id == self.project_id
+
+    # 認証
+
+    def _login(self, query, data):
+        if not data.get("username") or not data.get("password"):
+            return SimulatorResponse(400, {"detail": "username and password are required"})
+        return SimulatorResponse(200, {"token": self.issue_token()})
+
+    def _refresh(self, query, data):
+        token = data.get("token")
+        if token not in self._tokens:
+            return SimulatorResponse(400, {"non_field_errors": ["Error decoding signature."]})
+        # リフレッシュしたトークンも同じ利用者のものとする
+        user_id = _decode_jwt_claims(token)["user_id"]
+        return SimulatorResponse(200, {"token": self.issue_token(user_id)})
+
+    # 仮想マシン
+
+    def _deploy(self, query, data):
+        if not self._check_project(data.get("project")) or not data.get("vm_name"):
+            return SimulatorResponse(400, {"detail": "invalid vm spec"})
+        vm_names = MdxLib._predict_vmnames(None, data["vm_name"])
+        existing = set(vm["name"] for vm in self._vms.values())
+        if existing.intersection(vm_names):
+            return SimulatorResponse(400, {"detail": "vm name already exists"})
+        task_ids = []
+        for vm_name in vm_names:
+            vm = self._create_vm(vm_name, data, "Deploying")
+            task = self._start_task(vm, "deploy", self.deploy_delay_sec, "status",
+                                    "PowerON" if data.get("power_on", True) else "PowerOFF")
+            task_ids.append(task["uuid"])
+        return SimulatorResponse(202, {"task_id": task_ids})
+
+    def _clone(self, query, data, vm_id):
+        original = self._get_vm(vm_id)
+        if original is None:
+            return SimulatorResponse(404, {"detail": "Not found."})
+        if not self._check_project(data.get("project")) or not data.get("vm_name"):
+            return SimulatorResponse(400, {"detail": "invalid vm spec"})
+        if any(vm["name"] == data["vm_name"] for vm in self._vms.values()):
+            return SimulatorResponse(400, {"detail": "vm name already exists"})
+        spec = dict((k, original[k]) for k in ("pack_type", "pack_num", "gpu", "disk_size",
+                                               "storage_network"))
+        spec.update(data)
+        vm = self._create_vm(data["vm_name"], spec, "Deploying")
+        task = self._start_task(vm, "clone", self.clone_delay_sec, "status", "PowerOFF")
+        return SimulatorResponse(202, {"task_id": [task["uuid"]]})
+
+    def _power(self, vm_id, type, allowed, target, delay_sec, kind="status"):
+        vm = self._get_vm(vm_id)
+        if vm is None:
+            return SimulatorResponse(404, {"detail": "Not found."})
+        if vm["status"] not in allowed or vm["_task"] is not None:
+            return SimulatorResponse(400, {"detail": "{} is not allowed in {}".format(type, vm["status"])})
+        task = self._start_task(vm, type, delay_sec, kind, target)
+        return SimulatorResponse(202, {"task_id": [task["uuid"]]})
+
+    def _power_on(self, query, data, vm_id):
+        return self._power(vm_id, "power_on", ("PowerOFF", "Deallocated"), "PowerON",
+                           self.power_delay_sec)
+
+    def _power_off(self, query, data, vm_id):
+        return self._power(vm_id, "power_off", ("PowerON",), "PowerOFF", self.power_delay_sec)
+
+    def _shutdown(self, query, data, vm_id):
+        return self._power(vm_id, "shutdown", ("PowerON",), "PowerOFF", self.power_delay_sec)
+
+    def _reboot(self, query, data, vm_id):
+        # ゲストOSの再起動中も仮想マシンは PowerON のまま
+        return self._power(vm_id, "reboot", ("PowerON",), "PowerON", self.power_delay_sec)
+
+    def _destroy(self, query, data, vm_id):
+        return self._power(vm_id, "destroy", ("PowerOFF", "Deallocated"), None,
+                           self.destroy_delay_sec, kind="destroy")
+
+    def _vm_list(self, query, data, project_id):
+        if not self._check_project(project_id):
+            return SimulatorResponse(404, {"detail": "Not found."})
+        return self._paginate(query, [self._vm_summary(vm) for vm in self._vms.values()])
+
+    def _vm_info(self, query, data, vm_id):
+        vm = self._get_vm(vm_id)
+        if vm is None:
+            return SimulatorResponse(404, {"detail": "Not found."})
+        return SimulatorResponse(200, self._vm_detail(vm))
+
+    def _vm_history(self, query, data, vm_id):
+        entries = [dict(task) for task in reversed(self._history) if task["object_uuid"] == vm_id]
+        return self._paginate(query, entries)
+
+    def _project_history(self, query, data, project_id):
+        if not self._check_project(project_id):
+            return SimulatorResponse(404, {"detail": "Not found."})
+        return self._paginate(query, [dict(task) for task in reversed(self._history)])
+
+    # プロジェクト、カタログ、セグメント
+
+    def _assigned_projects(self, query, data):
+        return SimulatorResponse(200, [{
+            "uuid": self.org_id,
+            "name": "simulator",
+            "projects": [{"uuid": self.project_id, "name": self.project_name,
+                          "type": "normal", "expired": False}],
+        }])
+
+    def _catalogs(self, query, data, project_id):
+        if not self._check_project(project_id):
+            return SimulatorResponse(404, {"detail": "Not found."})
+        return SimulatorResponse(200, [dict(catalog) for catalog in self._catalog_entries])
+
+    def _segment_list(self, query, data, project_id):
+        if not self._check_project(project_id):
+            return SimulatorResponse(404, {"detail": "Not found."})
+        return SimulatorResponse(200, [{"uuid": s["uuid"], "name": s["name"], "default": s["default"]}
+                                       for s in self._segments.values()])
+
+    def _segment_summary(self, query, data, segment_id):
+        segment = self._segments.get(segment_id)
+        if segment is None:
+            return SimulatorResponse(404, {"detail": "Not found."})
+        return SimulatorResponse(200, {"vlan_id": segment["vlan_id"], "vni": segment["vni"],
+                                       "ip_range": str(segment["network"])})
+
+    # ACL
+
+    def _acl_list(self, family, segment_id):
+        if segment_id not in self._segments:
+            return SimulatorResponse(404, {"detail": "Not found."})
+        return SimulatorResponse(200, [dict(acl) for acl in self._acls[family].values()
+                                       if acl["segment"] == segment_id])
+
+    def _acl_add(self, family, data):
+        if data.get("segment") not in self._segments:
+            return SimulatorResponse(400, {"segment": ["invalid segment"]})
+        try:
+            for field in ("src_address", "dst_address"):
+                address = ipaddress.ip_address(data[field])
+                if address.version != (4 if family == "ipv4" else 6):
+                    raise ValueError(field)
+        except (KeyError, ValueError):
+            return SimulatorResponse(400, {"detail": "invalid address"})
+        acl = dict(data, uuid=str(uuid.uuid4()))
+        self._acls[family][acl["uuid"]] = acl
+        return SimulatorResponse(201, dict(acl))
+
+    def _acl_edit(self, family, acl_id, data):
+        acl = self._acls[family].get(acl_id)
+        if acl is None:
+            return SimulatorResponse(404, {"detail": "Not found."})
+        acl.update(data)
+        acl["uuid"] = acl_id
+        return SimulatorResponse(200, dict(acl))
+
+    def _acl_delete(self, family, acl_id):
+        if self._acls[family].pop(acl_id, None) is None:
+            return SimulatorResponse(404, {"detail": "Not found."})
+        return SimulatorResponse(204)
+
+    def _acl_ipv4_list(self, query, data, segment_id):
+        return self._acl_list("ipv4", segment_id)
+
+    def _acl_ipv4_add(self, query, data):
+        return self._acl_add("ipv4", data)
+
+    def _acl_ipv4_edit(self, query, data, acl_id):
+        return self._acl_edit("ipv4", acl_id, data)
+
+    def _acl_ipv4_delete(self, query, data, acl_id):
+        return self._acl_delete("ipv4", acl_id)
+
+    def _acl_ipv6_list(self, query, data, segment_id):
+        return self._acl_list("ipv6", segment_id)
+
+    def _acl_ipv6_add(self, query, data):
+        return self._acl_add("ipv6", data)
+
+    def _acl_ipv6_edit(self, query, data, acl_id):
+        return self._acl_edit("ipv6", acl_id, data)
+
+    def _acl_ipv6_delete(self, query, data, acl_id):
+        return self._acl_delete("ipv6", acl_id)
+
+    # DNAT、グローバルIP
+
+    def _assignable_global_ips(self):
+        used = set(dnat["pool_address"] for dnat in self._dnats.values())
+        return [address for address in self._global_ips if address not in used]
+
+    def _dnat_list(self, query, data, project_id):
+        if not self._check_project(project_id):
+            return SimulatorResponse(404, {"detail": "Not found."})
+        return self._paginate(query, [dict(dnat) for dnat in self._dnats.values()])
+
+    def _dnat_add(self, query, data):
+        if data.get("segment") not in self._segments:
+            return SimulatorResponse(400, {"segment": ["invalid segment"]})
+        if data.get("pool_address") not in self._assignable_global_ips():
+            return SimulatorResponse(400, {"pool_address": ["address is not assignable"]})
+        dnat = {"uuid": str(uuid.uuid4()), "pool_address": data["pool_address"],
+                "segment": data["segment"], "dst_address": data.get("dst_address")}
+        self._dnats[dnat["uuid"]] = dnat
+        return SimulatorResponse(201, dict(dnat))
+
+    def _dnat_edit(self, query, data, dnat_id):
+        dnat = self._dnats.get(dnat_id)
+        if dnat is None:
+            return SimulatorResponse(404, {"detail": "Not found."})
+        pool_address = data.get("pool_address", dnat["pool_address"])
+        if pool_address != dnat["pool_address"] and pool_address not in self._assignable_global_ips():
+            return SimulatorResponse(400, {"pool_address": ["address is not assignable"]})
+        dnat.update((k, data[k]) for k in ("pool_address", "segment", "dst_address") if k in data)
+        return SimulatorResponse(200, dict(dnat))
+
+    def _dnat_delete(self, query, data, dnat_id):
+        if self._dnats.pop(dnat_id, None) is None:
+            return SimulatorResponse(404, {"detail": "Not found."})
+        return SimulatorResponse(204)
+
+    def _global_ip_assignable(self, query, data, project_id):
+        if not self._check_project(project_id):
+            return SimulatorResponse(404, {"detail": "Not found."})
+        return SimulatorResponse(200, self._assignable_global_ips())
+
+
+_ID = r"([^/]+)"
+# (メソッド, パス, MdxSimulator のメソッド名, 認証が必要か)
+_ROUTES = [(method, re.compile(path), handler, with_token) for method, path, handler, with_token in (
+    ("POST", r"/api/login/", "_login", False),
+    ("POST", r"/api/refresh/", "_refresh", False),
+    ("POST", r"/api/vm/deploy/", "_deploy", True),
+    ("POST", r"/api/vm/{}/clone/".format(_ID), "_clone", True),
+    ("POST", r"/api/vm/{}/power_on/".format(_ID), "_power_on", True),
+    ("POST", r"/api/vm/{}/power_off/".format(_ID), "_power_off", True),
+    ("POST", r"/api/vm/{}/shutdown/".format(_ID), "_shutdown", True),
+    ("POST", r"/api/vm/{}/reboot/".format(_ID), "_reboot", True),
+    ("POST", r"/api/vm/{}/destroy/".format(_ID), "_destroy", True),
+    ("GET", r"/api/vm/project/{}/".format(_ID), "_vm_list", True),
+    ("GET", r"/api/vm/{}/".format(_ID), "_vm_info", True),
+    ("GET", r"/api/history/vm/{}/".format(_ID), "_vm_history", True),
+    ("GET", r"/api/history/project/{}/".format(_ID), "_project_history", True),
+    ("GET", r"/api/project/assigned/", "_assigned_projects", True),
+    ("GET", r"/api/catalog/project/{}/".format(_ID), "_catalogs", True),
+    ("GET", r"/api/segment/project/{}/all/".format(_ID), "_segment_list", True),
+    ("GET", r"/api/segment/{}/summary".format(_ID), "_segment_summary", True),
+    ("GET", r"/api/acl/segment/{}/".format(_ID), "_acl_ipv4_list", True),
+    ("POST", r"/api/acl/", "_acl_ipv4_add", True),
+    ("PUT", r"/api/acl/{}/".format(_ID), "_acl_ipv4_edit", True),
+    ("DELETE", r"/api/acl/{}/".format(_ID), "_acl_ipv4_delete", True),
+    ("GET", r"/api/acl_v6/segment/{}/".format(_ID), "_acl_ipv6_list", True),
+    ("POST", r"/api/acl_v6/", "_acl_ipv6_add", True),
+    ("PUT", r"/api/acl_v6/{}/".format(_ID), "_acl_ipv6_edit", True),
+    ("DELETE", r"/api/acl_v6/{}/".format(_ID), "_acl_ipv6_delete", True),
+    ("GET", r"/api/dnat/project/{}".format(_ID), "_dnat_list", True),
+    ("POST", r"/api/dnat/", "_dnat_add", True),
+    ("PUT", r"/api/dnat/{}/".format(_ID), "_dnat_edit", True),
+    ("DELETE", r"/api/dnat/{}/".format(_ID), "_dnat_delete", True),
+    ("GET", r"/api/global_ip/project/{}/assignable/".format(_ID), "_global_ip_assignable", True),
+)]
+
+_UUID_SEGMENT = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+
+
+def _normalize_path(path):
+    return "/".join("{id}" if _UUID_SEGMENT.match(segment) else segment
+                    for segment in path.split("/"))
+
+
+def _parse_body(body):
+    if body is None or body == b"" or body == "":
+        return {}
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    data = json.loads(body)
+    # PUT は json.dumps() した文字列を本体として送る
+    if isinstance(data, str):
+        data = json.loads(data)
+    return data if isinstance(data, dict) else {}
+
+
+def _split_url(url):
+    parsed = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(parsed.query))
+    return parsed.path, query
+
+
+class SimulatorAdapter(BaseAdapter):
+    """
+    requests の要求を MdxSimulator で処理するトランスポートアダプタ。HTTP通信を行わずにプロセス内で応答する。
+
+    .. code-block:: python
+
+      session.mount(DEFAULT_MDX_ENDPOINT, SimulatorAdapter(simulator))
+    """
+
+    def __init__(self, simulator):
+        super().__init__()
+        self.simulator = simulator
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        delay = self.simulator.delay()
+        if delay > 0:
+            time.sleep(delay)
+        path, query = _split_url(request.url)
+        result = self.simulator.handle(request.method, path, query, request.body,
+                                       dict(request.headers))
+        if result.status_code == DISCONNECT:
+            raise requests.exceptions.ConnectionError("simulated disconnect", request=request)
+        response = requests.Response()
+        response.status_code = result.status_code
+        response.headers.update(result.headers)
+        response.headers["Content-Type"] = "application/json"
+        response.raw = io.BytesIO(result.content())
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.reason = http.server.BaseHTTPRequestHandler.responses.get(
+            result.status_code, ("",))[0]
+        return response
+
+    def close(self):
+        pass
+
+
+class SimulatorServer(object):
+    """
+    MdxSimulator をHTTPサーバとして公開する。 AsyncMdxResourceExt や他のプロセスから使用する場合に使う。
+
+    :param simulator: MdxSimulator
+    :param port: 待ち受けるポート番号。0の場合は空いているポートを使用する
+    :param addr: 待ち受けるアドレス
+
+    .. code-block:: python
+
+      with SimulatorServer(MdxSimulator(vm_count=10)) as server:
+          mdx = MdxResourceExt(server.simulator.issue_token(), endpoint=server.endpoint)
+    """
+
+    def __init__(self, simulator, port=0, addr="127.0.0.1"):
+        self.simulator = simulator
+        self._port = port
+        self._addr = addr
+        self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def endpoint(self):
+        """
+        サーバのURL
+        """
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        """
+        サーバのスレッドを開始する
+        """
+        simulator = self.simulator
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else None
+                delay = simulator.delay()
+                if delay > 0:
+                    time.sleep(delay)
+                path, query = _split_url(self.path)
+                result = simulator.handle(self.command, path, query, body, dict(self.headers))
+                if result.status_code == DISCONNECT:
+                    self.close_connection = True
+                    return
+                content = result.content()
+                self.send_response(result.status_code)
+                for name, value in result.headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self._server = http.server.ThreadingHTTPServer((self._addr, self._port), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+        return self._server
+
+    def stop(self):
+        """
+        サーバを停止する
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="mdx REST API simulator")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--addr", default="127.0.0.1")
+    parser.add_argument("--vm-count", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+    simulator = MdxSimulator(vm_count=args.vm_count, latency_sec=args.latency,
+                             error_rate=args.error_rate)
+    server = SimulatorServer(simulator, args.port, args.addr)
+    server.start()
+    print("endpoint: {}".format(server.endpoint))
+    print("project: {} ({})".format(simulator.project_name, simulator.project_id))
+    print("token: {}".format(simulator.issue_token()))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+#
+# mdx 操作とAPI呼び出しのトレース
+#
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import threading
+import time
+
+# 公開メソッドのスパンに属性として記録する引数
+TRACED_ARGUMENTS = ("vm_name", "vm_names", "original_vm_name", "host", "segment_id", "dnat_id",
+                    "allow_acl_id", "acl_ipv4_id", "acl_ipv6_id")
+
+
+def _clean_attributes(attributes):
+    # OpenTelemetry は None の属性を受け付けない
+    if not attributes:
+        return {}
+    cleaned = {}
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = [str(v) for v in value]
+        elif not isinstance(value, (str, bool, int, float)):
+            value = str(value)
+        cleaned[key] = value
+    return cleaned
+
+
+class _NoopSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def activate(self):
+        return self
+
+    def end(self, error=None):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class NoopTracer(object):
+    """
+    何も記録しないトレーサ。トレーサを指定しない場合に使用する
+    """
+
+    def span(self, name, attributes=None):
+        """
+        スパンを開始する。with文で使用し、with文を抜けるとスパンを終了する
+
+        :param name: スパン名
+        :param attributes: スパンの属性
+        """
+        return _NOOP_SPAN
+
+    def start_span(self, name, attributes=None):
+        """
+        現在のスパンの子スパンを開始し、with文を使わずに終了できるスパンを返す。
+        イテレータのように、処理が呼び出し側と交互に進む操作に使用する。
+
+        返すスパンは、 activate() (with文で使用) の間だけ現在のスパンとなり、 end(error) で終了する。
+
+        :param name: スパン名
+        :param attributes: スパンの属性
+        """
+        return _NOOP_SPAN
+
+    def set_attribute(self, key, value):
+        """
+        現在のスパンに属性を設定する
+        """
+        pass
+
+    def record(self, name, start, end, attributes=None, error=None):
+        """
+        開始・終了時刻を指定して、現在のスパンの子スパンを記録する。
+        並行して進む待ち合わせの、仮想マシン毎の所要時間の記録に使用する。
+
+        :param start: 開始時刻(UNIX時刻)
+        :param end: 終了時刻(UNIX時刻)
+        :param error: 失敗した場合の例外
+        """
+        pass
+
+
+NOOP_TRACER = NoopTracer()
+
+
+class OpenTelemetryTracer(object):
+    """
+    OpenTelemetry のトレーサでスパンを記録するトレーサ。opentelemetry-api が必要。
+
+    スパンは現在のコンテキストの子として作成されるため、呼び出し側のスパンの下に
+    mdx の操作、API呼び出し、待ち合わせのスパンが記録される。
+
+    :param tracer: opentelemetry.trace.Tracer。省略時は opentelemetry.trace.get_tracer("mdx")
+
+    .. code-block:: python
+
+      mdx = MdxResourceExt(token, tracer=OpenTelemetryTracer())
+    """
+
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = tracer if tracer is not None else trace.get_tracer("mdx")
+
+    def span(self, name, attributes=None):
+        return self._tracer.start_as_current_span(name, attributes=_clean_attributes(attributes))
+
+    def start_span(self, name, attributes=None):
+        return _OpenTelemetrySpan(self._trace, self._tracer.start_span(
+            name, attributes=_clean_attributes(attributes)))
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self._trace.get_current_span().set_attribute(
+                key, _clean_attributes({key: value})[key])
+
+    def record(self, name, start, end, attributes=None, error=None):
+        span = self._tracer.start_span(name, attributes=_clean_attributes(attributes),
+                                       start_time=int(start * 1e9))
+        _OpenTelemetrySpan(self._trace, span).end(error, end_time=int(end * 1e9))
+
+
+class _OpenTelemetrySpan(object):
+
+    def __init__(self, trace, span):
+        self._trace = trace
+        self._span = span
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self._span.set_attribute(key, _clean_attributes({key: value})[key])
+
+    def activate(self):
+        # 例外は end() で記録する
+        return self._trace.use_span(self._span, end_on_exit=False, record_exception=False,
+                                    set_status_on_exception=False)
+
+    def end(self, error=None, end_time=None):
+        if error is not None:
+            self._span.record_exception(error)
+            self._span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, str(error)))
+        self._span.end(end_time=end_time)
+
+
+class _RecordedSpan(object):
+
+    def __init__(self, tracer, span_id, name, attributes):
+        self._tracer = tracer
+        self.span_id = span_id
+        self.name = name
+        self.attributes = _clean_attributes(attributes)
+        self.parent_id = None
+        self.start_time = None
+        self.end_time = None
+        self.error = None
+        self._token = None
+
+    def __enter__(self):
+        self._begin()
+        self._token = _current_recorded_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current_recorded_span.reset(self._token)
+        self.end(exc_value)
+        return False
+
+    def _begin(self):
+        parent = _current_recorded_span.get()
+        self.parent_id = None if parent is None else parent.span_id
+        self.start_time = time.time()
+
+    @contextlib.contextmanager
+    def activate(self):
+        token = _current_recorded_span.set(self)
+        try:
+            yield self
+        finally:
+            _current_recorded_span.reset(token)
+
+    def end(self, error=None):
+        self.end_time = time.time()
+        if error is not None:
+            self.error = repr(error)
+        self._tracer._finish(self)
+
+    def set_attribute(self, key, value):
+        self.attributes.update(_clean_attributes({key: value}))
+
+    def to_dict(self):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "attributes": dict(self.attributes),
+            "start": self.start_time,
+            "end": self.end_time,
+            "duration_sec": self.end_time - self.start_time,
+            "error": self.error,
+        }
+
+
+_current_recorded_span = contextvars.ContextVar("mdx_recorded_span", default=None)
+
+
+class RecordingTracer(object):
+    """
+    終了したスパンをメモリに記録するトレーサ。OpenTelemetry を使わずに所要時間の内訳を確認する場合に使用する。
+
+    :param max_spans: 記録するスパン数の上限。超えた場合は古いものから破棄する
+
+    .. code-block:: python
+
+      tracer = RecordingTracer()
+      mdx = MdxResourceExt(token, tracer=tracer)
+      mdx.deploy_vm("vm-[1-3]", vm_spec)
+      for span in tracer.get_spans():
+          print(span["name"], span["duration_sec"], span["attributes"])
+    """
+
+    def __init__(self, max_spans=10000):
+        self.max_spans = max_spans
+        self._spans = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def span(self, name, attributes=None):
+        return _RecordedSpan(self, next(self._ids), name, attributes)
+
+    def start_span(self, name, attributes=None):
+        span = _RecordedSpan(self, next(self._ids), name, attributes)
+        span._begin()
+        return span
+
+    def set_attribute(self, key, value):
+        span = _current_recorded_span.get()
+        if span is not None:
+            span.set_attribute(key, value)
+
+    def record(self, name, start, end, attributes=None, error=None):
+        span = _RecordedSpan(self, next(self._ids), name, attributes)
+        parent = _current_recorded_span.get()
+        span.parent_id = None if parent is None else parent.span_id
+        span.start_time = start
+        span.end_time = end
+        if error is not None:
+            span.error = repr(error)
+        self._finish(span)
+
+    def _finish(self, span):
+        with self._lock:
+            self._spans.append(span)
+            if len(self._spans) > self.max_spans:
+                del self._spans[:len(self._spans) - self.max_spans]
+
+    def get_spans(self):
+        """
+        終了したスパンを、終了した順に返す
+
+        :returns: 以下のようなスパンのリスト
+
+        .. code-block:: json
+
+          [
+            {
+              "span_id": "スパンID",
+              "parent_id": "親スパンのID (ない場合は null)",
+              "name": "スパン名",
+              "attributes": {"属性名": "値"},
+              "start": "開始時刻(UNIX時刻)",
+              "end": "終了時刻(UNIX時刻)",
+              "duration_sec": "所要時間(秒)",
+              "error": "例外 (正常終了した場合は null)"
+            }
+          ]
+
+        """
+        with self._lock:
+            return [span.to_dict() for span in self._spans]
+
+    def clear(self):
+        with self._lock:
+            self._spans = []
+
+
+def _method_attributes(self, signature, args, kwargs):
+    attributes = {
+        "mdx.endpoint": self._mdxlib._endpoint,
+        "mdx.project_id": self._project_id,
+    }
+    try:
+        bound = signature.bind(self, *args, **kwargs)
+    except TypeError:
+        return attributes
+    for name in TRACED_ARGUMENTS:
+        if name in bound.arguments:
+            attributes["mdx." + name] = bound.arguments[name]
+    return attributes
+
+
+def traced(func):
+    """
+    MdxResourceExt (AsyncMdxResourceExt) の公開メソッドを、メソッド名のスパンで囲むデコレータ。
+    仮想マシン名などの引数、エンドポイント、プロジェクトIDをスパンの属性として記録する。
+    """
+    signature = inspect.signature(func)
+    name = "mdx." + func.__name__
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self, *args, **kwargs):
+            tracer = self._mdxlib.tracer
+            if tracer is NOOP_TRACER:
+                return await func(self, *args, **kwargs)
+            with tracer.span(name, _method_attributes(self, signature, args, kwargs)):
+                return await func(self, *args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        tracer = self._mdxlib.tracer
+        if tracer is NOOP_TRACER:
+            return func(self, *args, **kwargs)
+        with tracer.span(name, _method_attributes(self, signature, args, kwargs)):
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+class _TracedIterator(object):
+    """
+    イテレータの要素を取り出す間だけスパンを現在のスパンとし、イテレータの終了、例外、close() でスパンを終了する
+    """
+
+    def __init__(self, span, iterator):
+        self._span = span
+        self._iterator = iterator
+        self._items = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._span is None:
+            raise StopIteration
+        with self._span.activate():
+            try:
+                item = next(self._iterator)
+            except StopIteration:
+                self._end()
+                raise
+            except BaseException as e:
+                self._end(e)
+                raise
+        self._items += 1
+        return item
+
+    def close(self):
+        if self._span is None:
+            return
+        # ジェネレータの後始末 (未完了の要求の取り消しなど) もスパンに含める
+        with self._span.activate():
+            close = getattr(self._iterator, "close", None)
+            if close is not None:
+                close()
+        self._end()
+
+    def _end(self, error=None):
+        span, self._span = self._span, None
+        if span is not None:
+            span.set_attribute("mdx.items", self._items)
+            span.end(error)
+
+    def __del__(self):
+        # 使い終わる前に破棄されたイテレータのスパンも終了する
+        self._end()
+
+
+class _TracedAsyncIterator(_TracedIterator):
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._span is None:
+            raise StopAsyncIteration
+        with self._span.activate():
+            try:
+                item = await self._iterator.__anext__()
+            except StopAsyncIteration:
+                self._end()
+                raise
+            except BaseException as e:
+                self._end(e)
+                raise
+        self._items += 1
+        return item
+
+    async def aclose(self):
+        if self._span is None:
+            return
+        with self._span.activate():
+            aclose = getattr(self._iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        self._end()
+
+
+def traced_iter(func):
+    """
+    イテレータ (非同期イテレータ) を返す MdxResourceExt (AsyncMdxResourceExt) の公開メソッドを、
+    イテレータを使い終わるまで開いたままのスパンで囲むデコレータ。
+
+    スパンはメソッドの呼び出しで開始し、イテレータの終了、例外、close() (aclose()) で終了する。
+    イテレータを返すまでの処理と要素を取り出す間のAPI呼び出しは子スパンとなり、
+    呼び出し側が要素を処理している間はスパンを現在のスパンとしない。
+    取り出した要素数を mdx.items 属性に記録する。
+    """
+    signature = inspect.signature(func)
+    name = "mdx." + func.__name__
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        tracer = self._mdxlib.tracer
+        if tracer is NOOP_TRACER:
+            return func(self, *args, **kwargs)
+        span = tracer.start_span(name, _method_attributes(self, signature, args, kwargs))
+        try:
+            with span.activate():
+                iterator = func(self, *args, **kwargs)
+        except BaseException as e:
+            span.end(e)
+            raise
+        if hasattr(iterator, "__anext__"):
+            return _TracedAsyncIterator(span, iterator)
+        return _TracedIterator(span, iter(iterator))
+    return wrapper
+
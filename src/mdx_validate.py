@@ -0,0 +1,255 @@
+#
+# mdx 仮想マシン、ACL、DNAT の仕様の検証
+#
+import threading
+
+# project_id, vm_name, os_typeを外した
+# 通常プロジェクト
+MDX_VM_SPEC_SCHEMA = {
+    "additionalProperties": False,
+    "type": "object",
+    "properties": {
+        "catalog": {
+            "type": "string"
+        },
+        "template_name": {
+            "type": "string"
+        },
+        "pack_num": {
+            "type": "integer"
+        },
+        "pack_type": {
+            "type": "string",
+            "enum": [
+                "cpu",
+                "gpu"
+            ]
+        },
+        "gpu": {
+            "type": "string"
+        },
+        "disk_size": {
+            "type": "integer"  # GB
+        },
+        "network_adapters": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "properties": {
+                    "adapter_number": {
+                        "type": "integer"
+                    },
+                    "segment": {
+                        "type": "string"
+                    }
+                }
+            }
+        },
+        "shared_key": {
+            "type": "string"
+        },
+        "storage_network": {
+            "type": "string",
+            "enum": [
+                "sr-iov",
+                "pvrdma",
+                "portgroup",
+            ],
+        },
+        "service_level": {
+            "type": "string"
+        }
+    }
+}
+
+# クローンで変更できる項目
+# vm_name, project, os_type は clone_vm() で上書きするため、指定されていても受け付ける
+MDX_CLONE_SPEC_SCHEMA = {
+    "additionalProperties": False,
+    "type": "object",
+    "properties": dict(
+        {name: MDX_VM_SPEC_SCHEMA["properties"][name]
+         for name in ("pack_type", "pack_num", "gpu", "network_adapters", "storage_network",
+                      "service_level")},
+        vm_name={"type": "string"},
+        project={"type": "string"},
+        os_type={"type": "string"},
+    )
+}
+
+
+def _acl_spec_schema(address_format, add):
+    # マスクとポートは文字列表現で返されるため、数値と文字列のどちらも受け付ける。
+    # 取得した情報をそのまま編集に使えるよう、uuid などの他の項目は許容する
+    mask_or_port = {"type": ["string", "integer"]}
+    required = ["src_address", "src_mask", "src_port", "dst_address", "dst_mask", "dst_port",
+                "protocol"]
+    if add:
+        # 追加の場合のみセグメントの指定が必要
+        required.insert(0, "segment")
+    return {
+        "type": "object",
+        "required": required,
+        "properties": {
+            "segment": {"type": "string"},
+            "src_address": {"type": "string", "format": address_format},
+            "src_mask": mask_or_port,
+            "src_port": mask_or_port,
+            "dst_address": {"type": "string", "format": address_format},
+            "dst_mask": mask_or_port,
+            "dst_port": mask_or_port,
+            "protocol": {"type": "string"},
+        }
+    }
+
+
+MDX_ACL_IPV4_SPEC_SCHEMA = _acl_spec_schema("ipv4", add=True)
+MDX_ACL_IPV4_EDIT_SPEC_SCHEMA = _acl_spec_schema("ipv4", add=False)
+MDX_ACL_IPV6_SPEC_SCHEMA = _acl_spec_schema("ipv6", add=True)
+MDX_ACL_IPV6_EDIT_SPEC_SCHEMA = _acl_spec_schema("ipv6", add=False)
+
+MDX_DNAT_SPEC_SCHEMA = {
+    "type": "object",
+    "required": ["pool_address", "segment", "dst_address"],
+    "properties": {
+        "pool_address": {"type": "string", "format": "ipv4"},
+        "segment": {"type": "string"},
+        "dst_address": {"type": "string", "format": "ipv4"},
+    }
+}
+
+# 仕様の種類→スキーマ
+SPEC_SCHEMAS = {
+    "vm_deploy": MDX_VM_SPEC_SCHEMA,
+    "vm_clone": MDX_CLONE_SPEC_SCHEMA,
+    "acl_ipv4": MDX_ACL_IPV4_SPEC_SCHEMA,
+    "acl_ipv4_edit": MDX_ACL_IPV4_EDIT_SPEC_SCHEMA,
+    "acl_ipv6": MDX_ACL_IPV6_SPEC_SCHEMA,
+    "acl_ipv6_edit": MDX_ACL_IPV6_EDIT_SPEC_SCHEMA,
+    "dnat": MDX_DNAT_SPEC_SCHEMA,
+}
+
+
+def _error_path(error):
+    return "/".join(str(p) for p in error.absolute_path)
+
+
+class SpecValidatorRegistry(object):
+    """
+    仕様の種類毎にスキーマから作成したバリデータを保持し、検証の度にバリデータを作り直さないようにする。
+
+    バリデータは種類毎に最初の検証時に作成する。jsonschema もその時点で読み込む。
+
+    :param schemas: 仕様の種類→スキーマのdict。SPEC_SCHEMAS に追加・上書きする
+
+    .. code-block:: python
+
+      registry = SpecValidatorRegistry()
+      registry.validate("dnat", dnat_spec)
+    """
+
+    def __init__(self, schemas=None):
+        self._schemas = dict(SPEC_SCHEMAS)
+        if schemas is not None:
+            self._schemas.update(schemas)
+        self._validators = {}
+        self._lock = threading.Lock()
+
+    def kinds(self):
+        """
+        登録されている仕様の種類のリストを返す
+        """
+        return sorted(self._schemas)
+
+    def register(self, kind, schema):
+        """
+        仕様の種類とスキーマを登録する。登録済みの種類は置き換える。
+        """
+        with self._lock:
+            self._schemas[kind] = schema
+            self._validators.pop(kind, None)
+
+    def validator(self, kind):
+        """
+        仕様の種類のバリデータを返す
+
+        :raises KeyError: 登録されていない種類の場合
+        """
+        validator = self._validators.get(kind)
+        if validator is not None:
+            return validator
+        # jsonschema は読み込みに時間がかかるため、最初の検証時に読み込む
+        import jsonschema
+        with self._lock:
+            validator = self._validators.get(kind)
+            if validator is None:
+                schema = self._schemas[kind]
+                cls = jsonschema.validators.validator_for(schema)
+                cls.check_schema(schema)
+                validator = cls(schema, format_checker=jsonschema.FormatChecker())
+                self._validators[kind] = validator
+        return validator
+
+    def validate(self, kind, spec):
+        """
+        仕様を検証する
+
+        :param kind: 仕様の種類 ("vm_deploy", "vm_clone", "acl_ipv4", "acl_ipv4_edit", "acl_ipv6",
+          "acl_ipv6_edit", "dnat")
+        :param spec: 仕様
+        :raises jsonschema.ValidationError: 仕様が不正な場合
+        """
+        import jsonschema
+        error = jsonschema.exceptions.best_match(self.validator(kind).iter_errors(spec))
+        if error is not None:
+            raise error
+
+    def validate_many(self, kind, specs):
+        """
+        複数の仕様をまとめて検証し、不正な仕様のエラーを返す。API呼び出しの前に一括で検証する場合に使用する。
+
+        :param kind: 仕様の種類
+        :param specs: 仕様のリスト
+        :returns: 以下のような、不正な仕様のリスト。全て正しい場合は空のリスト
+
+        .. code-block:: json
+
+          [
+            {
+              "index": "specs中の位置",
+              "errors": [
+                {"path": "不正な項目のパス (例: network_adapters/0/segment)", "message": "エラーメッセージ"}
+              ]
+            }
+          ]
+
+        """
+        validator = self.validator(kind)
+        invalid = []
+        for index, spec in enumerate(specs):
+            errors = sorted(validator.iter_errors(spec), key=_error_path)
+            if errors:
+                invalid.append({
+                    "index": index,
+                    "errors": [{"path": _error_path(e), "message": e.message} for e in errors],
+                })
+        return invalid
+
+
+# 既定のバリデータの登録先
+SPEC_VALIDATORS = SpecValidatorRegistry()
+
+
+def validate_spec(kind, spec):
+    """
+    既定の SpecValidatorRegistry で仕様を検証する。 SpecValidatorRegistry.validate() を参照のこと。
+    """
+    SPEC_VALIDATORS.validate(kind, spec)
+
+
+def validate_specs(kind, specs):
+    """
+    既定の SpecValidatorRegistry で複数の仕様をまとめて検証する。 SpecValidatorRegistry.validate_many() を参照のこと。
+    """
+    return SPEC_VALIDATORS.validate_many(kind, specs)
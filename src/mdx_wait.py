@@ -0,0 +1,610 @@
+#
+# mdx 仮想マシン状態の待ち合わせ
+#
+import logging
+import random
+import threading
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .mdx_lib import MdxRestException, MdxTimeoutException, current_deadline, submit_in_context
+from .mdx_trace import NOOP_TRACER
+
+# 仮想マシンが削除済み(一覧に存在しない、またはvm_info APIが404を返す)であることを表す状態
+VM_NOT_FOUND = "NotFound"
+# 待ち合わせ対象がこの数以上の場合、仮想マシン一覧の取得で状態を確認する
+LIST_POLLING_THRESHOLD = 2
+# 仮想マシン一覧を取得する際のページサイズ
+LIST_PAGE_SIZE = 10000
+# 学習した所要時間のうち、最初の確認までに待つ割合
+LEARNED_FIRST_WAIT_RATIO = 0.8
+# 所要時間の移動平均の重み
+LEARNING_WEIGHT = 0.3
+
+logger = logging.getLogger(__name__)
+
+
+def state_reached(vm_info, status, idle=False):
+    """
+    仮想マシン情報が、待ち合わせている状態に達したことを表すかどうかを返す。
+
+    :param vm_info: 仮想マシン一覧の要素または詳細情報。存在しない仮想マシンは ``None``
+    :param status: 待つ状態
+    :param idle: ``True`` の場合、実行中のタスク (仮想マシン一覧の running_tasks) がないことも条件とする
+    """
+    actual = VM_NOT_FOUND if vm_info is None else vm_info["status"]
+    if actual != status:
+        return False
+    return not idle or vm_info is None or not vm_info.get("running_tasks")
+
+
+class PollingPolicy(object):
+    """
+    状態の確認(ポーリング)の間隔と期限。
+
+    確認の間隔は initial_interval_sec から multiplier 倍ずつ max_interval_sec まで伸ばし、
+    ±jitter の割合でランダムにずらす。timeout_sec を超えると待ち合わせを打ち切る。
+
+    learn が ``True`` の場合、操作種別(operation)毎の所要時間の移動平均を記録し、
+    次回以降は所要時間の LEARNED_FIRST_WAIT_RATIO 倍を待ってから短い間隔で確認を始める。
+    所要時間の短い操作は完了直後に、長い操作は少ない確認回数で完了を検知できる。
+
+    :param initial_interval_sec: 最初の確認間隔(秒)
+    :param multiplier: 確認間隔を伸ばす倍率
+    :param max_interval_sec: 確認間隔の上限(秒)
+    :param jitter: 確認間隔をずらす割合 (0〜1)
+    :param timeout_sec: 待ち合わせの期限(秒)
+    :param learn: 操作種別毎の所要時間を学習する場合 ``True`` を指定
+    """
+
+    def __init__(self, initial_interval_sec=1, multiplier=1.5, max_interval_sec=15,
+                 jitter=0.1, timeout_sec=600, learn=True):
+        self.initial_interval_sec = initial_interval_sec
+        self.multiplier = multiplier
+        self.max_interval_sec = max_interval_sec
+        self.jitter = jitter
+        self.timeout_sec = timeout_sec
+        self.learn = learn
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def start(self, operation=None, timeout_sec=None, metrics=None):
+        """
+        1回の待ち合わせの PollingSchedule を作成する
+
+        :param operation: 操作種別 ("reboot", "deploy" など)。所要時間の学習に使用する
+        :param timeout_sec: この待ち合わせの期限(秒)。省略時は policy の timeout_sec
+        :param metrics: sleep() の時間を記録する MdxMetrics (オプショナル)
+        """
+        if timeout_sec is None:
+            timeout_sec = self.timeout_sec
+        return PollingSchedule(self, operation, timeout_sec, metrics)
+
+    def typical_duration(self, operation):
+        """
+        学習した操作種別の所要時間(秒)を返す。未学習の場合は None を返す。
+        """
+        if not self.learn or operation is None:
+            return None
+        with self._lock:
+            return self._durations.get(operation)
+
+    def record(self, operation, duration_sec):
+        """
+        操作種別の所要時間を記録する
+        """
+        if not self.learn or operation is None:
+            return
+        with self._lock:
+            average = self._durations.get(operation)
+            if average is None:
+                self._durations[operation] = duration_sec
+            else:
+                self._durations[operation] = (
+                    (1 - LEARNING_WEIGHT) * average + LEARNING_WEIGHT * duration_sec)
+
+    def _jittered(self, interval):
+        if self.jitter <= 0:
+            return interval
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class PollingSchedule(object):
+    """
+    PollingPolicy.start() で作成する、1回の待ち合わせの確認間隔の列。
+    deadline_scope() で操作全体の期限が設定されている場合は、早い方の期限に従う。
+    """
+
+    def __init__(self, policy, operation, timeout_sec, metrics=None):
+        self._policy = policy
+        self._metrics = metrics
+        self.operation = operation
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + timeout_sec
+        self._budget = current_deadline()
+        if self._budget is not None:
+            self.deadline = min(self.deadline, self._budget.expires_at)
+        self._interval = None
+        self._first_wait = None
+        typical = policy.typical_duration(operation)
+        self.learned = typical is not None
+        if self.learned:
+            self._first_wait = typical * LEARNED_FIRST_WAIT_RATIO
+
+    def expired(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return now >= self.deadline
+
+    def remaining(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, self.deadline - now)
+
+    def next_interval(self):
+        """
+        次の確認までに待つ秒数を返す。期限を超えない範囲に切り詰める。
+        """
+        policy = self._policy
+        if self._first_wait is not None:
+            interval, self._first_wait = self._first_wait, None
+        else:
+            if self._interval is None:
+                self._interval = policy.initial_interval_sec
+            else:
+                self._interval = min(self._interval * policy.multiplier,
+                                     policy.max_interval_sec)
+            interval = policy._jittered(self._interval)
+        return min(interval, self.remaining())
+
+    def budget_exhausted(self):
+        """
+        操作全体の期限を過ぎており、状態の確認のためのAPI呼び出しもできない場合に ``True`` を返す
+        """
+        return self._budget is not None and self._budget.expired()
+
+    def sleep(self):
+        """
+        次の確認まで待つ。期限を過ぎている場合は ``False`` を返す。
+        """
+        if self.expired():
+            return False
+        interval = self.next_interval()
+        if self._metrics is not None:
+            self._metrics.observe_wait(self.operation, interval)
+        time.sleep(interval)
+        return not self.budget_exhausted()
+
+    def finish(self, observed=True):
+        """
+        待ち合わせの完了を記録する
+
+        :param observed: 状態に達する前の状態を確認できた場合 ``True``。学習前の最初の確認で既に
+          状態に達していた場合は、操作の所要時間が分からないため ``False`` を指定して学習から除く
+        """
+        if not observed and not self.learned:
+            logger.debug("{}: state is reached at the first check, skip learning".format(self.operation))
+            return
+        self._policy.record(self.operation, time.monotonic() - self.started_at)
+
+
+class VmStateWatch(object):
+    """
+    VmStateWaiter.watch() で登録した待ち合わせ
+
+    :ivar vm_id: 仮想マシンID
+    :ivar status: 待つ状態
+    :ivar schedule: 確認間隔と期限 (PollingSchedule)
+    :ivar detail: ``True`` の場合、完了時に vm_info API で仮想マシンの詳細情報を取得する
+    :ivar idle: ``True`` の場合、状態に達したうえで実行中のタスクがなくなるまで待つ
+    :ivar condition: 状態に達した後、仮想マシンの詳細情報が満たすべき条件
+    :ivar reached: 状態に達し、condition を待っている場合 ``True``
+    :ivar future: 完了時に仮想マシン情報が設定される concurrent.futures.Future
+    :ivar last_error: 直前の確認で発生した一時的なエラー (発生していない場合は None)
+    """
+
+    def __init__(self, vm_id, status, schedule, detail=False, callback=None,
+                 condition=None, condition_schedule=None, tracer=NOOP_TRACER, idle=False):
+        self.vm_id = vm_id
+        self.status = status
+        self.schedule = schedule
+        self.detail = detail or condition is not None
+        self.condition = condition
+        self.idle = idle
+        self.reached = False
+        # 状態に達する前の状態を確認したかどうか (所要時間の学習に使用する)
+        self.observed = False
+        self.future = Future()
+        self.last_error = None
+        self.next_poll_at = schedule.started_at + schedule.next_interval()
+        self._callback = callback
+        self._condition_schedule = condition_schedule
+        self._tracer = tracer
+        self._phase_started = time.time()
+
+    def _record_phase(self, error=None):
+        # 待ち合わせは並行して進むため、段階毎の所要時間を終了時にスパンとして記録する
+        now = time.time()
+        self._tracer.record("mdx.wait " + (self.schedule.operation or "wait"),
+                            self._phase_started, now,
+                            {"mdx.vm_id": self.vm_id, "mdx.wait.status": self.status,
+                             "mdx.wait.reached": self.reached}, error)
+        self._phase_started = now
+
+    def _reach(self, now):
+        # 状態に達したので、以降は condition の確認間隔と期限に従う
+        self.schedule.finish(self.observed)
+        self._record_phase()
+        self.reached = True
+        if self._condition_schedule is not None:
+            self.schedule = self._condition_schedule()
+        self.next_poll_at = now + self.schedule.next_interval()
+
+    def _set_result(self, vm_info):
+        if not self.reached:
+            self.schedule.finish(self.observed)
+        self._record_phase()
+        self.future.set_result(vm_info)
+        self._notify()
+
+    def _set_exception(self, e):
+        self._record_phase(e)
+        self.future.set_exception(e)
+        self._notify()
+
+    def _notify(self):
+        if self._callback is None:
+            return
+        try:
+            self._callback(self)
+        except Exception:
+            logger.exception("wait callback is failed: {}".format(self.vm_id))
+
+
+class BaseVmStateWaiter(object):
+    """
+    VmStateWaiter と mdx_async.AsyncVmStateWaiter に共通する、待ち合わせの登録、確認時期と確認方法の決定、
+    確認結果による完了の判定を行う。API呼び出しと待機はサブクラスで行う。
+
+    サブクラスは1回の確認を以下の順に行う。
+
+    1. _next_delay() の秒数だけ待つ
+    2. _expire_all() が待ち合わせを返した場合 (操作全体の期限切れ) は終了する
+    3. _plan() が返した仮想マシンの情報を取得する。仮想マシン一覧の取得に失敗した場合は _fail_all() で終了する
+    4. _apply() で確認結果を反映し、詳細情報が必要な待ち合わせは詳細情報を取得して _apply_detail() を呼び出す
+
+    :param mdxlib: MdxLib または mdx_async.AsyncMdxLib
+    :param project_id: プロジェクトID
+    :param policy: 確認間隔と期限 (PollingPolicy)。省略時は既定値の PollingPolicy
+    """
+
+    def __init__(self, mdxlib, project_id, policy=None):
+        self._mdxlib = mdxlib
+        self._project_id = project_id
+        self.policy = PollingPolicy() if policy is None else policy
+        self._pending = []
+        self._metrics = mdxlib.metrics
+        self._retry_policy = mdxlib._retry_policy
+
+    def watch(self, vm_id, status, timeout_sec=None, detail=False, callback=None,
+              operation=None, condition=None, condition_operation=None,
+              condition_timeout_sec=None, idle=False):
+        """
+        待ち合わせを登録する。
+
+        :param vm_id: 仮想マシンID
+        :param status: 待つ状態。削除の完了を待つ場合は VM_NOT_FOUND を指定する
+        :param timeout_sec: この仮想マシンの待ち合わせの期限(秒)。省略時は policy の timeout_sec
+        :param detail: ``True`` の場合、完了時に vm_info API で取得した詳細情報を結果とする。
+          ``False`` の場合、仮想マシン一覧の要素(一覧で確認しなかった場合は詳細情報)を結果とする
+        :param callback: 完了時に VmStateWatch を引数として呼び出す関数
+        :param operation: 操作種別 ("reboot", "deploy" など)。PollingPolicy の学習に使用する
+        :param condition: 状態に達した後、さらに待つ条件。仮想マシンの詳細情報を引数とし、
+          満たした場合に ``True`` を返す関数。指定した場合、結果は詳細情報となる
+        :param condition_operation: condition を待つ際の操作種別
+        :param condition_timeout_sec: 状態に達してから condition を満たすまでの期限(秒)
+        :param idle: ``True`` の場合、状態に達したうえで実行中のタスクがなくなるまで待つ。
+          再起動のように操作の前後で状態が変わらない操作の完了を待つ場合に指定する。
+          実行中のタスクは仮想マシン一覧で確認する
+        :returns: 完了時に仮想マシン情報が設定される concurrent.futures.Future
+        """
+        schedule = self.policy.start(operation, timeout_sec)
+        condition_schedule = None
+        if condition is not None:
+            def condition_schedule():
+                return self.policy.start(condition_operation, condition_timeout_sec)
+        watch = VmStateWatch(vm_id, status, schedule, detail, callback,
+                             condition, condition_schedule, self._mdxlib.tracer, idle)
+        self._pending.append(watch)
+        return watch.future
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def _next_delay(self):
+        """
+        次に確認するまでに待つ秒数を返す
+        """
+        first = min(self._pending, key=lambda watch: watch.next_poll_at)
+        delay = first.next_poll_at - time.monotonic()
+        if delay <= 0:
+            return 0
+        # 次に確認する待ち合わせの操作種別でスリープ時間を記録する
+        self._metrics.observe_wait(first.schedule.operation, delay)
+        return delay
+
+    def _expire_all(self):
+        """
+        操作全体の期限を過ぎている場合、状態を確認せずに全ての待ち合わせを期限切れとして返す。
+        それ以外は ``None`` を返す。
+        """
+        budget = current_deadline()
+        if budget is None or not budget.expired():
+            return None
+        pending, self._pending = self._pending, []
+        for watch in pending:
+            watch._set_exception(self._timeout_exception(watch))
+        return pending
+
+    def _fail_all(self, e):
+        """
+        仮想マシン一覧が取得できない場合に、全ての待ち合わせを失敗として返す
+        """
+        pending, self._pending = self._pending, []
+        for watch in pending:
+            watch._set_exception(e)
+        return pending
+
+    def _plan(self, now):
+        """
+        確認時期に達した待ち合わせから、今回確認する仮想マシンを決める。
+
+        状態を待っている仮想マシンが複数あれば、いずれかが確認時期に達した時点で仮想マシン一覧を取得し、
+        状態を待っている全ての仮想マシンを確認する。実行中のタスクを待つ (idle) 仮想マシンがあれば、
+        1つでも仮想マシン一覧で確認する。condition を待っている仮想マシンは vm_info API で確認する。
+
+        :returns: (vm_info API で確認する仮想マシンIDの集合, 仮想マシン一覧で確認する仮想マシンIDの集合) のタプル。
+          仮想マシン一覧を取得しない場合、後者は空の集合
+        """
+        due = [watch for watch in self._pending if watch.next_poll_at <= now]
+        detail_ids = set(watch.vm_id for watch in due if watch.reached)
+        due_ids = set(watch.vm_id for watch in due if not watch.reached)
+        vm_ids = set(watch.vm_id for watch in self._pending if not watch.reached)
+        idle = any(watch.idle for watch in due if not watch.reached)
+        if not due_ids or (len(vm_ids) < LIST_POLLING_THRESHOLD and not idle):
+            return detail_ids | due_ids, set()
+        return detail_ids, vm_ids
+
+    def _apply(self, polled_ids, statuses, errors, now):
+        """
+        確認結果を待ち合わせに反映する。
+
+        :param polled_ids: 確認した仮想マシンIDの集合
+        :param statuses: 仮想マシンIDをキーとした仮想マシン情報のdict。存在しない仮想マシンは含まない
+        :param errors: vm_info API で確認できなかった仮想マシンIDをキーとした例外のdict
+        :returns: (完了した待ち合わせのリスト, 完了の判定に詳細情報が必要な待ち合わせのリスト) のタプル。
+          後者は詳細情報を取得して _apply_detail() に渡す
+        """
+        completed = []
+        detail = []
+        pending = []
+        for watch in self._pending:
+            if watch.vm_id in errors:
+                if not self._retry_later(watch, errors[watch.vm_id]):
+                    completed.append(watch)
+                    continue
+            elif watch.vm_id in polled_ids:
+                watch.last_error = None
+                vm_info = statuses.get(watch.vm_id)
+                status = VM_NOT_FOUND if vm_info is None else vm_info["status"]
+                logger.debug("{}: waiting expected: {} actual: {}".format(
+                    watch.vm_id, watch.status, status))
+                if watch.reached or state_reached(vm_info, watch.status, watch.idle):
+                    # 一覧の要素には vm_id がないので、詳細情報が必要な場合のみ vm_info API で取得する
+                    if watch.detail and vm_info is not None and "vm_id" not in vm_info:
+                        detail.append(watch)
+                        continue
+                    if self._check(watch, vm_info, now):
+                        completed.append(watch)
+                        continue
+                else:
+                    watch.observed = True
+            if self._reschedule(watch, watch.vm_id in polled_ids, now):
+                pending.append(watch)
+            else:
+                completed.append(watch)
+        self._pending = pending
+        return completed, detail
+
+    def _apply_detail(self, watch, vm_info, error, now):
+        """
+        _apply() が返した待ち合わせに、取得した詳細情報を反映し、完了した場合 ``True`` を返す
+        """
+        if error is not None:
+            if not self._retry_later(watch, error):
+                return True
+        elif self._check(watch, vm_info, now):
+            return True
+        if not self._reschedule(watch, True, now):
+            return True
+        self._pending.append(watch)
+        return False
+
+    def _reschedule(self, watch, polled, now):
+        # 期限切れの場合は待ち合わせを失敗として ``False`` を返す
+        if watch.schedule.expired(now):
+            watch._set_exception(self._timeout_exception(watch))
+            return False
+        if polled or watch.next_poll_at <= now:
+            watch.next_poll_at = now + watch.schedule.next_interval()
+        return True
+
+    def _check(self, watch, vm_info, now):
+        """
+        状態に達した(または condition を待っている)待ち合わせを確認し、完了した場合 ``True`` を返す
+        """
+        if watch.condition is not None:
+            if vm_info is None or not watch.condition(vm_info):
+                if not watch.reached:
+                    watch._reach(now)
+                return False
+        watch._set_result(vm_info)
+        return True
+
+    def _retry_later(self, watch, e):
+        """
+        確認に失敗した待ち合わせを、一時的なエラーであれば次の確認時期に確認し直すこととして ``True`` を返す。
+        それ以外の場合は待ち合わせを失敗として ``False`` を返す。
+        """
+        if self._retry_policy.is_transient(e):
+            logger.debug("{}: waiting: {}, check again later".format(watch.vm_id, e))
+            watch.last_error = e
+            return True
+        watch._set_exception(e)
+        return False
+
+    @staticmethod
+    def _timeout_exception(watch):
+        if watch.reached:
+            message = "wait_until {} is failed: condition is not satisfied"
+        else:
+            message = "wait_until {} is failed"
+        e = MdxTimeoutException(message.format(watch.status), watch.schedule.operation or "wait")
+        e.__cause__ = watch.last_error
+        return e
+
+    @staticmethod
+    def _select_listed(vm_list, vm_ids, statuses):
+        # 仮想マシン一覧のページから、待ち合わせ対象の仮想マシンの要素を statuses に加える
+        for vm_info in vm_list["results"]:
+            if vm_info["uuid"] in vm_ids:
+                statuses[vm_info["uuid"]] = vm_info
+
+
+class VmStateWaiter(BaseVmStateWaiter):
+    """
+    複数の仮想マシンが指定した状態になるのをまとめて待つ。
+
+    待ち合わせ対象が複数ある場合は、1回の確認につき仮想マシン一覧を1回取得して全ての状態を確認する。
+    待ち合わせ対象が1つの場合、および状態に達した後に詳細情報の条件(IPアドレスの付与など)を待つ場合は
+    vm_info API で確認し、複数あれば最大 max_workers 並列で取得する。
+    仮想マシン毎に PollingPolicy に従った確認間隔と期限を持ち、状態に達した仮想マシンから順に
+    Future の完了、コールバックの呼び出しを行う。
+
+    vm_info API の失敗はその仮想マシンの待ち合わせだけに影響する。MdxLib の RetryPolicy が一時的なエラー
+    とみなす失敗であれば次の確認時期に確認し直し、それ以外は失敗とする。
+    仮想マシン一覧の取得に失敗した場合は、全ての待ち合わせを失敗とする。
+
+    :param mdxlib: MdxLib
+    :param project_id: プロジェクトID
+    :param policy: 確認間隔と期限 (PollingPolicy)。省略時は既定値の PollingPolicy
+    :param max_workers: vm_info API を並列に呼び出す最大数
+
+    .. code-block:: python
+
+      waiter = VmStateWaiter(mdxlib, project_id)
+      futures = [waiter.watch(vm_id, "PowerON") for vm_id in vm_ids]
+      for watch in waiter.iter_completed():
+          print(watch.vm_id, watch.future.exception())
+    """
+
+    def __init__(self, mdxlib, project_id, policy=None, max_workers=1):
+        super().__init__(mdxlib, project_id, policy)
+        self.max_workers = max_workers
+        self._executor = None
+
+    def run(self):
+        """
+        登録した全ての待ち合わせが完了するまで待つ
+        """
+        for _watch in self.iter_completed():
+            pass
+
+    def iter_completed(self):
+        """
+        登録した待ち合わせを、完了したものから順に VmStateWatch として返すジェネレータ
+        """
+        if self.max_workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for watch in self._iter_completed():
+                yield watch
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        logger.debug("wait_until finished")
+
+    def _iter_completed(self):
+        while self._pending:
+            delay = self._next_delay()
+            if delay > 0:
+                time.sleep(delay)
+            expired = self._expire_all()
+            if expired is not None:
+                yield from expired
+                return
+            info_ids, list_ids = self._plan(time.monotonic())
+            try:
+                statuses, errors = self._poll_statuses(info_ids, list_ids)
+            except Exception as e:
+                yield from self._fail_all(e)
+                return
+            completed, detail = self._apply(info_ids | list_ids, statuses, errors, time.monotonic())
+            yield from completed
+            if not detail:
+                continue
+            vm_infos, errors = self._poll_vm_info(set(watch.vm_id for watch in detail),
+                                                  self._mdxlib.get_vm_info)
+            now = time.monotonic()
+            for watch in detail:
+                if self._apply_detail(watch, vm_infos.get(watch.vm_id), errors.get(watch.vm_id), now):
+                    yield watch
+
+    def _poll_statuses(self, info_ids, list_ids):
+        """
+        仮想マシンの情報を取得し、仮想マシンIDをキーとした仮想マシン情報のdictと、
+        vm_info API で確認できなかった仮想マシンIDをキーとした例外のdictを返す。
+        仮想マシン情報のdictには存在しない仮想マシンは含まない。
+        """
+        statuses, errors = self._poll_vm_info(info_ids, self._get_vm_info)
+        if not list_ids:
+            return statuses, errors
+        page = 1
+        while True:
+            vm_list = self._mdxlib.get_vm_list(self._project_id, page=page,
+                                               page_size=LIST_PAGE_SIZE)
+            self._select_listed(vm_list, list_ids, statuses)
+            if vm_list["next"] is None:
+                return statuses, errors
+            page += 1
+
+    def _poll_vm_info(self, vm_ids, get_vm_info):
+        # 仮想マシン毎に失敗を記録し、他の仮想マシンの確認は続ける
+        statuses = {}
+        errors = {}
+        if self._executor is not None and len(vm_ids) > 1:
+            futures = {vm_id: submit_in_context(self._executor, get_vm_info, vm_id) for vm_id in vm_ids}
+        else:
+            futures = None
+        for vm_id in vm_ids:
+            try:
+                if futures is not None:
+                    vm_info = futures[vm_id].result()
+                else:
+                    vm_info = get_vm_info(vm_id)
+            except Exception as e:
+                errors[vm_id] = e
+                continue
+            if vm_info is not None:
+                statuses[vm_id] = vm_info
+        return statuses, errors
+
+    def _get_vm_info(self, vm_id):
+        try:
+            return self._mdxlib.get_vm_info(vm_id)
+        except MdxRestException as e:
+            if e.status_code != 404:
+                raise
+            return None
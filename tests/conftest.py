@@ -0,0 +1,61 @@
+#
+# テスト共通のフィクスチャ。MdxResourceExt を MdxSimulator に接続して使う
+#
+import time
+
+import pytest
+
+from mdx.mdx_ext import MdxResourceExt
+from mdx.mdx_lib import RetryPolicy
+from mdx.mdx_wait import PollingPolicy
+
+
+def fast_polling_policy(interval_sec=0.01, timeout_sec=5):
+    """
+    シミュレータの短い状態遷移に合わせた、一定の短い間隔で確認する PollingPolicy
+    """
+    return PollingPolicy(initial_interval_sec=interval_sec, multiplier=1,
+                         max_interval_sec=interval_sec, jitter=0, timeout_sec=timeout_sec,
+                         learn=False)
+
+
+class FakeClock(object):
+    """
+    MdxSimulator に渡す、テストから進める時計
+    """
+
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, sec):
+        self.now += sec
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def make_client():
+    """
+    シミュレータに接続し、シミュレータのプロジェクトを選択した MdxResourceExt を作成する関数。
+    既定では再試行しない。
+    """
+    clients = []
+
+    def make(simulator, **options):
+        options.setdefault("polling_policy", fast_polling_policy())
+        options.setdefault("retry_policy", RetryPolicy(max_attempts=1))
+        client = MdxResourceExt(simulator.issue_token(), **options)
+        clients.append(client)
+        simulator.attach(client)
+        client.set_current_project_by_name(simulator.project_name)
+        return client
+
+    yield make
+    for client in clients:
+        client.close()
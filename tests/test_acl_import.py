@@ -0,0 +1,79 @@
+#
+# ファイルからのAllow ACLの一括登録
+#
+import io
+import json
+
+from mdx.mdx_acl_import import AclRuleError
+from mdx.mdx_simulator import MdxSimulator
+
+CSV_RULES = """segment,src_address,src_mask,src_port,dst_address,dst_mask,dst_port,protocol
+,203.0.113.0/24,,Any,10.0.0.10,,22,TCP
+,203.0.113.0,255.255.255.0,,10.0.0.10,32,22,TCP
+,2001:db8::,32,Any,2001:db8:1::10,128,443,TCP
+,203.0.113.0,,Any,2001:db8:1::10,128,443,TCP
+,not-an-address,,Any,10.0.0.10,,22,TCP
+,198.51.100.1,,Any,10.0.0.10,,80,
+,198.51.100.1,,Any,10.0.0.10,,443,TCP
+"""
+
+
+def test_import_csv_skips_duplicate_and_invalid_rows(make_client, tmp_path):
+    sim = MdxSimulator()
+    mdx = make_client(sim)
+    segment_id = mdx.get_segments()[0]["uuid"]
+    # 登録済みのルールと同じ行は登録しない
+    mdx.add_allow_acl_ipv4_info({
+        "segment": segment_id, "src_address": "198.51.100.1", "src_mask": "32", "src_port": "Any",
+        "dst_address": "10.0.0.10", "dst_mask": "32", "dst_port": "443", "protocol": "TCP"})
+    source = tmp_path / "acl.csv"
+    source.write_text(CSV_RULES)
+    sim.reset_request_counts()
+
+    results = mdx.import_acl_rules(str(source), segment_id=segment_id,
+                                   report=str(tmp_path / "report.jsonl"))
+
+    assert [(r["row"], r["result"], r["kind"]) for r in results] == [
+        (2, "done", "acl_ipv4"),
+        (3, "duplicate", "acl_ipv4"),
+        (4, "done", "acl_ipv6"),
+        (5, "invalid", None),
+        (6, "invalid", None),
+        (7, "invalid", None),
+        (8, "duplicate", "acl_ipv4"),
+    ]
+    assert results[0]["spec"]["src_address"] == "203.0.113.0"
+    assert results[0]["spec"]["src_mask"] == "24"
+    assert results[0]["id"] is not None
+    assert all(isinstance(r["error"], AclRuleError) for r in results[3:6])
+    # 既存のルールはセグメントと種類毎に1回だけ取得する
+    counts = sim.get_request_counts()
+    assert counts["GET /api/acl/segment/{id}/"] == 1
+    assert counts["GET /api/acl_v6/segment/{id}/"] == 1
+    assert counts["POST /api/acl/"] == 1
+    assert counts["POST /api/acl_v6/"] == 1
+
+    report = [json.loads(line) for line in (tmp_path / "report.jsonl").read_text().splitlines()]
+    assert [row["result"] for row in report] == [r["result"] for r in results]
+    assert report[3]["error"] is not None
+
+
+def test_import_jsonl_dry_run(make_client):
+    sim = MdxSimulator()
+    mdx = make_client(sim)
+    segment_id = mdx.get_segments()[0]["uuid"]
+    rule = {"src_address": "203.0.113.1", "dst_address": "10.0.0.10", "dst_port": 22,
+            "protocol": "TCP"}
+    source = io.StringIO("\n".join([
+        "# comment",
+        json.dumps(rule),
+        "{broken",
+        json.dumps([rule]),
+        json.dumps(dict(rule, src_mask=32)),
+    ]))
+
+    results = mdx.import_acl_rules(source, segment_id=segment_id, format="jsonl", dry_run=True)
+
+    assert [(r["row"], r["result"]) for r in results] == [
+        (2, "planned"), (3, "invalid"), (4, "invalid"), (5, "duplicate")]
+    assert mdx.get_allow_acl_ipv4_info(segment_id) == []
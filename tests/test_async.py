@@ -0,0 +1,69 @@
+#
+# AsyncMdxResourceExt をHTTPサーバとして公開したシミュレータに接続して使う
+#
+import asyncio
+import threading
+
+from conftest import fast_polling_policy
+from mdx.mdx_async import AsyncMdxResourceExt
+from mdx.mdx_history import JsonlHistoryStore
+from mdx.mdx_simulator import MdxSimulator, SimulatorServer
+
+VM_LIST = "GET /api/vm/project/{id}/"
+VM_INFO = "GET /api/vm/{id}/"
+VM_SPEC = {"catalog": "catalog", "template_name": "template", "pack_type": "cpu", "pack_num": 1,
+           "disk_size": 40, "gpu": "0", "storage_network": "portgroup", "shared_key": "key"}
+
+
+def test_deploy_vms_share_one_list_poll():
+    # IPv4アドレスは起動と同時に付与し、仮想マシン毎の詳細の取得を条件の確認の1回だけにする
+    sim = MdxSimulator(deploy_delay_sec=0.1, ip_assign_delay_sec=0)
+
+    async def deploy():
+        async with AsyncMdxResourceExt(sim.issue_token(), endpoint=server.endpoint,
+                                       polling_policy=fast_polling_policy()) as mdx:
+            await mdx.set_current_project_by_name(sim.project_name)
+            segment_id = (await mdx.get_segments())[0]["uuid"]
+            vm_spec = dict(VM_SPEC, network_adapters=[{"adapter_number": 1, "segment": segment_id}])
+            sim.reset_request_counts()
+            return await mdx.deploy_vm("vm-[1-5]", vm_spec)
+
+    with SimulatorServer(sim) as server:
+        vm_infos = asyncio.run(deploy())
+
+    assert [vm_info["name"] for vm_info in vm_infos] == ["vm-{}".format(i) for i in range(1, 6)]
+    assert all(vm_info["service_networks"][0]["ipv4_address"] for vm_info in vm_infos)
+    # デプロイの完了は仮想マシン一覧でまとめて確認する
+    counts = sim.get_request_counts()
+    assert counts[VM_LIST] >= 2
+    # デプロイの完了を待つ間は仮想マシン毎の詳細を取得しない
+    assert counts[VM_INFO] == 5
+
+
+def test_history_store_is_used_off_the_event_loop(tmp_path):
+    sim = MdxSimulator(vm_count=1)
+    store = JsonlHistoryStore(str(tmp_path / "history.jsonl"))
+    threads = []
+    for name in ("watermark", "upsert"):
+        method = getattr(store, name)
+
+        def recording(*args, _method=method):
+            threads.append(threading.get_ident())
+            return _method(*args)
+
+        setattr(store, name, recording)
+
+    async def sync():
+        async with AsyncMdxResourceExt(sim.issue_token(), endpoint=server.endpoint) as mdx:
+            await mdx.set_current_project_by_name(sim.project_name)
+            vm_id = (await mdx.get_vm_list())[0]["uuid"]
+            await mdx._mdxlib.power_off_vm(vm_id)
+            return threading.get_ident(), await mdx.sync_project_history(store)
+
+    with SimulatorServer(sim) as server:
+        loop_thread, changed = asyncio.run(sync())
+    store.close()
+
+    assert changed == 1
+    assert len(threads) == 2
+    assert loop_thread not in threads
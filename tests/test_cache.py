@@ -0,0 +1,137 @@
+#
+# ResourceCache の有効期間、ディスクへの保存、DNATの変更による破棄、利用者毎のスコープ
+#
+import threading
+import types
+
+import pytest
+
+from mdx import mdx_cache
+from mdx.mdx_cache import DiskCacheBackend, MemoryCacheBackend, ResourceCache
+from mdx.mdx_ext import MdxResourceExt
+from mdx.mdx_simulator import MdxSimulator
+
+ASSIGNED_PROJECTS = "GET /api/project/assigned/"
+GLOBAL_IPV4 = "GET /api/global_ip/project/{id}/assignable/"
+
+
+@pytest.fixture
+def cache_clock(monkeypatch, clock):
+    # ResourceCache の有効期限の判定に使う時刻をテストから進める
+    monkeypatch.setattr(mdx_cache, "time", types.SimpleNamespace(time=clock))
+    return clock
+
+
+@pytest.fixture(params=["memory", "disk"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryCacheBackend()
+    return DiskCacheBackend(str(tmp_path / "cache"))
+
+
+def test_entry_expires_after_ttl(backend, cache_clock):
+    cache = ResourceCache(backend, ttl_sec={"segments": 600})
+    cache.put("segments", "scope", ["segment"])
+
+    cache_clock.advance(599)
+    assert cache.get("segments", "scope") == ["segment"]
+    cache_clock.advance(1)
+    assert cache.get("segments", "scope") is None
+    assert (cache.hit_count, cache.miss_count) == (1, 1)
+
+
+def test_zero_ttl_is_not_cached(backend):
+    cache = ResourceCache(backend, ttl_sec={"segments": 0})
+    cache.put("segments", "scope", ["segment"])
+    assert cache.get("segments", "scope") is None
+    assert backend.keys() == []
+
+
+def test_invalidate_without_scope_removes_all_scopes(backend):
+    cache = ResourceCache(backend)
+    for scope in ("a", "b"):
+        cache.put("segments", scope, [scope])
+        cache.put("vm_catalogs", scope, [scope])
+
+    cache.invalidate("segments")
+
+    assert cache.get("segments", "a") is None
+    assert cache.get("segments", "b") is None
+    assert cache.get("vm_catalogs", "a") == ["a"]
+
+
+def test_hit_and_miss_counts_from_threads():
+    cache = ResourceCache()
+    cache.put("segments", "scope", [])
+
+    def read():
+        for _ in range(1000):
+            cache.get("segments", "scope")
+            cache.get("segments", "other")
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert (cache.hit_count, cache.miss_count) == (8000, 8000)
+
+
+def test_disk_cache_is_shared_across_clients(make_client, tmp_path):
+    sim = MdxSimulator(vm_count=1)
+    directory = str(tmp_path / "cache")
+    make_client(sim, cache=ResourceCache(DiskCacheBackend(directory))).get_segments()
+    sim.reset_request_counts()
+
+    # 別のプロセスを想定し、キャッシュもクライアントも作り直す
+    mdx = make_client(sim, cache=ResourceCache(DiskCacheBackend(directory)))
+    segments = mdx.get_segments()
+
+    assert [segment["name"] for segment in segments] == ["default"]
+    assert sim.get_request_counts() == {}
+
+
+@pytest.mark.parametrize("operation", ["add", "edit", "delete"])
+def test_dnat_change_invalidates_assignable_global_ipv4(make_client, operation):
+    sim = MdxSimulator(vm_count=1)
+    mdx = make_client(sim, cache=ResourceCache())
+    segment_id = mdx.get_segments()[0]["uuid"]
+    addresses = mdx.get_assignable_global_ipv4()
+    spec = {"pool_address": addresses[0], "segment": segment_id, "dst_address": "10.0.0.1"}
+    if operation != "add":
+        dnat_id = mdx.add_dnat(spec)["uuid"]
+        mdx.get_assignable_global_ipv4()
+    sim.reset_request_counts()
+
+    if operation == "add":
+        mdx.add_dnat(spec)
+    elif operation == "edit":
+        mdx.edit_dnat(dnat_id, dict(spec, pool_address=addresses[1]))
+    else:
+        mdx.delete_dnat(dnat_id)
+    assignable = mdx.get_assignable_global_ipv4()
+    mdx.get_assignable_global_ipv4()
+
+    assert sim.get_request_counts()[GLOBAL_IPV4] == 1
+    expected = {"add": addresses[1:], "edit": [addresses[0]] + addresses[2:], "delete": addresses}
+    assert assignable == expected[operation]
+
+
+def test_assigned_projects_are_cached_per_user(tmp_path):
+    sim = MdxSimulator(vm_count=1)
+    directory = str(tmp_path / "cache")
+
+    def assigned_projects(token):
+        with MdxResourceExt(token, cache=ResourceCache(DiskCacheBackend(directory))) as mdx:
+            sim.attach(mdx)
+            return mdx.get_assigned_projects()
+
+    assigned_projects(sim.issue_token(user_id=1))
+    sim.reset_request_counts()
+
+    # 同じ利用者の別のトークン(リフレッシュ後など)はキャッシュを使い、他の利用者は使わない
+    assigned_projects(sim.issue_token(user_id=1))
+    assert sim.get_request_counts() == {}
+    assigned_projects(sim.issue_token(user_id=2))
+    assert sim.get_request_counts() == {ASSIGNED_PROJECTS: 1}
@@ -0,0 +1,61 @@
+#
+# 期限 (deadline_scope) による読み込み、要求、要求レートの制限、待ち合わせの打ち切り
+#
+import pytest
+
+from mdx.mdx_ext import MdxResourceExt
+from mdx.mdx_lib import MdxTimeoutException, RetryPolicy, TokenBucketRateLimiter, deadline_scope
+from mdx.mdx_simulator import MdxSimulator, SimulatorServer
+
+VM_LIST = "GET /api/vm/project/{id}/"
+
+
+def test_read_timeout_within_deadline():
+    sim = MdxSimulator(vm_count=1)
+    with SimulatorServer(sim) as server:
+        with MdxResourceExt(sim.issue_token(), endpoint=server.endpoint,
+                            retry_policy=RetryPolicy(max_attempts=1)) as mdx:
+            mdx.set_current_project_by_name(sim.project_name)
+            sim.latency_sec = 0.5
+            with deadline_scope(0.1):
+                with pytest.raises(MdxTimeoutException) as e:
+                    mdx.get_vm_list()
+    assert e.value.phase == "read"
+
+
+def test_expired_deadline_fails_before_request(make_client):
+    sim = MdxSimulator(vm_count=1)
+    mdx = make_client(sim)
+    sim.reset_request_counts()
+    with deadline_scope(0):
+        with pytest.raises(MdxTimeoutException) as e:
+            mdx.get_vm_list()
+    assert e.value.phase == "request"
+    assert sim.get_request_counts() == {}
+
+
+def test_wait_timeout_reports_operation(make_client):
+    sim = MdxSimulator(vm_count=1, power_delay_sec=10)
+    mdx = make_client(sim)
+
+    with pytest.raises(MdxTimeoutException) as e:
+        mdx.power_off_vm("vm-0001", timeout=0.1)
+    assert e.value.phase == "power_off"
+
+
+def test_rate_limit_wait_beyond_deadline_fails(make_client):
+    sim = MdxSimulator(vm_count=1)
+    limiter = TokenBucketRateLimiter(rate_per_sec=0.1, burst=1)
+    mdx = make_client(sim, rate_limiter=limiter)
+    sim.reset_request_counts()
+
+    # プロジェクトの選択でトークンを使い切ったため、次の要求は10秒近く待つ必要がある
+    with deadline_scope(1):
+        with pytest.raises(MdxTimeoutException) as e:
+            mdx.get_vm_list()
+
+    assert e.value.phase == "rate_limit"
+    assert sim.get_request_counts() == {}
+    assert "rate_limit" not in mdx.get_metrics()["waits"]
+    # 期限切れで取り消した予約は、次の要求の待ち時間に加算されない
+    assert limiter.reserve() < 10
@@ -0,0 +1,128 @@
+#
+# set_first_passwords の再接続と期限。SSHの対話 (_first_password_dialogue) を置き換えて確認する
+#
+import collections
+import threading
+import time
+
+import pytest
+
+from mdx import mdx_ext
+from mdx.mdx_ext import _SshNotReady
+from mdx.mdx_lib import MdxRestException, MdxTimeoutException, RetryPolicy, current_deadline
+from mdx.mdx_simulator import MdxSimulator
+
+
+class FakeDialogue(object):
+    """
+    ホスト毎に決めた応答を順に返す _first_password_dialogue の代わり。
+    応答が例外の場合は送出し、呼び出し可能なものは呼び出した結果を返す。最後の応答は繰り返す
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, host, password, ssh_key, username):
+        with self._lock:
+            responses = self.responses[host]
+            response = responses[min(self.calls[host], len(responses) - 1)]
+            self.calls[host] += 1
+        if isinstance(response, BaseException):
+            raise response
+        if callable(response):
+            return response(host)
+        return response
+
+
+def _not_ready(host="host"):
+    return _SshNotReady("{}: ssh is not ready: connection closed".format(host))
+
+
+def _wait_for_deadline(host):
+    # 実際の対話と同様に、応答がないまま期限を過ぎたら期限切れの例外を送出する
+    deadline = current_deadline()
+    time.sleep(deadline.remaining())
+    raise deadline.exception("ssh")
+
+
+@pytest.fixture
+def mdx(make_client):
+    return make_client(MdxSimulator(vm_count=1))
+
+
+@pytest.fixture
+def dialogue(monkeypatch):
+    def install(responses):
+        fake = FakeDialogue(responses)
+        monkeypatch.setattr(mdx_ext, "_first_password_dialogue", fake)
+        return fake
+    return install
+
+
+def _fast_retry(max_attempts):
+    return RetryPolicy(max_attempts=max_attempts, initial_backoff_sec=0.01, max_backoff_sec=0.01,
+                       jitter=0)
+
+
+def test_host_is_retried_until_ssh_is_ready(mdx, dialogue):
+    fake = dialogue({
+        "10.0.0.1": [_not_ready(), _not_ready(), "done"],
+        "10.0.0.2": ["already_set"],
+    })
+
+    results = mdx.set_first_passwords(["10.0.0.1", "10.0.0.2"], "password",
+                                      retry_policy=_fast_retry(5))
+
+    assert results == {
+        "10.0.0.1": {"result": "done", "attempts": 3, "error": None},
+        "10.0.0.2": {"result": "already_set", "attempts": 1, "error": None},
+    }
+    assert fake.calls == {"10.0.0.1": 3, "10.0.0.2": 1}
+
+
+def test_permanent_failure_is_not_retried(mdx, dialogue):
+    denied = MdxRestException("10.0.0.1: ssh authentication is failed")
+    dialogue({"10.0.0.1": [denied], "10.0.0.2": [_not_ready(), "done"]})
+
+    results = mdx.set_first_passwords(["10.0.0.1", "10.0.0.2"], "password",
+                                      retry_policy=_fast_retry(5))
+
+    assert results["10.0.0.1"] == {"result": "failed", "attempts": 1, "error": denied}
+    # 一部の仮想マシンで失敗しても、他の仮想マシンの設定は続ける
+    assert results["10.0.0.2"] == {"result": "done", "attempts": 2, "error": None}
+
+
+def test_retries_are_limited_by_policy(mdx, dialogue):
+    last_error = _not_ready("10.0.0.1")
+    dialogue({"10.0.0.1": [_not_ready(), _not_ready(), last_error]})
+
+    results = mdx.set_first_passwords(["10.0.0.1"], "password", retry_policy=_fast_retry(3))
+
+    assert results["10.0.0.1"] == {"result": "failed", "attempts": 3, "error": last_error}
+
+
+def test_hosts_outliving_deadline_fail_with_timeout(mdx, dialogue):
+    dialogue({
+        # 再接続を待つ間に期限を過ぎる
+        "10.0.0.1": [_not_ready()],
+        # 対話の途中で期限を過ぎる
+        "10.0.0.2": [_wait_for_deadline],
+        "10.0.0.3": ["done"],
+    })
+    retry_policy = RetryPolicy(max_attempts=100, initial_backoff_sec=0.05, max_backoff_sec=0.05,
+                               jitter=0)
+
+    started = time.monotonic()
+    results = mdx.set_first_passwords(["10.0.0.1", "10.0.0.2", "10.0.0.3"], "password",
+                                      retry_policy=retry_policy, timeout=0.3)
+
+    assert time.monotonic() - started < 2
+    assert results["10.0.0.3"] == {"result": "done", "attempts": 1, "error": None}
+    for host in ("10.0.0.1", "10.0.0.2"):
+        assert results[host]["result"] == "failed"
+        assert isinstance(results[host]["error"], MdxTimeoutException)
+        assert results[host]["error"].phase == "ssh"
+    assert results["10.0.0.1"]["attempts"] > 1
+    assert results["10.0.0.2"]["attempts"] == 1
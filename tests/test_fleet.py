@@ -0,0 +1,73 @@
+#
+# 複数の仮想マシンの電源操作と仮想マシン毎の結果
+#
+from mdx.mdx_lib import MdxRestException, MdxTimeoutException
+from mdx.mdx_simulator import MdxSimulator
+
+
+def _fleet(sim, count, status="PowerON"):
+    return {"vm-{:04d}".format(i + 1): sim.add_vm("vm-{:04d}".format(i + 1), status=status)
+            for i in range(count)}
+
+
+def test_power_off_vms_reports_each_vm(make_client):
+    sim = MdxSimulator(power_delay_sec=0.05)
+    vm_ids = _fleet(sim, 4)
+    sim.add_vm("stopped", status="PowerOFF")
+    mdx = make_client(sim)
+    sim.fail_next(count=1, status=500, method="POST",
+                  path="/api/vm/{}/power_off/".format(vm_ids["vm-0002"]))
+
+    result = mdx.power_off_vms(["vm-0001", "vm-0002", "vm-0003", "stopped", "missing"])
+
+    assert list(result) == ["vm-0001", "vm-0002", "vm-0003", "stopped", "missing"]
+    assert result["vm-0001"] == {"vm_id": vm_ids["vm-0001"], "result": "done", "error": None}
+    assert result["vm-0003"]["result"] == "done"
+    assert result["vm-0002"]["result"] == "failed"
+    assert isinstance(result["vm-0002"]["error"], MdxRestException)
+    assert result["vm-0002"]["error"].status_code == 500
+    assert result["stopped"]["result"] == "skipped"
+    assert result["missing"]["vm_id"] is None
+    assert result["missing"]["result"] == "failed"
+
+    statuses = {vm["name"]: vm["status"] for vm in mdx.get_vm_list()}
+    assert statuses["vm-0001"] == statuses["vm-0003"] == "PowerOFF"
+    assert statuses["vm-0002"] == statuses["vm-0004"] == "PowerON"
+
+
+def test_power_on_vms_without_waiting(make_client):
+    sim = MdxSimulator(power_delay_sec=10)
+    _fleet(sim, 3, status="PowerOFF")
+    mdx = make_client(sim)
+
+    result = mdx.power_on_vms(["vm-0001", "vm-0002", "vm-0003"], wait_for=False)
+
+    assert [r["result"] for r in result.values()] == ["requested"] * 3
+
+
+def test_reboot_vms_waits_for_tasks(make_client):
+    sim = MdxSimulator(power_delay_sec=0.1)
+    _fleet(sim, 3)
+    mdx = make_client(sim)
+
+    result = mdx.reboot_vms(["vm-0001", "vm-0002", "vm-0003"])
+
+    assert [r["result"] for r in result.values()] == ["done"] * 3
+    assert all(not vm["running_tasks"] for vm in mdx.get_vm_list())
+
+
+def test_power_vms_timeout_keeps_request_errors(make_client):
+    sim = MdxSimulator(power_delay_sec=10)
+    vm_ids = _fleet(sim, 3)
+    mdx = make_client(sim)
+    sim.fail_next(count=1, status=500, method="POST",
+                  path="/api/vm/{}/shutdown/".format(vm_ids["vm-0002"]))
+
+    result = mdx.shutdown_vms(["vm-0001", "vm-0002", "vm-0003"], timeout=0.2)
+
+    assert [r["result"] for r in result.values()] == ["failed"] * 3
+    assert result["vm-0002"]["error"].status_code == 500
+    for vm_name in ("vm-0001", "vm-0003"):
+        error = result[vm_name]["error"]
+        assert isinstance(error, MdxTimeoutException)
+        assert error.phase == "shutdown"
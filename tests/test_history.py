@@ -0,0 +1,84 @@
+#
+# プロジェクト操作履歴の差分同期
+#
+import pytest
+
+from mdx.mdx_history import JsonlHistoryStore, SqliteHistoryStore
+from mdx.mdx_simulator import MdxSimulator
+
+PROJECT_HISTORY = "GET /api/history/project/{id}/"
+
+
+@pytest.fixture(params=["sqlite", "jsonl"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        store = SqliteHistoryStore(str(tmp_path / "history.db"))
+    else:
+        store = JsonlHistoryStore(str(tmp_path / "history.jsonl"))
+    yield store
+    store.close()
+
+
+def _toggle_power(mdx, vm_id, clock, count):
+    # 操作毎に開始日時が変わるよう時計を進める。状態遷移は次の要求で完了する
+    for i in range(count):
+        if i % 2 == 0:
+            mdx._mdxlib.power_off_vm(vm_id)
+        else:
+            mdx._mdxlib.power_on_vm(vm_id)
+        clock.advance(2)
+
+
+def test_sync_fetches_only_new_pages(make_client, clock, store):
+    sim = MdxSimulator(power_delay_sec=1, clock=clock)
+    vm_id = sim.add_vm("vm-0001")
+    mdx = make_client(sim)
+    _toggle_power(mdx, vm_id, clock, 150)
+    sim.reset_request_counts()
+
+    assert mdx.sync_project_history(store) == 150
+    assert sim.get_request_counts()[PROJECT_HISTORY] == 2
+
+    _toggle_power(mdx, vm_id, clock, 1)
+    sim.reset_request_counts()
+
+    # watermark (最新の開始日時) と同時に開始した操作履歴は取得し直すが、変更がなければ数えない
+    assert mdx.sync_project_history(store) == 1
+    assert sim.get_request_counts()[PROJECT_HISTORY] == 1
+    entries = store.query(project_id=sim.project_id, vm_id=vm_id)
+    assert len(entries) == 151
+    assert entries[0]["type"] == entries[2]["type"] != entries[1]["type"]
+
+
+def test_sync_updates_unfinished_entries(make_client, clock, store):
+    sim = MdxSimulator(power_delay_sec=1, clock=clock)
+    vm_id = sim.add_vm("vm-0001")
+    mdx = make_client(sim)
+    _toggle_power(mdx, vm_id, clock, 2)
+    mdx._mdxlib.power_off_vm(vm_id)
+
+    assert mdx.sync_project_history(store) == 3
+    running = store.query(vm_id=vm_id)[0]
+    assert running["end_datetime"] is None
+    assert store.watermark(sim.project_id) == running["start_datetime"]
+
+    clock.advance(2)
+    assert mdx.sync_project_history(store) == 1
+    finished = store.query(vm_id=vm_id)[0]
+    assert finished["uuid"] == running["uuid"]
+    assert finished["status"] == "Completed"
+    assert finished["end_datetime"] is not None
+    assert len(store.query(project_id=sim.project_id)) == 3
+
+
+def test_sync_keeps_projects_apart(make_client, clock, store):
+    sim = MdxSimulator(power_delay_sec=1, clock=clock)
+    vm_id = sim.add_vm("vm-0001")
+    mdx = make_client(sim)
+    _toggle_power(mdx, vm_id, clock, 2)
+
+    mdx.sync_project_history(store)
+
+    assert len(store.query(project_id=sim.project_id)) == 2
+    assert store.query(project_id="other-project") == []
+    assert store.watermark("other-project") is None
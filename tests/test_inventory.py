@@ -0,0 +1,55 @@
+#
+# 仮想マシンのスナップショットと前回の詳細情報の再利用
+#
+from mdx.mdx_simulator import MdxSimulator
+
+VM_INFO = "GET /api/vm/{id}/"
+
+
+def test_snapshot_reuses_unchanged_vms(make_client):
+    sim = MdxSimulator(vm_count=5, power_delay_sec=0.05)
+    mdx = make_client(sim)
+    sim.reset_request_counts()
+
+    first = mdx.snapshot()
+
+    assert (len(first), first.fetched, first.reused) == (5, 5, 0)
+    assert sim.get_request_counts()[VM_INFO] == 5
+    vm = first.find_by_name("vm-0002")
+    address = vm["info"]["service_networks"][0]["ipv4_address"][0]
+    assert first.find_by_ip(address) is vm
+    assert first.statuses() == {"PowerON": 5}
+
+    mdx.power_off_vm("vm-0002")
+    sim.add_vm("vm-0006", status="PowerOFF")
+    sim.reset_request_counts()
+
+    second = mdx.snapshot(previous=first)
+
+    # 状態の変わった vm-0002 と新しい vm-0006 のみ取得し直す
+    assert (len(second), second.fetched, second.reused) == (6, 2, 4)
+    assert sim.get_request_counts()[VM_INFO] == 2
+    assert second.find_by_name("vm-0001")["info"] is first.find_by_name("vm-0001")["info"]
+    assert second.statuses() == {"PowerON": 4, "PowerOFF": 2}
+
+    sim.reset_request_counts()
+    third = mdx.snapshot(previous=second)
+    assert (third.fetched, third.reused) == (0, 6)
+    assert VM_INFO not in sim.get_request_counts()
+
+
+def test_snapshot_keeps_failed_vms(make_client):
+    sim = MdxSimulator(vm_count=3)
+    mdx = make_client(sim)
+    vm_id = mdx.get_vm_list()[1]["uuid"]
+    sim.fail_next(count=1, status=500, method="GET", path="/api/vm/{}/$".format(vm_id))
+
+    inventory = mdx.snapshot()
+
+    assert [vm["name"] for vm in inventory.failed()] == ["vm-0002"]
+    assert inventory.get(vm_id)["error"].status_code == 500
+
+    # 取得に失敗した仮想マシンは次回に取得し直す
+    again = mdx.snapshot(previous=inventory)
+    assert (again.fetched, again.reused) == (1, 2)
+    assert again.failed() == []
@@ -0,0 +1,109 @@
+#
+# ページ分割された一覧の取得中に件数が変わる場合
+#
+import asyncio
+
+from mdx.mdx_async import AsyncMdxResourceExt
+from mdx.mdx_ext import PAGE_MAX_WORKERS
+from mdx.mdx_simulator import MdxSimulator, SimulatorServer
+
+VM_LIST = "GET /api/vm/project/{id}/"
+
+
+def _after_first_page(mdx, action):
+    # 1ページ目を返した直後に action を実行する。2ページ目以降は1ページ目を受け取ってから要求される
+    get_vm_list = mdx._mdxlib.get_vm_list
+
+    def get_vm_list_hook(project_id, page=1, page_size=100):
+        res = get_vm_list(project_id, page=page, page_size=page_size)
+        if page == 1:
+            action()
+        return res
+
+    mdx._mdxlib.get_vm_list = get_vm_list_hook
+
+
+def test_all_pages_are_fetched(make_client):
+    sim = MdxSimulator(vm_count=250)
+    mdx = make_client(sim)
+    sim.reset_request_counts()
+
+    names = [vm["name"] for vm in mdx.vm_info_iter()]
+
+    assert names == ["vm-{:04d}".format(i + 1) for i in range(250)]
+    assert sim.get_request_counts()[VM_LIST] == 3
+
+
+def test_vanished_page_ends_iteration(make_client):
+    sim = MdxSimulator(vm_count=150)
+    mdx = make_client(sim)
+    # 1ページ目の取得後に仮想マシンが減り、2ページ目が範囲外(404)になった場合
+    _after_first_page(mdx, lambda: sim.fail_next(count=1, status=404, method="GET",
+                                                 path="vm/project"))
+    sim.reset_request_counts()
+
+    names = [vm["name"] for vm in mdx.vm_info_iter()]
+
+    assert names == ["vm-{:04d}".format(i + 1) for i in range(100)]
+    assert sim.get_request_counts()[VM_LIST] == 2
+
+
+def test_trailing_next_is_followed(make_client):
+    sim = MdxSimulator(vm_count=150)
+    mdx = make_client(sim)
+
+    def add_vms():
+        for i in range(150, 250):
+            sim.add_vm("vm-{:04d}".format(i + 1))
+
+    # 1ページ目の件数(150)から求めた最終ページ(2ページ目)に続きができる
+    _after_first_page(mdx, add_vms)
+    sim.reset_request_counts()
+
+    names = [vm["name"] for vm in mdx.vm_info_iter()]
+
+    assert names == ["vm-{:04d}".format(i + 1) for i in range(250)]
+    assert sim.get_request_counts()[VM_LIST] == 3
+
+
+def test_consistent_iteration_refetches_after_drift(make_client):
+    sim = MdxSimulator(vm_count=150)
+    mdx = make_client(sim)
+    added = []
+
+    def add_vm_once():
+        if not added:
+            added.append(sim.add_vm("vm-0151"))
+
+    _after_first_page(mdx, add_vm_once)
+
+    names = [vm["name"] for vm in mdx.vm_info_iter(consistent=True)]
+
+    assert names == ["vm-{:04d}".format(i + 1) for i in range(151)]
+
+
+def test_async_pages_are_read_ahead_within_window():
+    sim = MdxSimulator(vm_count=1000, latency_sec=0.01)
+
+    async def read_until(stop):
+        async with AsyncMdxResourceExt(sim.issue_token(), endpoint=server.endpoint) as mdx:
+            await mdx.set_current_project_by_name(sim.project_name)
+            sim.reset_request_counts()
+            names = []
+            vm_infos = mdx.vm_info_iter()
+            async for vm_info in vm_infos:
+                names.append(vm_info["name"])
+                if len(names) == stop:
+                    break
+            await vm_infos.aclose()
+            return names
+
+    with SimulatorServer(sim) as server:
+        names = asyncio.run(read_until(1000))
+        assert names == ["vm-{:04d}".format(i + 1) for i in range(1000)]
+        assert sim.get_request_counts()[VM_LIST] == 10
+
+        names = asyncio.run(read_until(150))
+    assert len(names) == 150
+    # 打ち切った時点で先読みしていたページ以外は取得しない
+    assert sim.get_request_counts()[VM_LIST] <= 2 + PAGE_MAX_WORKERS
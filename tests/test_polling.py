@@ -0,0 +1,89 @@
+#
+# PollingPolicy の確認間隔の伸長、ゆらぎ、所要時間の学習と、再起動の完了の待ち合わせ
+#
+import pytest
+
+from conftest import fast_polling_policy
+from mdx.mdx_lib import deadline_scope
+from mdx.mdx_simulator import MdxSimulator
+from mdx.mdx_wait import LEARNED_FIRST_WAIT_RATIO, PollingPolicy
+
+VM_LIST = "GET /api/vm/project/{id}/"
+VM_INFO = "GET /api/vm/{id}/"
+
+
+def test_interval_grows_up_to_max():
+    policy = PollingPolicy(initial_interval_sec=1, multiplier=2, max_interval_sec=5, jitter=0,
+                           learn=False)
+    schedule = policy.start("deploy")
+
+    assert [schedule.next_interval() for _ in range(5)] == [1, 2, 4, 5, 5]
+
+
+def test_jitter_stays_in_range():
+    policy = PollingPolicy(initial_interval_sec=10, multiplier=1, jitter=0.1, learn=False)
+    schedule = policy.start()
+
+    intervals = [schedule.next_interval() for _ in range(200)]
+
+    assert all(9 <= interval <= 11 for interval in intervals)
+    assert len(set(intervals)) > 1
+
+
+def test_interval_is_cut_to_deadline():
+    policy = PollingPolicy(initial_interval_sec=10, jitter=0, timeout_sec=600, learn=False)
+    with deadline_scope(0.5):
+        schedule = policy.start()
+    assert schedule.next_interval() <= 0.5
+
+
+def test_learned_duration_sets_first_wait():
+    policy = PollingPolicy(initial_interval_sec=1, jitter=0)
+    assert policy.start("deploy").learned is False
+
+    policy.record("deploy", 100)
+    policy.record("deploy", 200)
+    schedule = policy.start("deploy")
+
+    # 所要時間の移動平均 (100 * 0.7 + 200 * 0.3) の一定割合を待ってから確認を始める
+    assert schedule.learned is True
+    assert schedule.next_interval() == pytest.approx(130 * LEARNED_FIRST_WAIT_RATIO)
+    assert schedule.next_interval() == 1
+    assert policy.start("reboot").learned is False
+
+
+def test_first_check_is_not_learned():
+    policy = PollingPolicy()
+    policy.start("deploy").finish(observed=False)
+    assert policy.typical_duration("deploy") is None
+    policy.start("deploy").finish(observed=True)
+    assert policy.typical_duration("deploy") is not None
+
+
+def test_idle_watch_is_polled_with_vm_list(make_client):
+    # 再起動のタスクは仮想マシン一覧にのみ現れるため、1台でも一覧で確認する
+    sim = MdxSimulator(power_delay_sec=0.05)
+    vm_id = sim.add_vm("vm-0001")
+    mdx = make_client(sim)
+    mdx._mdxlib.reboot_vm(vm_id)
+    waiter = mdx.create_state_waiter()
+    future = waiter.watch(vm_id, "PowerON", idle=True)
+    sim.reset_request_counts()
+
+    waiter.run()
+
+    assert future.result()["running_tasks"] == []
+    counts = sim.get_request_counts()
+    assert counts.get(VM_INFO, 0) == 0
+    assert counts[VM_LIST] >= 1
+
+
+def test_reboot_vm_waits_for_the_task(make_client):
+    # 再起動中も PowerON のままのため、状態だけでは完了を判定できない
+    sim = MdxSimulator(vm_count=1, power_delay_sec=0.3)
+    mdx = make_client(sim, polling_policy=fast_polling_policy(interval_sec=0.05))
+
+    mdx.reboot_vm("vm-0001")
+
+    assert mdx.get_vm_list()[0]["running_tasks"] == []
+    assert mdx.get_metrics()["waits"]["reboot"]["sleep_sec"] >= 0.2
@@ -0,0 +1,143 @@
+#
+# probe_ssh_iter によるSSH接続の待ち合わせ。localhost で待ち受けるソケットに接続する
+#
+import socket
+import threading
+
+import pytest
+
+from mdx import mdx_probe
+from mdx.mdx_lib import Deadline, MdxTimeoutException
+from mdx.mdx_probe import probe_ssh_iter
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _Listener(object):
+    """
+    接続を受け付けて data を送り、接続を閉じるサーバ
+    """
+
+    def __init__(self, data, port=0):
+        self.data = data
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", port))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        # 終了を確認できるよう accept() を一定時間で打ち切る
+        self.sock.settimeout(0.05)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self.sock.accept()
+            except socket.timeout:
+                continue
+            with conn:
+                conn.sendall(self.data)
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+        self.sock.close()
+
+
+@pytest.fixture
+def listen():
+    listeners = []
+
+    def start(data, port=0):
+        listener = _Listener(data, port)
+        listeners.append(listener)
+        return listener
+
+    yield start
+    for listener in listeners:
+        listener.close()
+
+
+def test_banner_after_preamble_line(listen):
+    listener = listen(b"Welcome\r\nSSH-2.0-OpenSSH_9.6\r\n")
+
+    results = dict(probe_ssh_iter(["127.0.0.1"], port=listener.port, deadline=Deadline(5)))
+
+    result = results["127.0.0.1"]
+    assert (result["result"], result["attempts"]) == ("ready", 1)
+    assert result["banner"] == "SSH-2.0-OpenSSH_9.6"
+    assert result["error"] is None
+
+
+def test_connection_without_banner_is_retried(listen):
+    # 接続を受け付けるがバナーを送らずに閉じる (sshd の起動途中)
+    listener = listen(b"")
+
+    results = dict(probe_ssh_iter(["127.0.0.1"], port=listener.port, interval_sec=0.05,
+                                  deadline=Deadline(0.3)))
+
+    result = results["127.0.0.1"]
+    assert result["result"] == "failed"
+    assert result["attempts"] > 1
+    assert isinstance(result["error"].__cause__, ConnectionResetError)
+
+
+def test_refused_connection_is_retried_until_listening(listen):
+    port = _free_port()
+    timer = threading.Timer(0.2, listen, args=(b"SSH-2.0-Test\r\n", port))
+    timer.start()
+    try:
+        results = dict(probe_ssh_iter(["127.0.0.1"], port=port, interval_sec=0.05,
+                                      deadline=Deadline(5)))
+    finally:
+        timer.join()
+
+    result = results["127.0.0.1"]
+    assert result["result"] == "ready"
+    assert result["attempts"] > 1
+    assert result["banner"] == "SSH-2.0-Test"
+
+
+def test_deadline_expiry_fails_waiting_hosts():
+    port = _free_port()
+
+    results = dict(probe_ssh_iter(["127.0.0.1"], port=port, interval_sec=0.05,
+                                  deadline=Deadline(0.2)))
+
+    result = results["127.0.0.1"]
+    assert result["result"] == "failed"
+    assert result["attempts"] >= 2
+    assert isinstance(result["error"], MdxTimeoutException)
+    assert result["error"].phase == "ssh_ready"
+    assert isinstance(result["error"].__cause__, ConnectionRefusedError)
+
+
+def test_names_are_resolved_once_before_probing(monkeypatch):
+    calls = []
+    getaddrinfo = socket.getaddrinfo
+
+    def recording_getaddrinfo(host, *args, **kwargs):
+        calls.append(host)
+        if host == "unknown.invalid":
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return getaddrinfo(host, *args, **kwargs)
+
+    monkeypatch.setattr(mdx_probe.socket, "getaddrinfo", recording_getaddrinfo)
+
+    results = list(probe_ssh_iter(["unknown.invalid", "localhost"], port=_free_port(),
+                                  interval_sec=0.05, deadline=Deadline(0.3)))
+
+    # 名前解決できないホストは接続を試みずに最初に返す
+    assert [host for host, _ in results] == ["unknown.invalid", "localhost"]
+    unknown = results[0][1]
+    assert (unknown["result"], unknown["attempts"]) == ("failed", 0)
+    assert isinstance(unknown["error"], socket.gaierror)
+    assert results[1][1]["attempts"] >= 2
+    # 再試行しても名前解決は繰り返さない (IPアドレスとしての解釈を試みた後に名前解決する)
+    assert calls.count("localhost") == 2
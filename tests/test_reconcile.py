@@ -0,0 +1,119 @@
+#
+# ACL、DNAT の差分の計画と適用
+#
+from mdx.mdx_reconcile import acl_rule_key, plan_acl, plan_dnat
+from mdx.mdx_simulator import MdxSimulator
+
+
+def _acl(dst_port, dst_address="10.0.0.10", uuid=None, **fields):
+    rule = {"src_address": "0.0.0.0", "src_mask": "0", "src_port": "Any",
+            "dst_address": dst_address, "dst_mask": "32", "dst_port": dst_port, "protocol": "TCP"}
+    rule.update(fields)
+    if uuid is not None:
+        rule["uuid"] = uuid
+    return rule
+
+
+def _dnat(pool_address, dst_address, segment="seg", uuid=None):
+    dnat = {"pool_address": pool_address, "segment": segment, "dst_address": dst_address}
+    if uuid is not None:
+        dnat["uuid"] = uuid
+    return dnat
+
+
+def _summary(actions):
+    return [(a["action"], a["id"], a["spec"] and a["spec"].get("dst_port")) for a in actions]
+
+
+def test_plan_acl_reuses_extra_rules_for_edits():
+    current = [_acl("22", uuid="a"), _acl("80", uuid="b"), _acl("8080", uuid="c")]
+    desired = [_acl("22"), _acl("443"), _acl("8443")]
+
+    actions, unchanged = plan_acl("acl_ipv4", current, desired)
+
+    assert unchanged == 1
+    assert _summary(actions) == [("edit", "b", "443"), ("edit", "c", "8443")]
+
+
+def test_plan_acl_deletes_or_adds_the_rest():
+    current = [_acl("22", uuid="a"), _acl("80", uuid="b")]
+    assert _summary(plan_acl("acl_ipv4", current, [_acl("22")])[0]) == [("delete", "b", None)]
+    assert _summary(plan_acl("acl_ipv4", current, [_acl("22"), _acl("80"), _acl("443")])[0]) == \
+        [("add", None, "443")]
+    # prune=False の場合は既存のルールを編集・削除しない
+    assert _summary(plan_acl("acl_ipv4", current, [_acl("443")], prune=False)[0]) == \
+        [("add", None, "443")]
+
+
+def test_plan_acl_dedupes_rules():
+    # 表記の違い (アドレスの省略、プロトコルの大文字小文字、数値のマスク) は同じルールとみなす
+    current = [_acl("22", uuid="a"), _acl("22", uuid="b")]
+    desired = [_acl("22", src_mask=0), _acl("22", protocol="tcp")]
+
+    actions, unchanged = plan_acl("acl_ipv4", current, desired)
+
+    assert unchanged == 1
+    # 重複して登録されているルールは1つを残して削除する
+    assert _summary(actions) == [("delete", "a", None)]
+    assert acl_rule_key(_acl("443", dst_address="2001:db8:0:0::10")) == \
+        acl_rule_key(_acl("443", dst_address="2001:db8::10"))
+
+
+def test_plan_dnat_edits_by_pool_address_and_dedupes():
+    current = [_dnat("192.0.2.10", "10.0.0.10", uuid="a"),
+               _dnat("192.0.2.11", "10.0.0.11", uuid="b"),
+               _dnat("192.0.2.12", "10.0.0.12", uuid="c")]
+    desired = [_dnat("192.0.2.10", "10.0.0.10"), _dnat("192.0.2.11", "10.0.0.21"),
+               _dnat("192.0.2.11", "10.0.0.31"), _dnat("192.0.2.13", "10.0.0.13")]
+
+    actions, unchanged = plan_dnat(current, desired)
+
+    assert unchanged == 1
+    assert [(a["action"], a["id"], a["spec"] and a["spec"]["dst_address"]) for a in actions] == [
+        ("edit", "b", "10.0.0.21"), ("add", None, "10.0.0.13"), ("delete", "c", None)]
+
+
+def test_reconcile_acl_applies_minimal_changes(make_client):
+    sim = MdxSimulator()
+    mdx = make_client(sim)
+    segment_id = mdx.get_segments()[0]["uuid"]
+    for port in ("22", "80", "80"):
+        mdx.add_allow_acl_ipv4_info(dict(_acl(port), segment=segment_id))
+    sim.reset_request_counts()
+
+    desired = [_acl("22"), _acl("443"), _acl("443")]
+    result = mdx.reconcile_acl(segment_id, ipv4=desired)
+
+    assert result["unchanged"] == 1
+    assert sorted((a["action"], a["result"]) for a in result["actions"]) == \
+        [("delete", "done"), ("edit", "done")]
+    counts = sim.get_request_counts()
+    assert counts.get("POST /api/acl/", 0) == 0
+    assert counts["PUT /api/acl/{id}/"] == 1
+    assert counts["DELETE /api/acl/{id}/"] == 1
+    assert sorted(r["dst_port"] for r in mdx.get_allow_acl_ipv4_info(segment_id)) == ["22", "443"]
+
+    # 一致した後は取得のみ行う
+    sim.reset_request_counts()
+    result = mdx.reconcile_acl(segment_id, ipv4=desired)
+    assert result["actions"] == []
+    assert list(sim.get_request_counts()) == ["GET /api/acl/segment/{id}/"]
+
+
+def test_reconcile_dnat_dry_run_does_not_change(make_client):
+    sim = MdxSimulator()
+    mdx = make_client(sim)
+    segment_id = mdx.get_segments()[0]["uuid"]
+    mdx.add_dnat(_dnat("192.0.2.10", "10.0.0.10", segment=segment_id))
+    mdx.add_dnat(_dnat("192.0.2.11", "10.0.0.11", segment=segment_id))
+    desired = [_dnat("192.0.2.10", "10.0.0.20", segment=segment_id)]
+
+    result = mdx.reconcile_dnat(desired, dry_run=True)
+
+    assert sorted((a["action"], a["result"]) for a in result["actions"]) == \
+        [("delete", "planned"), ("edit", "planned")]
+    assert len(mdx.get_dnat()) == 2
+
+    mdx.reconcile_dnat(desired)
+    assert [(d["pool_address"], d["dst_address"]) for d in mdx.get_dnat()] == \
+        [("192.0.2.10", "10.0.0.20")]
@@ -0,0 +1,97 @@
+#
+# MdxSimulator の状態遷移、エラーの注入、ページ分割
+#
+import json
+
+from mdx.mdx_simulator import DISCONNECT, MdxSimulator
+
+
+def _get(sim, token, path, **query):
+    res = sim.handle("GET", path, {k: str(v) for k, v in query.items()},
+                     headers={"Authorization": "JWT " + token})
+    return res.status_code, json.loads(res.content() or b"null")
+
+
+def _post(sim, token, path, body=None):
+    res = sim.handle("POST", path, body=json.dumps(body or {}),
+                     headers={"Authorization": "JWT " + token})
+    return res.status_code, json.loads(res.content() or b"null")
+
+
+def test_power_off_transitions_after_delay(clock):
+    sim = MdxSimulator(power_delay_sec=5, clock=clock)
+    vm_id = sim.add_vm("vm-0001")
+    token = sim.issue_token()
+
+    status, body = _post(sim, token, "/api/vm/{}/power_off/".format(vm_id))
+    assert status == 202
+    assert len(body["task_id"]) == 1
+
+    _, vm_list = _get(sim, token, "/api/vm/project/{}/".format(sim.project_id))
+    assert vm_list["results"][0]["status"] == "PowerON"
+    assert vm_list["results"][0]["running_tasks"]
+
+    clock.advance(5)
+    _, vm_list = _get(sim, token, "/api/vm/project/{}/".format(sim.project_id))
+    assert vm_list["results"][0]["status"] == "PowerOFF"
+    assert vm_list["results"][0]["running_tasks"] == []
+    _, history = _get(sim, token, "/api/history/project/{}/".format(sim.project_id))
+    assert history["results"][0]["status"] == "Completed"
+
+
+def test_ip_is_assigned_after_power_on(clock):
+    sim = MdxSimulator(power_delay_sec=1, ip_assign_delay_sec=2, clock=clock)
+    vm_id = sim.add_vm("vm-0001", status="PowerOFF")
+    token = sim.issue_token()
+    _post(sim, token, "/api/vm/{}/power_on/".format(vm_id), {"service_level": "spot"})
+
+    clock.advance(1)
+    _, vm_info = _get(sim, token, "/api/vm/{}/".format(vm_id))
+    assert vm_info["status"] == "PowerON"
+    assert not vm_info["service_networks"][0]["ipv4_address"]
+
+    clock.advance(2)
+    _, vm_info = _get(sim, token, "/api/vm/{}/".format(vm_id))
+    assert vm_info["service_networks"][0]["ipv4_address"]
+
+
+def test_fail_next_injects_errors_in_order():
+    sim = MdxSimulator(vm_count=1)
+    token = sim.issue_token()
+    path = "/api/vm/project/{}/".format(sim.project_id)
+    sim.fail_next(count=1, status=503, path="vm/project", retry_after=3)
+    sim.fail_next(count=1, status=DISCONNECT, path="vm/project")
+
+    res = sim.handle("GET", path, headers={"Authorization": "JWT " + token})
+    assert (res.status_code, res.headers["Retry-After"]) == (503, "3")
+    assert sim.handle("GET", path, headers={"Authorization": "JWT " + token}).status_code == \
+        DISCONNECT
+    assert _get(sim, token, path)[0] == 200
+    assert sim.get_request_counts() == {"GET /api/vm/project/{id}/": 3}
+
+
+def test_unknown_or_expired_token_is_rejected(clock):
+    sim = MdxSimulator(vm_count=1, token_ttl_sec=10, clock=clock)
+    token = sim.issue_token()
+    path = "/api/vm/project/{}/".format(sim.project_id)
+    assert _get(sim, "unknown", path)[0] == 401
+
+    clock.advance(11)
+    assert _get(sim, token, path)[0] == 401
+    # 期限切れのトークンでもリフレッシュはできる
+    res = sim.handle("POST", "/api/refresh/", body=json.dumps({"token": token}))
+    assert res.status_code == 200
+    assert _get(sim, json.loads(res.content())["token"], path)[0] == 200
+
+
+def test_pages_follow_page_size():
+    sim = MdxSimulator(vm_count=5)
+    token = sim.issue_token()
+    path = "/api/vm/project/{}/".format(sim.project_id)
+
+    _, first = _get(sim, token, path, page=1, page_size=2)
+    _, last = _get(sim, token, path, page=3, page_size=2)
+
+    assert (first["count"], len(first["results"]), first["next"]) == (5, 2, "?page=2")
+    assert (len(last["results"]), last["next"]) == (1, None)
+    assert _get(sim, token, path, page=4, page_size=2)[0] == 404
@@ -0,0 +1,51 @@
+#
+# トークンの有効期限に基づくリフレッシュ
+#
+from mdx.mdx_simulator import MdxSimulator
+
+VM_LIST = "GET /api/vm/project/{id}/"
+REFRESH = "POST /api/refresh/"
+
+
+def test_token_is_not_refreshed_before_margin(make_client):
+    sim = MdxSimulator(vm_count=1, token_ttl_sec=3600)
+    mdx = make_client(sim, token_refresh_margin_sec=300)
+    sim.reset_request_counts()
+
+    for _ in range(3):
+        mdx.get_vm_list()
+
+    assert sim.get_request_counts() == {VM_LIST: 3}
+    assert mdx.get_token_stats()["refreshes"] == 0
+
+
+def test_token_near_expiry_is_refreshed_once(make_client):
+    sim = MdxSimulator(vm_count=1, token_ttl_sec=3600)
+    mdx = make_client(sim, token_refresh_margin_sec=300)
+    # 有効期限まで margin より短いトークンに差し替える
+    sim.token_ttl_sec = 60
+    mdx._mdxlib._token = sim.issue_token()
+    sim.token_ttl_sec = 3600
+    sim.reset_request_counts()
+
+    for _ in range(3):
+        mdx.get_vm_list()
+
+    assert sim.get_request_counts() == {REFRESH: 1, VM_LIST: 3}
+    stats = mdx.get_token_stats()
+    assert (stats["refreshes"], stats["unauthorized"]) == (1, 0)
+
+
+def test_expired_token_is_refreshed_and_retried(make_client, clock):
+    sim = MdxSimulator(vm_count=2, token_ttl_sec=600, clock=clock)
+    mdx = make_client(sim)
+    # シミュレータ上でのみトークンを期限切れにし、クライアントが401を受けるようにする
+    clock.advance(601)
+    sim.reset_request_counts()
+
+    assert len(mdx.get_vm_list()) == 2
+
+    assert sim.get_request_counts() == {VM_LIST: 2, REFRESH: 1}
+    stats = mdx.get_token_stats()
+    assert stats["unauthorized"] == 1
+    assert stats["refreshes"] == 1
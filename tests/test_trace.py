@@ -0,0 +1,110 @@
+#
+# RecordingTracer によるスパンの親子関係と、途中で閉じたイテレータのスパン
+#
+import asyncio
+import threading
+
+from conftest import fast_polling_policy
+from mdx.mdx_async import AsyncMdxResourceExt
+from mdx.mdx_simulator import MdxSimulator, SimulatorServer
+from mdx.mdx_trace import RecordingTracer
+
+VM_SPEC = {"catalog": "catalog", "template_name": "template", "pack_type": "cpu", "pack_num": 1,
+           "disk_size": 40, "gpu": "0", "storage_network": "portgroup", "shared_key": "key"}
+
+
+def _record_threads(mdxlib, name, threads):
+    # 呼び出されたスレッドを記録する
+    method = getattr(mdxlib, name)
+
+    def recording(*args, **kwargs):
+        threads.add(threading.get_ident())
+        return method(*args, **kwargs)
+
+    setattr(mdxlib, name, recording)
+
+
+def test_deploy_vm_spans_are_nested_across_threads(make_client):
+    sim = MdxSimulator(deploy_delay_sec=0.05, ip_assign_delay_sec=0.05)
+    tracer = RecordingTracer()
+    mdx = make_client(sim, tracer=tracer)
+    vm_spec = dict(VM_SPEC, network_adapters=[{"adapter_number": 1,
+                                               "segment": mdx.get_segments()[0]["uuid"]}])
+    history_threads = set()
+    vm_info_threads = set()
+    _record_threads(mdx._mdxlib, "get_vm_history", history_threads)
+    _record_threads(mdx._mdxlib, "get_vm_info", vm_info_threads)
+    tracer.clear()
+
+    mdx.deploy_vm("vm-[1-3]", vm_spec)
+
+    spans = tracer.get_spans()
+    by_name = {}
+    for span in spans:
+        by_name.setdefault(span["name"], []).append(span)
+    root, = by_name["mdx.deploy_vm"]
+    correlation, = by_name["mdx.task_correlation"]
+    assert root["parent_id"] is None
+    assert len(set(span["span_id"] for span in spans)) == len(spans)
+    assert correlation["parent_id"] == root["span_id"]
+    # タスクの対応付けで並列に取得した操作履歴も、対応付けのスパンの子になる
+    assert history_threads and threading.get_ident() not in history_threads
+    histories = by_name["GET /api/history/vm/{id}/"]
+    assert len(histories) == 3
+    assert all(span["parent_id"] == correlation["span_id"] for span in histories)
+    waits = by_name["mdx.wait deploy"] + by_name["mdx.wait ip_assign"]
+    assert len(waits) == 6
+    assert all(span["parent_id"] == root["span_id"] for span in waits)
+    # 待ち合わせで並列に取得した仮想マシンの詳細も、デプロイのスパンの子になる
+    assert vm_info_threads and threading.get_ident() not in vm_info_threads
+    assert all(span["parent_id"] == root["span_id"] for span in by_name["GET /api/vm/{id}/"])
+    assert all(span["parent_id"] in (root["span_id"], correlation["span_id"])
+               for span in by_name["GET /api/vm/project/{id}/"])
+    # 子スパンは親スパンの期間に含まれる
+    assert all(root["start"] <= span["start"] and span["end"] <= root["end"]
+               for span in spans if span is not root)
+
+
+def test_closed_vm_info_iter_ends_span(make_client):
+    sim = MdxSimulator(vm_count=250)
+    tracer = RecordingTracer()
+    mdx = make_client(sim, tracer=tracer)
+    tracer.clear()
+
+    vm_infos = mdx.vm_info_iter()
+    assert next(vm_infos)["name"] == "vm-0001"
+    assert [span["name"] for span in tracer.get_spans()] == ["GET /api/vm/project/{id}/"]
+    vm_infos.close()
+
+    span, = [span for span in tracer.get_spans() if span["name"] == "mdx.vm_info_iter"]
+    assert span["attributes"]["mdx.items"] == 1
+    assert span["error"] is None
+    requests = [s for s in tracer.get_spans() if s["name"] == "GET /api/vm/project/{id}/"]
+    assert requests
+    assert all(s["parent_id"] == span["span_id"] for s in requests)
+
+
+def test_closed_async_vm_info_iter_ends_span():
+    sim = MdxSimulator(vm_count=250)
+    tracer = RecordingTracer()
+
+    async def read_first():
+        async with AsyncMdxResourceExt(sim.issue_token(), endpoint=server.endpoint,
+                                       polling_policy=fast_polling_policy(),
+                                       tracer=tracer) as mdx:
+            await mdx.set_current_project_by_name(sim.project_name)
+            tracer.clear()
+            vm_infos = mdx.vm_info_iter()
+            async for vm_info in vm_infos:
+                break
+            await vm_infos.aclose()
+            return vm_info
+
+    with SimulatorServer(sim) as server:
+        assert asyncio.run(read_first())["name"] == "vm-0001"
+
+    span, = [span for span in tracer.get_spans() if span["name"] == "mdx.vm_info_iter"]
+    assert span["attributes"]["mdx.items"] == 1
+    requests = [s for s in tracer.get_spans() if s["name"] == "GET /api/vm/project/{id}/"]
+    assert requests
+    assert all(s["parent_id"] == span["span_id"] for s in requests)
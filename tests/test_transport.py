@@ -0,0 +1,100 @@
+#
+# MdxLib の再試行、要求レートの制限、コネクションの再利用
+#
+import time
+
+import pytest
+
+from mdx.mdx_ext import MdxResourceExt
+from mdx.mdx_lib import RetryPolicy, TokenBucketRateLimiter
+from mdx.mdx_simulator import DISCONNECT, MdxSimulator, SimulatorServer
+
+VM_LIST = "GET /api/vm/project/{id}/"
+
+
+def test_retry_after_is_honoured(make_client):
+    sim = MdxSimulator(vm_count=3)
+    mdx = make_client(sim, retry_policy=RetryPolicy(max_attempts=3, initial_backoff_sec=5))
+    sim.reset_request_counts()
+    sim.fail_next(count=2, status=503, method="GET", path="vm/project", retry_after=0.05)
+
+    assert len(mdx.get_vm_list()) == 3
+
+    assert sim.get_request_counts()[VM_LIST] == 3
+    metrics = mdx.get_metrics()
+    # 既定の待ち時間 (5秒) ではなく Retry-After の時間だけ待つ
+    assert metrics["waits"]["retry"]["count"] == 2
+    assert metrics["waits"]["retry"]["sleep_sec"] == pytest.approx(0.1)
+    assert [r["reason"] for r in metrics["retries"]] == ["503"]
+
+
+def test_post_is_not_retried_on_server_error(make_client):
+    sim = MdxSimulator(vm_count=1)
+    mdx = make_client(sim, retry_policy=RetryPolicy(max_attempts=3, initial_backoff_sec=0.01))
+    sim.reset_request_counts()
+    sim.fail_next(count=1, status=503, method="POST", path="power_off")
+
+    result = mdx.power_off_vms(["vm-0001"])
+
+    assert result["vm-0001"]["result"] == "failed"
+    assert result["vm-0001"]["error"].status_code == 503
+    assert sim.get_request_counts()["POST /api/vm/{id}/power_off/"] == 1
+
+
+def test_connection_error_is_retried_for_get(make_client):
+    sim = MdxSimulator(vm_count=1)
+    mdx = make_client(sim, retry_policy=RetryPolicy(max_attempts=2, initial_backoff_sec=0.01))
+    sim.reset_request_counts()
+    sim.fail_next(count=1, status=DISCONNECT, method="GET", path="vm/project")
+
+    assert len(mdx.get_vm_list()) == 1
+
+    assert sim.get_request_counts()[VM_LIST] == 2
+    assert [r["reason"] for r in mdx.get_metrics()["retries"]] == ["ConnectionError"]
+
+
+def test_rate_limiter_spaces_requests(make_client):
+    sim = MdxSimulator(vm_count=1)
+    mdx = make_client(sim, rate_limiter=TokenBucketRateLimiter(rate_per_sec=50, burst=1))
+    # プロジェクトの選択で消費したトークンが補充されるまで待つ
+    time.sleep(0.05)
+    mdx.metrics.reset()
+
+    started = time.monotonic()
+    for _ in range(6):
+        mdx.get_vm_list()
+
+    # 最初の要求以外は 1/50 秒ずつ待つ
+    assert time.monotonic() - started >= 0.09
+    waits = mdx.get_metrics()["waits"]["rate_limit"]
+    assert waits["count"] == 5
+
+
+def _count_connections(httpd):
+    # サーバが受け付けたTCP接続を数える
+    accepted = []
+    get_request = httpd.get_request
+
+    def counting_get_request():
+        request = get_request()
+        accepted.append(request[1])
+        return request
+
+    httpd.get_request = counting_get_request
+    return accepted
+
+
+@pytest.mark.parametrize("keep_alive", [True, False])
+def test_pooled_session_reuses_connection(keep_alive):
+    sim = MdxSimulator(vm_count=2)
+    server = SimulatorServer(sim)
+    accepted = _count_connections(server.start())
+    try:
+        with MdxResourceExt(sim.issue_token(), endpoint=server.endpoint,
+                            keep_alive=keep_alive) as mdx:
+            mdx.set_current_project_by_name(sim.project_name)
+            for _ in range(10):
+                mdx.get_vm_list()
+    finally:
+        server.stop()
+    assert len(accepted) == (1 if keep_alive else 11)
@@ -0,0 +1,95 @@
+#
+# SpecValidatorRegistry による仕様の検証
+#
+import jsonschema
+import pytest
+
+from mdx.mdx_simulator import MdxSimulator
+from mdx.mdx_validate import SpecValidatorRegistry, validate_spec, validate_specs
+
+ACL_IPV4 = {"segment": "segment", "src_address": "192.0.2.1", "src_mask": "32", "src_port": "any",
+            "dst_address": "10.0.0.1", "dst_mask": 32, "dst_port": "22", "protocol": "TCP"}
+ACL_IPV6 = dict(ACL_IPV4, src_address="2001:db8::1", dst_address="fd00::1")
+
+
+def test_valid_specs_pass():
+    validate_spec("acl_ipv4", ACL_IPV4)
+    validate_spec("acl_ipv6", ACL_IPV6)
+    # 編集ではセグメントを指定しない
+    validate_spec("acl_ipv4_edit", {k: v for k, v in ACL_IPV4.items() if k != "segment"})
+
+
+@pytest.mark.parametrize("kind,address", [
+    ("acl_ipv4", "2001:db8::1"),
+    ("acl_ipv4", "192.0.2.256"),
+    ("acl_ipv6", "192.0.2.1"),
+    ("acl_ipv6", "2001:db8::g"),
+])
+def test_address_format_is_checked(kind, address):
+    spec = dict(ACL_IPV4 if kind == "acl_ipv4" else ACL_IPV6, src_address=address)
+    with pytest.raises(jsonschema.ValidationError) as e:
+        validate_spec(kind, spec)
+    assert list(e.value.absolute_path) == ["src_address"]
+
+
+def test_best_match_error_is_raised():
+    # 複数の誤りのうち、jsonschema が最も関連の深いものと判断したエラーを送出する
+    spec = dict(ACL_IPV4, src_address="not an address", dst_mask=[32])
+    del spec["protocol"]
+    registry = SpecValidatorRegistry()
+    expected = jsonschema.exceptions.best_match(registry.validator("acl_ipv4").iter_errors(spec))
+
+    with pytest.raises(jsonschema.ValidationError) as e:
+        registry.validate("acl_ipv4", spec)
+
+    assert (e.value.message, list(e.value.absolute_path)) == \
+        (expected.message, list(expected.absolute_path))
+
+
+def test_validator_is_cached_until_reregistered():
+    registry = SpecValidatorRegistry()
+    validator = registry.validator("dnat")
+    assert registry.validator("dnat") is validator
+
+    registry.register("dnat", {"type": "object", "required": ["segment"]})
+
+    assert registry.validator("dnat") is not validator
+    registry.validate("dnat", {"segment": "segment"})
+    with pytest.raises(KeyError):
+        registry.validator("unknown")
+
+
+def test_registry_schemas_override_defaults():
+    registry = SpecValidatorRegistry({"custom": {"type": "integer"}})
+    assert "custom" in registry.kinds()
+    assert "dnat" in registry.kinds()
+    with pytest.raises(jsonschema.ValidationError):
+        registry.validate("custom", "1")
+
+
+def test_validate_many_reports_errors_per_index():
+    specs = [
+        {"pool_address": "192.0.2.10", "segment": "segment", "dst_address": "10.0.0.1"},
+        {"pool_address": "2001:db8::1", "segment": "segment"},
+        {"pool_address": "192.0.2.11", "segment": "segment", "dst_address": "10.0.0.2"},
+        {"pool_address": "192.0.2.12", "segment": 1, "dst_address": "10.0.0.256"},
+    ]
+
+    invalid = validate_specs("dnat", specs)
+
+    assert [entry["index"] for entry in invalid] == [1, 3]
+    # エラーは項目のパス順に並ぶ。必須項目の欠落はパスが空になる
+    assert [error["path"] for error in invalid[0]["errors"]] == ["", "pool_address"]
+    assert [error["path"] for error in invalid[1]["errors"]] == ["dst_address", "segment"]
+    assert validate_specs("dnat", specs[::2]) == []
+
+
+def test_invalid_acl_is_rejected_before_request(make_client):
+    sim = MdxSimulator(vm_count=1)
+    mdx = make_client(sim)
+    sim.reset_request_counts()
+
+    with pytest.raises(jsonschema.ValidationError):
+        mdx.add_allow_acl_ipv4_info(dict(ACL_IPV4, src_address="2001:db8::1"))
+
+    assert sim.get_request_counts() == {}
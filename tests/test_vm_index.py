@@ -0,0 +1,102 @@
+#
+# 仮想マシン名→仮想マシンIDの索引 (VmNameIndex) の有効期間、作り直し、古い仮想マシンIDの検出
+#
+import types
+
+import pytest
+
+from mdx import mdx_ext
+from mdx.mdx_ext import VmNameIndex
+from mdx.mdx_simulator import MdxSimulator
+
+VM_LIST = "GET /api/vm/project/{id}/"
+VM_INFO = "GET /api/vm/{id}/"
+
+
+def test_index_expires_after_ttl(monkeypatch, clock):
+    monkeypatch.setattr(mdx_ext, "time", types.SimpleNamespace(monotonic=clock))
+    index = VmNameIndex(ttl_sec=60)
+    assert index.get("vm-0001") is None
+
+    index.rebuild([{"name": "vm-0001", "uuid": "a"}, {"name": "vm-0001", "uuid": "b"}])
+    # 同名の仮想マシンは一覧で先に現れたものを採用する
+    assert index.get("vm-0001") == "a"
+
+    clock.advance(59)
+    assert index.get("vm-0001") == "a"
+    clock.advance(1)
+    assert index.get("vm-0001") is None
+
+
+def test_names_are_resolved_from_index(make_client):
+    sim = MdxSimulator(vm_count=3)
+    mdx = make_client(sim)
+    sim.reset_request_counts()
+
+    for name in ("vm-0001", "vm-0002", "vm-0003", "vm-0001"):
+        assert mdx.get_vm_info(name)["name"] == name
+
+    assert sim.get_request_counts() == {VM_LIST: 1, VM_INFO: 4}
+
+
+def test_zero_ttl_disables_index(make_client):
+    sim = MdxSimulator(vm_count=1)
+    mdx = make_client(sim, vm_index_ttl_sec=0)
+    sim.reset_request_counts()
+
+    mdx.get_vm_info("vm-0001")
+    mdx.get_vm_info("vm-0001")
+
+    assert sim.get_request_counts() == {VM_LIST: 2, VM_INFO: 2}
+
+
+def test_index_is_rebuilt_after_miss(make_client):
+    sim = MdxSimulator(vm_count=1)
+    mdx = make_client(sim)
+    mdx.get_vm_info("vm-0001")
+    # 索引の作成後に追加された仮想マシン
+    vm_id = sim.add_vm("vm-0002")
+    sim.reset_request_counts()
+
+    assert mdx.get_vm_info("vm-0002")["name"] == "vm-0002"
+    assert mdx.get_vm_info("missing") is None
+
+    assert sim.get_request_counts() == {VM_LIST: 2, VM_INFO: 1}
+    assert mdx._vm_index.get("vm-0002") == vm_id
+
+
+def test_deleted_vm_falls_back_to_fresh_lookup(make_client):
+    sim = MdxSimulator(vm_count=1)
+    mdx = make_client(sim)
+    mdx.get_vm_info("vm-0001")
+    # 索引の作成後に他のクライアントで削除され、同じ名前で作り直された
+    sim.remove_vm(mdx._vm_index.get("vm-0001"))
+    new_vm_id = sim.add_vm("vm-0001", status="PowerOFF")
+    sim.reset_request_counts()
+
+    mdx.power_on_vm("vm-0001")
+
+    assert mdx._vm_index.get("vm-0001") == new_vm_id
+    assert mdx.get_vm_info("vm-0001")["status"] == "PowerON"
+    counts = sim.get_request_counts()
+    assert counts[VM_LIST] == 1
+    assert counts["POST /api/vm/{id}/power_on/"] == 1
+
+
+def test_renamed_vm_is_not_operated(make_client):
+    sim = MdxSimulator(vm_count=2)
+    mdx = make_client(sim)
+    mdx.get_vm_info("vm-0001")
+    old_vm_id = mdx._vm_index.get("vm-0001")
+    sim.rename_vm(old_vm_id, "renamed")
+    sim.reset_request_counts()
+
+    # 索引の仮想マシンIDは別の名前の仮想マシンのものになっているため、操作せずに見つからないとする
+    with pytest.raises(Exception, match="vm vm-0001 is not found"):
+        mdx.power_off_vm("vm-0001")
+    assert mdx.get_vm_info("renamed")["status"] == "PowerON"
+    assert sim.get_request_counts().get("POST /api/vm/{id}/power_off/", 0) == 0
+
+    sim.rename_vm(mdx._vm_index.get("vm-0002"), "vm-0001")
+    assert mdx.get_vm_info("vm-0001")["name"] == "vm-0001"
+    assert mdx._vm_index.get("vm-0001") != old_vm_id
@@ -0,0 +1,108 @@
+#
+# VmStateWaiter の仮想マシン一覧と詳細情報による状態の確認
+#
+from conftest import fast_polling_policy
+from mdx.mdx_simulator import MdxSimulator
+from mdx.mdx_wait import LIST_POLLING_THRESHOLD, VM_NOT_FOUND
+
+VM_LIST = "GET /api/vm/project/{id}/"
+VM_INFO = "GET /api/vm/{id}/"
+
+
+def _power_off_and_wait(mdx, sim, vm_ids, **watch_options):
+    waiter = mdx.create_state_waiter()
+    futures = []
+    for vm_id in vm_ids:
+        mdx._mdxlib.power_off_vm(vm_id)
+        futures.append(waiter.watch(vm_id, "PowerOFF", **watch_options))
+    sim.reset_request_counts()
+    waiter.run()
+    return [future.result() for future in futures]
+
+
+def test_single_vm_is_polled_with_vm_info(make_client):
+    sim = MdxSimulator(power_delay_sec=0.05)
+    vm_ids = [sim.add_vm("vm-0001")]
+    mdx = make_client(sim)
+
+    results = _power_off_and_wait(mdx, sim, vm_ids)
+
+    assert [r["status"] for r in results] == ["PowerOFF"]
+    counts = sim.get_request_counts()
+    assert counts.get(VM_LIST, 0) == 0
+    assert counts[VM_INFO] >= 1
+
+
+def test_vms_over_threshold_are_polled_with_vm_list(make_client):
+    sim = MdxSimulator(power_delay_sec=0.02)
+    vm_ids = [sim.add_vm("vm-{:04d}".format(i + 1)) for i in range(LIST_POLLING_THRESHOLD + 3)]
+    # 最初の確認までに全ての仮想マシンの操作を完了させ、1回の一覧の取得で全て確認できるようにする
+    mdx = make_client(sim, polling_policy=fast_polling_policy(interval_sec=0.2))
+
+    results = _power_off_and_wait(mdx, sim, vm_ids)
+
+    assert [r["status"] for r in results] == ["PowerOFF"] * len(vm_ids)
+    assert sim.get_request_counts() == {VM_LIST: 1}
+
+
+def test_last_pending_vm_is_polled_with_vm_info(make_client):
+    sim = MdxSimulator(power_delay_sec=0.3)
+    vm_ids = [sim.add_vm("vm-0001"), sim.add_vm("vm-0002")]
+    mdx = make_client(sim, polling_policy=fast_polling_policy(interval_sec=0.2))
+    waiter = mdx.create_state_waiter()
+    mdx._mdxlib.power_off_vm(vm_ids[0])
+    first = waiter.watch(vm_ids[0], "PowerOFF")
+    # vm-0002 は既に PowerON のため1回目の一覧の取得で完了し、残った vm-0001 は詳細情報で確認する
+    second = waiter.watch(vm_ids[1], "PowerON")
+    sim.reset_request_counts()
+
+    waiter.run()
+
+    assert first.result()["status"] == "PowerOFF"
+    assert second.result()["status"] == "PowerON"
+    assert sim.get_request_counts() == {VM_LIST: 1, VM_INFO: 1}
+
+
+def test_detail_watch_fetches_vm_info_after_list(make_client):
+    sim = MdxSimulator(power_delay_sec=0.02)
+    vm_ids = [sim.add_vm("vm-0001"), sim.add_vm("vm-0002")]
+    mdx = make_client(sim, polling_policy=fast_polling_policy(interval_sec=0.2))
+
+    results = _power_off_and_wait(mdx, sim, vm_ids, detail=True)
+
+    # 詳細情報は状態に達した後に1台につき1回だけ取得する
+    assert [r["name"] for r in results] == ["vm-0001", "vm-0002"]
+    assert all("service_networks" in r for r in results)
+    assert sim.get_request_counts() == {VM_LIST: 1, VM_INFO: len(vm_ids)}
+
+
+def test_destroyed_vm_reaches_not_found(make_client):
+    sim = MdxSimulator(destroy_delay_sec=0.05)
+    vm_ids = [sim.add_vm("vm-{:04d}".format(i + 1), status="PowerOFF") for i in range(3)]
+    mdx = make_client(sim)
+    waiter = mdx.create_state_waiter()
+    futures = []
+    for vm_id in vm_ids:
+        mdx._mdxlib.destroy_vm(vm_id)
+        futures.append(waiter.watch(vm_id, VM_NOT_FOUND))
+
+    waiter.run()
+
+    assert [future.result() for future in futures] == [None] * len(vm_ids)
+
+
+def test_vm_info_error_fails_only_that_watch(make_client):
+    sim = MdxSimulator(power_delay_sec=0.02)
+    vm_ids = [sim.add_vm("vm-0001"), sim.add_vm("vm-0002")]
+    mdx = make_client(sim, polling_policy=fast_polling_policy(interval_sec=0.2))
+    sim.fail_next(count=10, status=403, method="GET", path="/api/vm/{}/$".format(vm_ids[1]))
+    waiter = mdx.create_state_waiter()
+    futures = []
+    for vm_id in vm_ids:
+        mdx._mdxlib.power_off_vm(vm_id)
+        futures.append(waiter.watch(vm_id, "PowerOFF", detail=True))
+
+    waiter.run()
+
+    assert futures[0].result()["name"] == "vm-0001"
+    assert futures[1].exception().status_code == 403